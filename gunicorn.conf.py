@@ -0,0 +1,108 @@
+import math
+import os
+import shutil
+import tempfile
+
+# Запуск в продакшене: gunicorn -c gunicorn.conf.py
+# SERVER_MODE=wsgi (по умолчанию) - потоковые воркеры gthread для referral_system.wsgi,
+# SERVER_MODE=asgi - воркеры uvicorn для referral_system.asgi (асинхронные эндпоинты /api/async/).
+# Количество воркеров и потоков считается по доступным процессору ядрам, его можно задать явно
+# переменными WEB_CONCURRENCY и GUNICORN_THREADS
+
+# Под gunicorn DEBUG выключен, если не включен явно: с DEBUG Django копит все SQL-запросы
+# в connection.queries, и память воркера растет с каждым запросом
+os.environ.setdefault('DEBUG', '0')
+
+
+def cpu_count():
+    # Ядра, доступные процессу: с учетом привязки к ядрам и квоты CPU контейнера (cgroup v2)
+    count = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            count = min(count, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return count
+
+
+server_mode = os.getenv('SERVER_MODE', 'wsgi')
+cores = cpu_count()
+
+if server_mode == 'asgi':
+    wsgi_app = 'referral_system.asgi:application'
+    worker_class = 'uvicorn_worker.UvicornWorker'
+    # Асинхронный воркер занимает ядро целиком, лишние воркеры только делят его
+    workers = int(os.getenv('WEB_CONCURRENCY', cores))
+else:
+    wsgi_app = 'referral_system.wsgi:application'
+    worker_class = 'gthread'
+    # Запросы короткие и большую часть времени ждут БД и кэш: воркеров по два на ядро,
+    # в каждом несколько потоков. Каждый поток держит свое соединение с БД (DB_CONN_MAX_AGE)
+    workers = int(os.getenv('WEB_CONCURRENCY', cores * 2 + 1))
+    threads = int(os.getenv('GUNICORN_THREADS', '4'))
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+
+# Приложение загружается один раз в мастер-процессе до fork: воркеры стартуют быстрее
+# и делят неизменяемую память. Соединения с БД при импорте не открываются
+preload_app = True
+
+# Воркер перезапускается после max_requests запросов (со случайным разбросом, чтобы
+# воркеры не перезапускались одновременно): накопления в памяти процесса не растут бесконечно
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '2000'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', '200'))
+
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '30'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '5'))
+
+
+# Heartbeat воркеров в памяти, а не на диске контейнера
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+# Метрики каждого воркера в памяти его процесса. Воркеры раз в секунду пишут их в общий каталог,
+# и /api/metrics/ в любом воркере отдает сумму по всем (см. users/metrics.py)
+metrics_dir = os.getenv('METRICS_DIR') or os.path.join(worker_tmp_dir or tempfile.gettempdir(), 'referral-metrics')
+
+
+def post_fork(server, worker):
+    from users.metrics import registry
+    registry.enable_multiprocess(metrics_dir)
+
+
+def worker_exit(server, worker):
+    # Коды, стоящие в очереди отправки, досылаются до выхода воркера (перезапуск по max_requests, SIGTERM),
+    # затем метрики воркера переносятся в архив каталога метрик
+    from users.delivery import dispatcher
+    from users.metrics import registry
+    dispatcher.stop()
+    registry.close_process()
+
+# Каждый запрос и так пишется в лог users.metrics, access log gunicorn по умолчанию выключен
+accesslog = os.getenv('GUNICORN_ACCESS_LOG') or None
+errorlog = '-'
+
+
+# Кэши со значением locmem живут в памяти каждого воркера: счетчики, версии профилей, рейтинг
+# и лимиты запросов у воркеров расходятся и сбрасываются при перезапуске. Значения по умолчанию
+# как в settings.py
+LOCAL_CACHE_DEFAULTS = {
+    'CACHE_BACKEND': 'locmem',
+    'CODES_CACHE_BACKEND': 'db',
+    'THROTTLE_CACHE_BACKEND': 'locmem',
+    'SESSIONS_CACHE_BACKEND': 'locmem',
+}
+
+
+def on_starting(server):
+    # Метрики прошлого запуска сервера не смешиваются с новыми
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+
+    local = [name for name, default in LOCAL_CACHE_DEFAULTS.items() if os.getenv(name, default) == 'locmem']
+    if workers > 1 and local:
+        server.log.warning(
+            'Воркеров %s, но кэши в памяти процесса (%s=locmem): данные кэша у воркеров не общие, '
+            'задайте redis (REDIS_URL)', workers, ', '.join(local)
+        )
@@ -1,18 +1,24 @@
+import importlib.util
 import os
 from datetime import timedelta
 from pathlib import Path
+
 import dotenv
-import users
+from django.core.exceptions import ImproperlyConfigured
 
+# SECRET_KEY, VM_IP и остальные настройки развертывания берутся из .env
 dotenv.load_dotenv()
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 SECRET_KEY = os.getenv('SECRET_KEY')
 
-DEBUG = True
+# Для локальной разработки DEBUG включен. gunicorn.conf.py выключает его, если DEBUG не задан явно
+DEBUG = os.getenv('DEBUG', '1').lower() in ('1', 'true', 'yes')
 
 ALLOWED_HOSTS = ['34.133.84.90', 'localhost', '127.0.0.1']
+# Дополнительные хосты через запятую, например домен продакшена
+ALLOWED_HOSTS += [host.strip() for host in os.getenv('ALLOWED_HOSTS', '').split(',') if host.strip()]
 
 INSTALLED_APPS = [
     'django.contrib.auth',
@@ -23,32 +29,196 @@ INSTALLED_APPS = [
 
     'rest_framework',
     'rest_framework_simplejwt',
-    'drf_spectacular',
-    'drf_spectacular_sidecar',
 
     'users',
 ]
 
+# Документация API (drf-spectacular, requirements-docs.txt) необязательна. По умолчанию она включена
+# только с DEBUG: без нее воркер не загружает drf-spectacular при старте, а /api/schema/ отдает
+# схему, заранее сгенерированную в API_SCHEMA_FILE командой manage.py spectacular
+API_DOCS = (
+    os.getenv('API_DOCS', '1' if DEBUG else '0').lower() in ('1', 'true', 'yes')
+    and importlib.util.find_spec('drf_spectacular') is not None
+)
+API_SCHEMA_FILE = os.getenv('API_SCHEMA_FILE', os.path.join(BASE_DIR, 'openapi-schema.yml'))
+if API_DOCS:
+    INSTALLED_APPS += ['drf_spectacular']
+# Файлы Redoc для /api/schema/redoc/ собираются collectstatic, импорта при старте они не требуют
+if importlib.util.find_spec('drf_spectacular_sidecar') is not None:
+    INSTALLED_APPS += ['drf_spectacular_sidecar']
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.ClaimsJWTAuthentication',
     ),
-    'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    # Лимиты '<scope>_phone' считаются по номеру телефона, '<scope>_ip' - по IP клиента.
+    # Переопределяются переменными окружения THROTTLE_<SCOPE>, например THROTTLE_VERIFY_CODE_PHONE=5/10m
+    'DEFAULT_THROTTLE_RATES': {
+        scope: os.getenv(f'THROTTLE_{scope.upper()}', rate)
+        for scope, rate in {
+            'request_code_phone': '5/h',
+            'request_code_ip': '60/m',
+            'verify_code_phone': '10/h',
+            'verify_code_ip': '120/m',
+        }.items()
+    },
+    # Количество прокси перед приложением, по нему IP клиента берется из X-Forwarded-For
+    'NUM_PROXIES': int(os.environ['NUM_PROXIES']) if os.getenv('NUM_PROXIES') else None,
 }
 
+# Бэкенды кэша: locmem - в памяти процесса, db - таблица в БД (создается командой createcachetable),
+# file - файлы в CACHE_DIR, redis - Redis-совместимый сервер по адресу REDIS_URL
+CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'db': 'django.core.cache.backends.db.DatabaseCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'redis': 'django.core.cache.backends.redis.RedisCache',
+}
+CACHE_DIR = os.getenv('CACHE_DIR', os.path.join(BASE_DIR, '.cache'))
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+
+
+# Предел количества записей для кэшей locmem, db и file, по умолчанию у Django он 300, и при превышении
+# часть записей удаляется. Задается общим CACHE_MAX_ENTRIES или для кэша отдельно (CODES_CACHE_MAX_ENTRIES и т.п.)
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', '100000'))
+
+
+def cache_max_entries(prefix):
+    return int(os.getenv(f'{prefix}_CACHE_MAX_ENTRIES', CACHE_MAX_ENTRIES))
+
+
+def cache_config(backend, name, max_entries=CACHE_MAX_ENTRIES):
+    location = {
+        'locmem': name,
+        'db': f'cache_{name.replace("-", "_")}',
+        'file': os.path.join(CACHE_DIR, name),
+        'redis': REDIS_URL,
+    }[backend]
+    config = {'BACKEND': CACHE_BACKENDS[backend], 'LOCATION': location, 'KEY_PREFIX': name}
+    # Redis вытесняет записи сам, остальные бэкенды по умолчанию держат не больше 300 записей
+    if max_entries and backend != 'redis':
+        config['OPTIONS'] = {'MAX_ENTRIES': max_entries}
+    return config
+
+
+# Коды подтверждения хранятся в отдельном кэше, общем для всех воркеров и серверов
+CODES_CACHE_ALIAS = 'codes'
+
+# Счетчики ограничения частоты запросов. Кэш должен поддерживать атомарный incr (locmem, redis),
+# чтобы лимит был общим для всех воркеров, в продакшене нужен redis
+THROTTLE_CACHE_ALIAS = 'throttle'
+
+# Сессии веб-интерфейса при SESSION_BACKEND=cache
+SESSIONS_CACHE_ALIAS = 'sessions'
+
 CACHES = {
-    "default": {
-        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
-        "LOCATION": "auth-cache",
-    }
+    'default': cache_config(os.getenv('CACHE_BACKEND', 'locmem'), 'auth-cache'),
+    CODES_CACHE_ALIAS: cache_config(os.getenv('CODES_CACHE_BACKEND', 'db'), 'codes', cache_max_entries('CODES')),
+    THROTTLE_CACHE_ALIAS: cache_config(
+        os.getenv('THROTTLE_CACHE_BACKEND', 'locmem'), 'throttle', cache_max_entries('THROTTLE')
+    ),
+    SESSIONS_CACHE_ALIAS: cache_config(
+        os.getenv('SESSIONS_CACHE_BACKEND', 'locmem'), 'sessions', cache_max_entries('SESSIONS')
+    ),
+}
+
+# Хранилище сессий веб-интерфейса. В сессии только номер телефона и id пользователя, поэтому
+# по умолчанию она целиком хранится в подписанной cookie и не требует запросов к БД.
+# cache - в кэше SESSIONS_CACHE_ALIAS (для нескольких воркеров нужен redis),
+# db и cached_db - в таблице django_session, устаревшие строки удаляет команда purge_db_sessions
+SESSION_ENGINES = {
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+    'cache': 'django.contrib.sessions.backends.cache',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'db': 'django.contrib.sessions.backends.db',
+}
+SESSION_ENGINE = SESSION_ENGINES[os.getenv('SESSION_BACKEND', 'signed_cookies')]
+SESSION_CACHE_ALIAS = SESSIONS_CACHE_ALIAS
+SESSION_COOKIE_AGE = int(os.getenv('SESSION_COOKIE_AGE', str(14 * 24 * 3600)))
+SESSION_COOKIE_HTTPONLY = True
+
+
+# Токены внутренних сервисов для пакетных эндпоинтов: 'billing:<токен>,rewards:<токен>'.
+# Элемент без ':', без имени или без токена - ошибка конфигурации при старте
+def service_tokens(value):
+    tokens = {}
+    for number, item in enumerate(value.split(','), 1):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, token = item.partition(':')
+        if not name or not token:
+            # Сам элемент может оказаться токеном, поэтому в ошибке только его номер и начало
+            raise ImproperlyConfigured(
+                f'SERVICE_TOKENS: элемент {number} ({item[:4]}...) должен иметь вид <сервис>:<токен>'
+            )
+        tokens[name] = token
+    return tokens
+
+
+SERVICE_TOKENS = service_tokens(os.getenv('SERVICE_TOKENS', ''))
+
+# Сколько пользователей можно запросить одним пакетным запросом профилей
+BATCH_PROFILES_MAX_SIZE = int(os.getenv('BATCH_PROFILES_MAX_SIZE', '1000'))
+
+# Пользователь веб-интерфейса загружается из кэша в памяти процесса, как и для токенов без claims
+AUTHENTICATION_BACKENDS = ['users.authentication.CachedModelBackend']
+
+# Хранилище кодов подтверждения (см. users/otp.py): memory - в памяти процесса (только для разработки),
+# cache - в кэше CODES_CACHE_ALIAS (лимит попыток атомарен только с бэкендом redis или locmem в одном процессе),
+# db - в таблице users_onetimecode, redis - Redis-совместимый сервер
+OTP_STORES = {
+    'memory': 'users.otp.MemoryOTPStore',
+    'cache': 'users.otp.CacheOTPStore',
+    'db': 'users.otp.DatabaseOTPStore',
+    'redis': 'users.otp.RedisOTPStore',
 }
+OTP_STORE = OTP_STORES[os.getenv('OTP_STORE', 'db')]
+OTP_REDIS_URL = os.getenv('OTP_REDIS_URL', REDIS_URL)
+# Время жизни кода в секундах и количество неверных попыток, после которых код блокируется
+OTP_TTL = int(os.getenv('OTP_TTL', '300'))
+OTP_MAX_ATTEMPTS = int(os.getenv('OTP_MAX_ATTEMPTS', '5'))
+
+# Отправка кодов подтверждения
+SMS_BACKEND = os.getenv('SMS_BACKEND', 'users.delivery.DummySmsBackend')
+SMS_BACKEND_LATENCY = float(os.getenv('SMS_BACKEND_LATENCY', '2'))
+CODE_DELIVERY_WORKERS = int(os.getenv('CODE_DELIVERY_WORKERS', '4'))
+CODE_DELIVERY_QUEUE_SIZE = int(os.getenv('CODE_DELIVERY_QUEUE_SIZE', '1000'))
+# Сколько секунд при завершении воркера ждать отправки кодов из очереди, должно быть меньше GUNICORN_GRACEFUL_TIMEOUT
+CODE_DELIVERY_DRAIN_TIMEOUT = float(os.getenv('CODE_DELIVERY_DRAIN_TIMEOUT', '10'))
+
+# Размер страницы списка рефералов
+REFERRALS_PAGE_SIZE = int(os.getenv('REFERRALS_PAGE_SIZE', '50'))
+REFERRALS_MAX_PAGE_SIZE = int(os.getenv('REFERRALS_MAX_PAGE_SIZE', '500'))
+
+# Сколько инвайт-кодов воркер арендует за одно обращение к БД
+INVITE_CODE_BLOCK_SIZE = int(os.getenv('INVITE_CODE_BLOCK_SIZE', '1000'))
+
+# Время жизни кэшированных счетчиков и списков рефералов
+REFERRAL_CACHE_TIMEOUT = int(os.getenv('REFERRAL_CACHE_TIMEOUT', '86400'))
+
+# Многоуровневая реферальная сеть: максимальная глубина запроса и материализованные пути.
+# Перед включением REFERRAL_PATHS_ENABLED пути нужно построить командой rebuild_referral_paths
+REFERRAL_TREE_MAX_DEPTH = int(os.getenv('REFERRAL_TREE_MAX_DEPTH', '10'))
+REFERRAL_PATHS_ENABLED = os.getenv('REFERRAL_PATHS_ENABLED', '').lower() in ('1', 'true', 'yes')
+
+# Рейтинг пригласивших: размер топа, время жизни топа в кэше (после него топ перестраивается
+# по БД) и сколько дней хранятся рейтинги за прошедшие дни и недели
+LEADERBOARD_SIZE = int(os.getenv('LEADERBOARD_SIZE', '100'))
+LEADERBOARD_CACHE_TIMEOUT = int(os.getenv('LEADERBOARD_CACHE_TIMEOUT', '60'))
+LEADERBOARD_RETENTION_DAYS = int(os.getenv('LEADERBOARD_RETENTION_DAYS', '60'))
 
 SIMPLE_JWT = {
     'AUTH_HEADER_TYPES': ('Bearer',),
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1)
 }
-CSRF_TRUSTED_ORIGINS = [os.getenv('VM_IP')]
+# Время жизни пользователя в кэше процесса для токенов без claims, в секундах
+JWT_USER_CACHE_TIMEOUT = int(os.getenv('JWT_USER_CACHE_TIMEOUT', '30'))
+CSRF_TRUSTED_ORIGINS = [origin for origin in [os.getenv('VM_IP')] if origin]
+
+if API_DOCS:
+    REST_FRAMEWORK['DEFAULT_SCHEMA_CLASS'] = 'drf_spectacular.openapi.AutoSchema'
 
 SPECTACULAR_SETTINGS = {
     'TITLE': 'API документация',
@@ -74,7 +244,11 @@ SPECTACULAR_SETTINGS = {
 }
 
 MIDDLEWARE = [
+    # Первым, чтобы в замер попало время всех остальных middleware
+    'users.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # Статика отдается самим приложением, до сессий и аутентификации
+    'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -85,6 +259,26 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'referral_system.urls'
 
+# Замеры запросов пишутся в лог users.metrics по одной JSON-строке на запрос.
+# METRICS_LOG_LEVEL=WARNING отключает их, метрики в /api/metrics/ при этом сохраняются
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'message': {'format': '%(message)s'},
+    },
+    'handlers': {
+        'metrics': {'class': 'logging.StreamHandler', 'formatter': 'message'},
+    },
+    'loggers': {
+        'users.metrics': {
+            'handlers': ['metrics'],
+            'level': os.getenv('METRICS_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -111,9 +305,33 @@ DATABASES = {
         'PASSWORD': os.getenv('PASSWORD'),
         'HOST': os.getenv('HOST'),
         'PORT': os.getenv('PORT'),
+        # Соединение переиспользуется между запросами в течение DB_CONN_MAX_AGE секунд
+        # (0 - закрывается после каждого запроса). Перед повторным использованием
+        # соединение проверяется, чтобы разрыв со стороны БД не превращался в ошибку запроса
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '60')),
+        'CONN_HEALTH_CHECKS': os.getenv('DB_CONN_HEALTH_CHECKS', '1').lower() in ('1', 'true', 'yes'),
+        'OPTIONS': {},
     }
 }
 
+# Пул соединений psycopg 3 для PostgreSQL. Нужен под ASGI, где постоянные соединения
+# не переиспользуются, и при большом количестве потоков. Пул создается в каждом процессе,
+# поэтому всего соединений до DB_POOL_MAX_SIZE * количество воркеров.
+# С пулом соединение возвращается в него после каждого запроса, CONN_MAX_AGE должен быть 0
+if os.getenv('DB_POOL', '').lower() in ('1', 'true', 'yes'):
+    # Другие бэкенды пул не поддерживают, опция pool сломала бы подключение к БД
+    if DATABASES['default']['ENGINE'] != 'django.db.backends.postgresql':
+        raise ImproperlyConfigured(
+            f'DB_POOL поддерживается только для django.db.backends.postgresql, ENGINE={DATABASES["default"]["ENGINE"]!r}'
+        )
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['OPTIONS']['pool'] = {
+        'min_size': int(os.getenv('DB_POOL_MIN_SIZE', '2')),
+        'max_size': int(os.getenv('DB_POOL_MAX_SIZE', '10')),
+        # Сколько секунд запрос ждет свободное соединение, прежде чем завершиться ошибкой
+        'timeout': float(os.getenv('DB_POOL_TIMEOUT', '10')),
+    }
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -140,6 +358,26 @@ USE_TZ = True
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
+# С STATIC_MANIFEST collectstatic добавляет к именам файлов хэш содержимого и заранее сжимает их
+# (gzip, brotli при установленном пакете brotli). WhiteNoise отдает сжатый вариант и кэширует
+# файлы с хэшем в браузере навсегда. Без манифеста {% static %} с этим хранилищем падает даже
+# при DEBUG=0, поэтому по умолчанию он включается, только если collectstatic уже создал
+# staticfiles.json. Иначе файлы отдаются без хэша и collectstatic не нужен
+STATIC_MANIFEST = os.getenv(
+    'STATIC_MANIFEST', '1' if os.path.exists(os.path.join(STATIC_ROOT, 'staticfiles.json')) else '0'
+).lower() in ('1', 'true', 'yes')
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': (
+            'whitenoise.storage.CompressedManifestStaticFilesStorage' if STATIC_MANIFEST
+            else 'whitenoise.storage.CompressedStaticFilesStorage'
+        ),
+    },
+}
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'users.User'
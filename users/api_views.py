@@ -1,19 +1,38 @@
-import time
-
-from drf_spectacular.utils import extend_schema, OpenApiResponse, OpenApiExample
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from .schema import extend_schema, OpenApiResponse, OpenApiExample
+from rest_framework.generics import ListAPIView
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from .serializers import PhoneRequestSerializer, CodeVerifySerializer, UserProfileSerializer, \
-    ActivateInviteCodeSerializer
+    ActivateInviteCodeSerializer, ReferralSerializer, ReferralTreeQuerySerializer, ReferralTreeSerializer, \
+    LeaderboardQuerySerializer, LeaderboardSerializer, ReferralExportQuerySerializer, BatchProfilesRequestSerializer, \
+    BatchProfilesSerializer
 from rest_framework.exceptions import ValidationError
 from rest_framework import status
-from .auth import generate_verification_code, save_code_to_cache, get_code_from_cache, generate_invite_code
-from .models import User
-from rest_framework_simplejwt.tokens import RefreshToken
-from rest_framework.permissions import IsAuthenticated
+from .authentication import issue_access_token, ServiceTokenAuthentication, IsServiceClient
+from .batch_profiles import iter_profiles_json
+from .delivery import DeliveryQueueFull
+from .export import CONTENT_TYPES, export_referrals, gzip_stream
+from .leaderboard import get_leaderboard
+from .metrics import registry
+from .pagination import ReferralCursorPagination
+from .profile_cache import profile_etag, profile_last_modified
+from .referral_tree import get_downline
+from .referrals import referrals_of
+from .throttling import PhoneRateThrottle, IPRateThrottle
+from .services import ServiceError, send_code, verify_code, issue_tokens, activate_invite_code
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
+from rest_framework_simplejwt.authentication import JWTAuthentication
 
 
 class RequestCodeView(APIView):
+    # Лимиты проверяются до разбора запроса сериализатором и до любых обращений к БД
+    throttle_scope = 'request_code'
+    throttle_classes = [PhoneRateThrottle, IPRateThrottle]
+
     @extend_schema(
         tags=['Аутентификация'],
         description='Отправка запроса на получение кода верификации на указанный номер телефона',
@@ -28,7 +47,9 @@ class RequestCodeView(APIView):
                     )
                 ]
             ),
-            400: OpenApiResponse(description='Ошибка в запросе')
+            400: OpenApiResponse(description='Ошибка в запросе'),
+            429: OpenApiResponse(description='Слишком много запросов для номера или IP'),
+            503: OpenApiResponse(description='Сервис отправки кодов перегружен')
         }
     )
 
@@ -36,23 +57,28 @@ class RequestCodeView(APIView):
         try:
             serializer = PhoneRequestSerializer(data=request.data)
             serializer.is_valid(raise_exception=True)
-            phone = serializer.validated_data['phone']
-            code = generate_verification_code()
-            save_code_to_cache(phone, code)
-
-            # Эмуляция задержки 2 секунды
-            time.sleep(2)
+            code = send_code(serializer.validated_data['phone'])
 
             return Response({'detail': 'Код отправлен', 'debug_code': code}, status=200)
 
         except ValidationError as e:
             return Response(e.detail, status=status.HTTP_400_BAD_REQUEST)
 
+        except DeliveryQueueFull:
+            return Response(
+                {'detail': 'Сервис отправки кодов перегружен, попробуйте позже'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+
         except Exception as e:
             return Response({'error': str(e)}, status=400)
 
 
 class VerifyCodeView(APIView):
+    # Ограничение числа попыток по номеру защищает 4-значный код от перебора
+    throttle_scope = 'verify_code'
+    throttle_classes = [PhoneRateThrottle, IPRateThrottle]
+
     @extend_schema(
         tags=['Аутентификация'],
         description='Проверка кода верификации и получение токенов доступа',
@@ -78,7 +104,8 @@ class VerifyCodeView(APIView):
                         value={'detail': 'Неверный код'}
                     )
                 ]
-            )
+            ),
+            429: OpenApiResponse(description='Слишком много попыток для номера или IP')
         }
     )
 
@@ -86,32 +113,12 @@ class VerifyCodeView(APIView):
         try:
             serializer = CodeVerifySerializer(data=request.data)
             serializer.is_valid(raise_exception=True)
-            phone = serializer.validated_data['phone']
-            code = serializer.validated_data['code']
-            cached_code = get_code_from_cache(phone)
-
-            if cached_code != code:
-                return Response({'detail': 'Неверный код'}, status=400)
-
-            # Если пользователя нет в бд - создаем, в другом случае получаем его из бд
-            user, created = User.objects.get_or_create(phone=phone)
-
-            # Если пользователь создан впервые, генерируем инвайт-код
-            if created:
-                invite_code = generate_invite_code()
-                user.invite_code = invite_code
-                user.save()
-
-            refresh = RefreshToken.for_user(user)
+            user = verify_code(serializer.validated_data['phone'], serializer.validated_data['code'])
 
             # Отправляем refresh и access токены
-            return Response(
-                {
-                    'refresh': str(refresh),
-                    'access': str(refresh.access_token)
-                },
-                status=200
-            )
+            return Response(issue_tokens(user), status=200)
+        except ServiceError as e:
+            return Response({'detail': e.detail}, status=400)
         except Exception as e:
             return Response({'error': str(e)}, status=400)
 
@@ -127,12 +134,152 @@ class ProfileView(APIView):
             401: OpenApiResponse(description='Не авторизован')
         }
     )
+    @method_decorator(cache_control(private=True, no_cache=True))
+    @method_decorator(condition(etag_func=profile_etag, last_modified_func=profile_last_modified))
     def get(self, request):
         user = request.user
         serializer = UserProfileSerializer(user)
         return Response(serializer.data)
 
 
+class BatchProfilesView(APIView):
+    # Для внутренних сервисов: профили многих пользователей за один запрос
+    authentication_classes = [ServiceTokenAuthentication]
+    permission_classes = [IsServiceClient]
+
+    @extend_schema(
+        tags=['Внутренние сервисы'],
+        description='Телефон, инвайт-коды и количество рефералов для списка пользователей по id или номерам. '
+                    'Авторизация заголовком "Authorization: Service <токен>" из SERVICE_TOKENS. '
+                    'Пользователи ищутся пачками по 200: на пачку один запрос и один запрос количества рефералов',
+        request=BatchProfilesRequestSerializer,
+        responses={
+            200: BatchProfilesSerializer,
+            400: OpenApiResponse(description='Некорректный список пользователей'),
+            401: OpenApiResponse(description='Нет токена сервиса или токен неизвестен')
+        }
+    )
+    def post(self, request):
+        serializer = BatchProfilesRequestSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=400)
+
+        profiles = iter_profiles_json(serializer.validated_data.get('ids'), serializer.validated_data.get('phones'))
+        return StreamingHttpResponse(profiles, content_type='application/json')
+
+
+class ReferralListView(ListAPIView):
+    permission_classes = [IsAuthenticated]
+    serializer_class = ReferralSerializer
+    pagination_class = ReferralCursorPagination
+
+    def get_queryset(self):
+        # Выбираем только телефон, без загрузки полных объектов User
+        return referrals_of(self.request.user).values('phone')
+
+    @extend_schema(
+        tags=['Профиль'],
+        description='Постраничный список рефералов авторизованного пользователя. '
+                    'Для перехода между страницами используются ссылки next/previous из ответа',
+        responses={
+            401: OpenApiResponse(description='Не авторизован')
+        }
+    )
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+
+class ReferralTreeView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(
+        tags=['Профиль'],
+        description='Размер и глубина многоуровневой реферальной сети авторизованного пользователя: '
+                    'его рефералы, их рефералы и так далее',
+        parameters=[ReferralTreeQuerySerializer],
+        responses={
+            200: ReferralTreeSerializer,
+            400: OpenApiResponse(description='Некорректная глубина'),
+            401: OpenApiResponse(description='Не авторизован')
+        }
+    )
+    def get(self, request):
+        serializer = ReferralTreeQuerySerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=400)
+
+        downline = get_downline(request.user, serializer.validated_data.get('depth'))
+        return Response(ReferralTreeSerializer(downline).data)
+
+
+class LeaderboardView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(
+        tags=['Инвайт-коды'],
+        description='Рейтинг пригласивших по количеству активаций инвайт-кода за текущий день, '
+                    'текущую неделю или все время. Топ читается из кэша и обновляется при активациях',
+        parameters=[LeaderboardQuerySerializer],
+        responses={
+            200: LeaderboardSerializer,
+            400: OpenApiResponse(description='Некорректный период или размер рейтинга'),
+            401: OpenApiResponse(description='Не авторизован')
+        }
+    )
+    def get(self, request):
+        serializer = LeaderboardQuerySerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=400)
+
+        window = serializer.validated_data['window']
+        period, top = get_leaderboard(window, serializer.validated_data.get('limit'))
+        return Response(LeaderboardSerializer({
+            'window': window,
+            'period': period,
+            'results': [
+                {'rank': rank, 'invite_code': code, 'referrals': count}
+                for rank, (code, count) in enumerate(top, start=1)
+            ],
+        }).data)
+
+
+class ReferralExportView(APIView):
+    # Пользователь загружается из БД стандартной JWTAuthentication, а не из claims токена:
+    # доступ проверяется по актуальному is_staff
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAdminUser]
+
+    @extend_schema(
+        tags=['Администрирование'],
+        description='Потоковая выгрузка всех пар (пригласивший, приглашенный, время активации) в CSV или JSONL, '
+                    'при необходимости сжатая gzip. Доступна только пользователям с is_staff',
+        parameters=[ReferralExportQuerySerializer],
+        responses={
+            (200, 'text/csv'): OpenApiResponse(description='Файл выгрузки'),
+            400: OpenApiResponse(description='Некорректный формат'),
+            401: OpenApiResponse(description='Не авторизован'),
+            403: OpenApiResponse(description='Нет доступа')
+        }
+    )
+    def get(self, request):
+        serializer = ReferralExportQuerySerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=400)
+
+        file_format = serializer.validated_data['output']
+        filename = f'referrals.{file_format}'
+        chunks = export_referrals(file_format)
+        content_type = CONTENT_TYPES[file_format]
+        if serializer.validated_data['gzip']:
+            chunks = gzip_stream(chunks)
+            filename += '.gz'
+            content_type = 'application/gzip'
+
+        response = StreamingHttpResponse(chunks, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
 class ActivateInviteCodeView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -146,7 +293,7 @@ class ActivateInviteCodeView(APIView):
                 examples=[
                     OpenApiExample(
                         'Успешная активация',
-                        value={'detail': 'Инвайт-код успешно активирован'}
+                        value={'detail': 'Инвайт-код успешно активирован', 'access': 'eyJ0eXAiOiJKV1QiLCJhbG...'}
                     )
                 ]
             ),
@@ -164,6 +311,10 @@ class ActivateInviteCodeView(APIView):
                     OpenApiExample(
                         'Свой код',
                         value={'detail': 'Вы не можете активировать свой собственный инвайт-код'}
+                    ),
+                    OpenApiExample(
+                        'Код из своей сети',
+                        value={'detail': 'Нельзя активировать инвайт-код пользователя из вашей реферальной сети'}
                     )
                 ]
             ),
@@ -172,28 +323,25 @@ class ActivateInviteCodeView(APIView):
     )
 
     def post(self, request):
-        user = request.user
-
-        # Проверяем, не активировал ли пользователь уже инвайт-код
-        if user.activated_invite_code:
-            return Response({'detail': 'Вы уже активировали инвайт-код'}, status=400)
-
         serializer = ActivateInviteCodeSerializer(data=request.data)
         if not serializer.is_valid():
             return Response(serializer.errors, status=400)
 
-        invite_code = serializer.validated_data['invite_code']
+        try:
+            activate_invite_code(request.user, serializer.validated_data['invite_code'])
+        except ServiceError as e:
+            return Response({'detail': e.detail}, status=400)
 
-        # Проверяем, существует ли такой инвайт-код
-        if not User.objects.filter(invite_code=invite_code).exists():
-            return Response({'detail': 'Инвайт-код не существует'}, status=400)
+        # В старом access токене остался пустой activated_invite_code, выдаем новый
+        return Response({'detail': 'Инвайт-код успешно активирован', 'access': issue_access_token(request.user)})
 
-        # Проверяем, не пытается ли пользователь активировать свой собственный инвайт-код
-        if user.invite_code == invite_code:
-            return Response({'detail': 'Вы не можете активировать свой собственный инвайт-код'}, status=400)
 
-        # Активируем инвайт-код
-        user.activated_invite_code = invite_code
-        user.save()
+class MetricsView(APIView):
+    # Метрики в текстовом формате Prometheus. В них время и количество запросов к БД по эндпоинтам,
+    # поэтому доступ только у администраторов и у сборщика метрик с токеном сервиса (SERVICE_TOKENS)
+    authentication_classes = [JWTAuthentication, ServiceTokenAuthentication]
+    permission_classes = [IsAdminUser | IsServiceClient]
 
-        return Response({'detail': 'Инвайт-код успешно активирован'})
+    @extend_schema(exclude=True)
+    def get(self, request):
+        return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
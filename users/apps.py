@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class UsersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'users'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from .instrumentation import install_query_recorder
+
+        # Счетчик SQL-запросов для MetricsMiddleware подключается к каждому соединению
+        connection_created.connect(install_query_recorder, dispatch_uid='users_query_recorder')
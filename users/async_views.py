@@ -0,0 +1,141 @@
+import json
+
+from django.http import JsonResponse
+from django.utils.decorators import classonlymethod
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.exceptions import AuthenticationFailed, NotAuthenticated, Throttled
+
+from .authentication import ClaimsJWTAuthentication, issue_access_token
+from .delivery import DeliveryQueueFull
+from .referrals import aget_referral_count
+from .serializers import PhoneRequestSerializer, CodeVerifySerializer, ActivateInviteCodeSerializer
+from .services import ServiceError, asend_code, averify_code, issue_tokens, aactivate_invite_code
+from .throttling import acheck_rates
+
+
+def json_response(data, status=200):
+    return JsonResponse(data, status=status, safe=False, json_dumps_params={'ensure_ascii': False})
+
+
+def request_phone(request):
+    # Тело запроса может оказаться не объектом, а, например, JSON-массивом
+    return request.data.get('phone') if isinstance(request.data, dict) else None
+
+
+def throttled_response(wait):
+    # Тот же ответ, что у DRF при срабатывании ограничения частоты
+    response = json_response({'detail': Throttled(wait).detail}, status=429)
+    response['Retry-After'] = str(wait)
+    return response
+
+
+class AsyncAPIView(View):
+    # Асинхронные аналоги API-эндпоинтов для запуска под ASGI-сервером.
+    # Вся работа с БД и кэшем выполняется через асинхронные методы Django,
+    # поэтому один процесс обслуживает много одновременных запросов.
+    authentication_required = False
+
+    @classonlymethod
+    def as_view(cls, **initkwargs):
+        # Как и в DRF, аутентификация идет по JWT, а не по сессии, поэтому CSRF не нужен
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        if request.content_type == 'application/json' and request.body:
+            try:
+                request.data = json.loads(request.body)
+            except ValueError:
+                return json_response({'detail': 'Некорректный JSON'}, status=400)
+        else:
+            request.data = request.POST
+
+        if self.authentication_required:
+            try:
+                request.user = await self.authenticate(request)
+            except (NotAuthenticated, AuthenticationFailed) as e:
+                # Формат ответа как у DRF: строка оборачивается в {'detail': ...}
+                detail = e.detail if isinstance(e.detail, dict) else {'detail': e.detail}
+                return json_response(detail, status=401)
+
+        return await super().dispatch(request, *args, **kwargs)
+
+    async def authenticate(self, request):
+        # Разбор заголовка и проверка подписи токена не требуют ввода-вывода,
+        # асинхронно выполняется только загрузка пользователя для токенов без claims
+        authentication = ClaimsJWTAuthentication()
+        header = authentication.get_header(request)
+        raw_token = authentication.get_raw_token(header) if header else None
+        if raw_token is None:
+            raise NotAuthenticated()
+
+        validated_token = authentication.get_validated_token(raw_token)
+        return await authentication.aget_user(validated_token)
+
+
+class RequestCodeView(AsyncAPIView):
+    async def post(self, request):
+        wait = await acheck_rates(request, 'request_code', request_phone(request))
+        if wait is not None:
+            return throttled_response(wait)
+
+        serializer = PhoneRequestSerializer(data=request.data)
+        if not serializer.is_valid():
+            return json_response(serializer.errors, status=400)
+
+        try:
+            code = await asend_code(serializer.validated_data['phone'])
+        except DeliveryQueueFull:
+            return json_response({'detail': 'Сервис отправки кодов перегружен, попробуйте позже'}, status=503)
+
+        return json_response({'detail': 'Код отправлен', 'debug_code': code})
+
+
+class VerifyCodeView(AsyncAPIView):
+    async def post(self, request):
+        wait = await acheck_rates(request, 'verify_code', request_phone(request))
+        if wait is not None:
+            return throttled_response(wait)
+
+        serializer = CodeVerifySerializer(data=request.data)
+        if not serializer.is_valid():
+            return json_response(serializer.errors, status=400)
+
+        try:
+            user = await averify_code(serializer.validated_data['phone'], serializer.validated_data['code'])
+        except ServiceError as e:
+            return json_response({'detail': e.detail}, status=400)
+        except Exception as e:
+            return json_response({'error': str(e)}, status=400)
+
+        return json_response(issue_tokens(user))
+
+
+class ProfileView(AsyncAPIView):
+    authentication_required = True
+
+    async def get(self, request):
+        user = request.user
+
+        return json_response({
+            'phone': user.phone,
+            'invite_code': user.invite_code,
+            'activated_invite_code': user.activated_invite_code,
+            'referrals_count': await aget_referral_count(user),
+        })
+
+
+class ActivateInviteCodeView(AsyncAPIView):
+    authentication_required = True
+
+    async def post(self, request):
+        serializer = ActivateInviteCodeSerializer(data=request.data)
+        if not serializer.is_valid():
+            return json_response(serializer.errors, status=400)
+
+        try:
+            await aactivate_invite_code(request.user, serializer.validated_data['invite_code'])
+        except ServiceError as e:
+            return json_response({'detail': e.detail}, status=400)
+
+        return json_response({'detail': 'Инвайт-код успешно активирован', 'access': issue_access_token(request.user)})
@@ -0,0 +1,167 @@
+import hmac
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.permissions import BasePermission
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .models import User
+
+
+# Данные пользователя, которые кладутся в access токен. Эндпоинты, которым хватает
+# этих полей, обслуживаются без запроса к таблице пользователей
+USER_CLAIMS = ('phone', 'invite_code', 'activated_invite_code')
+
+
+def add_user_claims(token, user):
+    for claim in USER_CLAIMS:
+        token[claim] = getattr(user, claim)
+    return token
+
+
+def issue_access_token(user):
+    # Новый access токен с актуальными claims, например после активации инвайт-кода
+    return str(add_user_claims(AccessToken.for_user(user), user))
+
+
+class ClaimsUser(TokenUser):
+    # Пользователь, восстановленный из claims токена. Атрибуты из USER_CLAIMS
+    # читаются из токена, изменения сохраняются только в этом объекте
+    def __init__(self, token):
+        super().__init__(token)
+        for claim in USER_CLAIMS:
+            setattr(self, claim, token[claim])
+
+
+class UserCache:
+    # Кэш пользователей в памяти процесса с коротким временем жизни. Используется для
+    # токенов без claims, выданных до их появления: пользователь загружается из БД
+    # не чаще одного раза за timeout
+    def __init__(self, timeout, max_size=10_000):
+        self.timeout = timeout
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.users = {}
+
+    def get(self, user_id):
+        entry = self.users.get(user_id)
+        if entry is None:
+            return None
+        user, expires = entry
+        if expires < time.monotonic():
+            self.users.pop(user_id, None)
+            return None
+        return user
+
+    def set(self, user_id, user):
+        with self.lock:
+            if len(self.users) >= self.max_size:
+                self.users.clear()
+            self.users[user_id] = (user, time.monotonic() + self.timeout)
+
+    def delete(self, user_id):
+        self.users.pop(str(user_id), None)
+
+    def clear(self):
+        self.users.clear()
+
+
+user_cache = UserCache(settings.JWT_USER_CACHE_TIMEOUT)
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    # Проверка подписи та же, что в JWTAuthentication, но пользователь берется из claims
+    # токена, а при их отсутствии - из кэша в памяти процесса
+    def get_user(self, validated_token):
+        if all(claim in validated_token for claim in USER_CLAIMS):
+            return ClaimsUser(validated_token)
+
+        user_id = self.get_user_id(validated_token)
+        user = user_cache.get(user_id)
+        if user is None:
+            user = super().get_user(validated_token)
+            user_cache.set(user_id, user)
+        return user
+
+    async def aget_user(self, validated_token):
+        if all(claim in validated_token for claim in USER_CLAIMS):
+            return ClaimsUser(validated_token)
+
+        user_id = self.get_user_id(validated_token)
+        user = user_cache.get(user_id)
+        if user is None:
+            try:
+                user = await User.objects.aget(pk=user_id, is_active=True)
+            except User.DoesNotExist:
+                raise AuthenticationFailed('Пользователь не найден')
+            user_cache.set(user_id, user)
+        return user
+
+    def get_user_id(self, validated_token):
+        try:
+            return str(validated_token[api_settings.USER_ID_CLAIM])
+        except KeyError:
+            raise AuthenticationFailed('Пользователь не найден')
+
+
+class CachedModelBackend(ModelBackend):
+    # Бэкенд сессий веб-интерфейса: пользователь по id из сессии берется из того же кэша,
+    # что и для токенов без claims, и загружается из БД не чаще одного раза за timeout
+    def get_user(self, user_id):
+        user = user_cache.get(str(user_id))
+        if user is None:
+            user = super().get_user(user_id)
+            if user is not None:
+                user_cache.set(str(user_id), user)
+        return user
+
+
+class ServiceClient:
+    # Внутренний сервис (биллинг, бонусы), авторизованный токеном из SERVICE_TOKENS
+    is_authenticated = True
+    is_anonymous = False
+    is_staff = False
+
+    def __init__(self, name):
+        self.name = name
+        self.pk = None
+
+    def __str__(self):
+        return f'service:{self.name}'
+
+
+class ServiceTokenAuthentication(BaseAuthentication):
+    # Заголовок 'Authorization: Service <токен>'. Токены и имена сервисов задаются в SERVICE_TOKENS,
+    # проверка не обращается к БД. Токен сравнивается со всеми за постоянное время
+    keyword = 'Service'
+
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise AuthenticationFailed('Некорректный заголовок авторизации сервиса')
+
+        token = auth[1]
+        client = None
+        for name, expected in settings.SERVICE_TOKENS.items():
+            if hmac.compare_digest(token, expected.encode()):
+                client = ServiceClient(name)
+        if client is None:
+            raise AuthenticationFailed('Неизвестный токен сервиса')
+        return client, token.decode()
+
+    def authenticate_header(self, request):
+        return self.keyword
+
+
+class IsServiceClient(BasePermission):
+    def has_permission(self, request, view):
+        return isinstance(request.user, ServiceClient)
@@ -0,0 +1,47 @@
+import json
+from itertools import islice
+
+from .models import User
+from .referrals import get_referral_counts
+
+
+# Профили многих пользователей для внутренних сервисов. Запрошенные id или номера
+# обрабатываются пачками по chunk_size: на пачку один запрос с IN и одно получение
+# количества рефералов (из кэша или одним GROUP BY). В памяти держится только текущая пачка
+
+PROFILE_FIELDS = ('id', 'phone', 'invite_code', 'activated_invite_code')
+
+
+def _chunks(keys, chunk_size):
+    keys = iter(keys)
+    while chunk := list(islice(keys, chunk_size)):
+        yield chunk
+
+
+def iter_profiles(ids=None, phones=None, not_found=None, chunk_size=200):
+    # Профили в порядке запроса; ненайденные id или номера добавляются в not_found
+    field, keys = ('id', ids) if ids is not None else ('phone', phones)
+    for chunk in _chunks(dict.fromkeys(keys), chunk_size):
+        rows = User.objects.filter(**{f'{field}__in': chunk}).values(*PROFILE_FIELDS)
+        # iterator() не заполняет кэш queryset, строки пачки хранятся только в found
+        found = {row[field]: row for row in rows.iterator(chunk_size)}
+        counts = get_referral_counts((row['id'], row['invite_code']) for row in found.values())
+        for key in chunk:
+            row = found.get(key)
+            if row is None:
+                if not_found is not None:
+                    not_found.append(key)
+                continue
+            yield {**row, 'referrals_count': counts.get(row['invite_code'], 0)}
+
+
+def iter_profiles_json(ids=None, phones=None, chunk_size=200):
+    # Ответ {"results": [...], "not_found": [...]}: каждая пачка профилей отдается сразу
+    # после запроса к БД, список ненайденных - в конце
+    not_found = []
+    profiles = iter_profiles(ids, phones, not_found, chunk_size)
+    yield '{"results": ['
+    for index, chunk in enumerate(_chunks(profiles, chunk_size)):
+        chunk = ', '.join(json.dumps(profile, ensure_ascii=False) for profile in chunk)
+        yield chunk if index == 0 else ', ' + chunk
+    yield '], "not_found": ' + json.dumps(not_found, ensure_ascii=False) + '}'
@@ -0,0 +1,146 @@
+import json
+import math
+import os
+import re
+import tempfile
+from contextlib import contextmanager
+
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from .invite_codes import allocator, allocate_invite_codes
+from .models import User
+
+
+# Общие функции для нагрузочных тестов и бенчмарков
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, math.ceil(p / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+
+def summarize(latencies, elapsed, errors=0):
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+def format_table(rows, columns):
+    widths = [max(len(str(column)), *(len(str(row.get(column, ''))) for row in rows)) for column in columns]
+    lines = ['  '.join(str(column).ljust(width) for column, width in zip(columns, widths))]
+    lines.append('  '.join('-' * width for width in widths))
+    for row in rows:
+        lines.append('  '.join(str(row.get(column, '')).ljust(width) for column, width in zip(columns, widths)))
+    return '\n'.join(lines)
+
+
+# Сколько секунд поток ждет блокировку записи SQLite в многопоточных замерах (по умолчанию 5)
+SQLITE_BENCH_TIMEOUT = 60
+
+
+@contextmanager
+def test_database(shared_file=False):
+    # Временная тестовая БД, как у тестового раннера Django: рабочая БД не затрагивается.
+    # SQLite в памяти не выдерживает одновременной записи из нескольких потоков,
+    # поэтому для многопоточных замеров (shared_file=True) БД создается во временном файле.
+    # Запись в нем идет по очереди и под нагрузкой ждет блокировку дольше 5 секунд по умолчанию,
+    # поэтому ожидание увеличено, а журнал WAL не блокирует чтение во время записи
+    test_settings = connection.settings_dict.setdefault('TEST', {})
+    options = connection.settings_dict.setdefault('OPTIONS', {})
+    old_test_name, old_options = test_settings.get('NAME'), dict(options)
+    tmp_dir = None
+    if shared_file and connection.vendor == 'sqlite':
+        tmp_dir = tempfile.TemporaryDirectory()
+        test_settings['NAME'] = os.path.join(tmp_dir.name, 'bench.sqlite3')
+        options.update(timeout=SQLITE_BENCH_TIMEOUT, init_command='PRAGMA journal_mode=WAL')
+
+    # Блок инвайт-кодов, арендованный в одной БД, нельзя расходовать в другой
+    allocator.reset()
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+        allocator.reset()
+        test_settings['NAME'] = old_test_name
+        options.clear()
+        options.update(old_options)
+        if tmp_dir is not None:
+            tmp_dir.cleanup()
+
+
+# Сценарий из коллекции Postman: шаги с подстановкой переменных {{name}}
+# и переменные, которые тестовые скрипты коллекции сохраняют из ответов
+
+POSTMAN_VARIABLE_RE = re.compile(r'{{(\w+)}}')
+POSTMAN_CAPTURE_RE = re.compile(r'pm\.collectionVariables\.set\(\s*["\'](\w+)["\']\s*,\s*data\.(\w+)\s*\)')
+
+
+def render_template(text, variables):
+    return POSTMAN_VARIABLE_RE.sub(lambda match: str(variables.get(match.group(1), '')), text)
+
+
+def load_postman_flow(path):
+    with open(path, encoding='utf-8') as f:
+        collection = json.load(f)
+
+    variables = {variable['key']: variable.get('value', '') for variable in collection.get('variable', [])}
+    steps = []
+
+    def walk(items):
+        for item in items:
+            if 'item' in item:
+                walk(item['item'])
+                continue
+            request = item['request']
+            url = request['url'] if isinstance(request['url'], str) else request['url']['raw']
+            script = '\n'.join(
+                line for event in item.get('event', []) if event.get('listen') == 'test'
+                for line in event['script']['exec']
+            )
+            steps.append({
+                'name': item['name'],
+                'method': request['method'],
+                'url': url,
+                'headers': {header['key']: header['value'] for header in request.get('header', [])},
+                'body': request.get('body', {}).get('raw', ''),
+                'captures': dict(POSTMAN_CAPTURE_RE.findall(script)),
+            })
+
+    walk(collection['item'])
+    return steps, variables
+
+
+def seed_referral_tree(count, shape, fanout=10, prefix='+7904', batch_size=1000):
+    # Создает count пользователей, связанных рефералами: flat - все приглашены первым,
+    # chain - каждый приглашен предыдущим, balanced - дерево, где у каждого fanout рефералов
+    users = []
+    for start in range(0, count, batch_size):
+        size = min(batch_size, count - start)
+        users.extend(User.objects.bulk_create([
+            User(phone=f'{prefix}{start + index:07d}', invite_code=code)
+            for index, code in enumerate(allocate_invite_codes(size))
+        ]))
+
+    parents = {
+        'flat': lambda index: 0,
+        'chain': lambda index: index - 1,
+        'balanced': lambda index: (index - 1) // fanout,
+    }[shape]
+    for user_index, user in enumerate(users[1:], start=1):
+        parent = users[parents(user_index)]
+        user.referred_by = parent
+        user.activated_invite_code = parent.invite_code
+    User.objects.bulk_update(users[1:], ['referred_by', 'activated_invite_code'], batch_size=batch_size)
+    return users
@@ -0,0 +1,125 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+
+class DeliveryQueueFull(Exception):
+    pass
+
+
+class BaseSmsBackend:
+    def send(self, phone, message):
+        raise NotImplementedError
+
+
+class DummySmsBackend(BaseSmsBackend):
+    # Эмуляция SMS-шлюза: сообщение никуда не уходит, но отправка занимает время
+    def __init__(self, latency=None):
+        self.latency = settings.SMS_BACKEND_LATENCY if latency is None else latency
+
+    def send(self, phone, message):
+        time.sleep(self.latency)
+        logger.info('SMS для %s: %s', phone, message)
+
+
+class CodeDispatcher:
+    def __init__(self, backend=None, workers=None, queue_size=None):
+        self._backend = backend
+        self.workers = workers or settings.CODE_DELIVERY_WORKERS
+        self.queue = queue.Queue(maxsize=queue_size or settings.CODE_DELIVERY_QUEUE_SIZE)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._stopped = False
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = import_string(settings.SMS_BACKEND)()
+        return self._backend
+
+    def start(self):
+        # Потоки запускаются лениво при первой отправке, чтобы не плодить их
+        # в management-командах и в мастер-процессе сервера до форка воркеров
+        with self._lock:
+            if self._threads:
+                return
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f'code-dispatcher-{index}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            # Потоки-демоны завершаются вместе с процессом, поэтому перед выходом очередь дорабатывается.
+            # Под gunicorn stop вызывается из хука worker_exit, atexit - для остальных серверов
+            atexit.register(self.stop)
+
+    def stop(self, timeout=None):
+        # Перестает принимать коды и ждет отправки уже поставленных в очередь, не дольше timeout секунд
+        timeout = settings.CODE_DELIVERY_DRAIN_TIMEOUT if timeout is None else timeout
+        with self._lock:
+            if self._stopped or not self._threads:
+                self._stopped = True
+                return
+            self._stopped = True
+        deadline = time.monotonic() + timeout
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.queue.all_tasks_done.wait(remaining)
+            pending = self.queue.unfinished_tasks
+        if pending:
+            logger.error('Процесс завершается, не отправлено кодов: %s', pending)
+
+    def enqueue(self, phone, message):
+        if self._stopped:
+            delivery_rejected.inc()
+            raise DeliveryQueueFull('Отправка кодов остановлена')
+        self.start()
+        try:
+            self.queue.put_nowait((phone, message, time.monotonic()))
+        except queue.Full:
+            delivery_rejected.inc()
+            raise DeliveryQueueFull('Очередь отправки переполнена')
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def _work(self):
+        while True:
+            phone, message, enqueued_at = self.queue.get()
+            try:
+                self.backend.send(phone, message)
+                delivery_sent.inc()
+            except Exception:
+                delivery_failed.inc()
+                logger.exception('Не удалось отправить код на %s', phone)
+            finally:
+                # Задержка считается от постановки в очередь: ожидание плюс отправка
+                delivery_latency.observe(time.monotonic() - enqueued_at)
+                self.queue.task_done()
+
+
+dispatcher = CodeDispatcher()
+
+delivery_latency = registry.histogram(
+    'code_delivery_latency_seconds', 'Время от постановки кода в очередь до его отправки'
+)
+delivery_sent = registry.counter('code_delivery_sent_total', 'Количество отправленных кодов')
+delivery_failed = registry.counter('code_delivery_failed_total', 'Количество неудачных отправок кодов')
+delivery_rejected = registry.counter(
+    'code_delivery_rejected_total', 'Количество кодов, отклоненных из-за переполнения очереди'
+)
+registry.gauge('code_delivery_queue_depth', 'Количество кодов, ожидающих отправки', func=dispatcher.depth)
+
+
+def send_verification_code(phone, code):
+    dispatcher.enqueue(phone, f'Ваш код подтверждения: {code}')
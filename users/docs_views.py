@@ -0,0 +1,56 @@
+import os
+from datetime import datetime, timezone
+from functools import cache
+
+from django.conf import settings
+from django.http import FileResponse, Http404
+from django.shortcuts import render
+from django.urls import reverse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+
+
+# Документация API. Схема генерируется при сборке образа (manage.py spectacular --file) и отдается
+# из файла API_SCHEMA_FILE. Без файла схема генерируется drf-spectacular на каждый запрос,
+# это доступно только при API_DOCS. Страница Redoc - статический шаблон, схему она загружает сама
+
+
+def schema_last_modified(request, *args, **kwargs):
+    try:
+        return datetime.fromtimestamp(os.path.getmtime(settings.API_SCHEMA_FILE), tz=timezone.utc)
+    except OSError:
+        return None
+
+
+def schema_available():
+    return settings.API_DOCS or os.path.exists(settings.API_SCHEMA_FILE)
+
+
+@cache
+def live_schema_view():
+    # drf-spectacular импортируется при первом запросе схемы, а не при старте воркера
+    from drf_spectacular.views import SpectacularAPIView
+    return SpectacularAPIView.as_view()
+
+
+class SchemaView(View):
+    @method_decorator(cache_control(public=True, no_cache=True))
+    @method_decorator(condition(last_modified_func=schema_last_modified))
+    def get(self, request):
+        if os.path.exists(settings.API_SCHEMA_FILE):
+            return FileResponse(open(settings.API_SCHEMA_FILE, 'rb'), content_type='application/vnd.oai.openapi')
+        if not settings.API_DOCS:
+            raise Http404('Схема API не сгенерирована')
+        return live_schema_view()(request)
+
+
+class RedocView(View):
+    def get(self, request):
+        if not schema_available():
+            raise Http404('Документация API отключена')
+        return render(request, 'redoc.html', {
+            'title': settings.SPECTACULAR_SETTINGS['TITLE'],
+            'schema_url': reverse('schema'),
+        })
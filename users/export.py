@@ -0,0 +1,71 @@
+import csv
+import io
+import json
+import zlib
+
+from .models import User
+
+
+# Выгрузка пар (пригласивший, приглашенный, время активации) для аналитики.
+# Пользователи читаются через iterator(chunk_size): в PostgreSQL это серверный курсор,
+# в остальных БД - построчная выборка из курсора. Строки формируются и отдаются пачками,
+# поэтому память не зависит от размера таблицы
+
+FORMATS = ('csv', 'jsonl')
+COLUMNS = ('inviter_id', 'inviter_phone', 'invite_code', 'invitee_id', 'invitee_phone', 'activated_at')
+CONTENT_TYPES = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+
+def referral_rows(chunk_size=2000):
+    users = (
+        User.objects
+        .filter(referred_by__isnull=False)
+        .order_by('pk')
+        .values_list('referred_by_id', 'referred_by__phone', 'activated_invite_code', 'pk', 'phone', 'activated_at')
+    )
+    for inviter_id, inviter_phone, invite_code, invitee_id, invitee_phone, activated_at in users.iterator(chunk_size):
+        yield (
+            inviter_id, inviter_phone, invite_code, invitee_id, invitee_phone,
+            activated_at.isoformat() if activated_at else None,
+        )
+
+
+def _csv_lines(rows, chunk_size):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for index, row in enumerate(rows, start=1):
+        writer.writerow(row)
+        if index % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _jsonl_lines(rows, chunk_size):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(COLUMNS, row)), ensure_ascii=False) + '\n')
+        if len(lines) == chunk_size:
+            yield ''.join(lines)
+            lines = []
+    yield ''.join(lines)
+
+
+def export_referrals(file_format='csv', chunk_size=2000):
+    # Генератор байтов выгрузки, по пачке на chunk_size пользователей
+    lines = {'csv': _csv_lines, 'jsonl': _jsonl_lines}[file_format]
+    for chunk in lines(referral_rows(chunk_size), chunk_size):
+        if chunk:
+            yield chunk.encode('utf-8')
+
+
+def gzip_stream(chunks, level=6):
+    # Сжимает поток по мере генерации, результат - обычный .gz файл
+    compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
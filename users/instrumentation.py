@@ -0,0 +1,82 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from .metrics import registry
+
+
+# Замеры текущего запроса. Хранятся в contextvar, поэтому не смешиваются между потоками
+# и асинхронными задачами и доступны в sync_to_async, куда контекст копируется
+
+request_duration = registry.histogram(
+    'http_request_duration_seconds', 'Время обработки запроса по представлениям'
+)
+requests_total = registry.counter('http_requests_total', 'Количество запросов по представлениям и статусам')
+db_queries_total = registry.counter('db_queries_total', 'Количество SQL-запросов по представлениям')
+db_query_seconds_total = registry.counter('db_query_seconds_total', 'Суммарное время SQL-запросов по представлениям')
+serializer_duration = registry.histogram(
+    'serializer_duration_seconds', 'Время валидации и сериализации данных по сериализаторам',
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+)
+
+
+class RequestStats:
+    def __init__(self):
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+
+
+current_stats = ContextVar('request_stats', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    # Обертка connection.execute_wrapper: считает запросы и их время для текущего запроса
+    stats = current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.db_queries += 1
+        stats.db_time += time.perf_counter() - started
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    # Обработчик сигнала connection_created. Сигнал приходит при каждом переподключении,
+    # а список оберток живет в объекте соединения, поэтому обертка добавляется один раз
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+# Глубина вложенности сериализаторов: время вложенного уже входит во время внешнего
+serializer_depth = ContextVar('serializer_depth', default=0)
+
+
+@contextmanager
+def timed_serializer(serializer, stage):
+    depth = serializer_depth.get()
+    token = serializer_depth.set(depth + 1)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        serializer_depth.reset(token)
+        serializer_duration.observe(elapsed, serializer=type(serializer).__name__, stage=stage)
+        stats = current_stats.get()
+        if stats is not None and depth == 0:
+            stats.serializer_time += elapsed
+
+
+class TimedSerializerMixin:
+    # Замеряет время валидации и преобразования в представление
+    def run_validation(self, *args, **kwargs):
+        with timed_serializer(self, 'validate'):
+            return super().run_validation(*args, **kwargs)
+
+    def to_representation(self, *args, **kwargs):
+        with timed_serializer(self, 'represent'):
+            return super().to_representation(*args, **kwargs)
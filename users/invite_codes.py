@@ -0,0 +1,109 @@
+import os
+import threading
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .models import InviteCodeSequence
+
+
+# Инвайт-код - это биективное отображение номера из общей последовательности в строку
+# из 6 символов. Воркер арендует в БД блок номеров и дальше выдает коды из памяти,
+# поэтому коды никогда не повторяются и не требуют повторных попыток вставки.
+#
+# Первый символ берется из букв G-Z: старые коды (первые 6 символов uuid4) состоят только
+# из шестнадцатеричных символов и потому не могут совпасть с новыми.
+
+ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+FIRST_ALPHABET = 'GHIJKLMNOPQRSTUVWXYZ'
+CODE_LENGTH = 6
+
+TAIL_CAPACITY = len(ALPHABET) ** (CODE_LENGTH - 1)
+CAPACITY = len(FIRST_ALPHABET) * TAIL_CAPACITY
+
+# Умножение на число, взаимно простое с CAPACITY, перемешивает соседние номера,
+# чтобы коды не шли подряд; отображение остается взаимно однозначным
+MULTIPLIER = 1_000_000_007
+OFFSET = 482_193_307
+INVERSE = pow(MULTIPLIER, -1, CAPACITY)
+
+SEQUENCE_NAME = 'invite_code'
+
+
+def encode(number):
+    if not 0 <= number < CAPACITY:
+        raise ValueError('Номер вне диапазона инвайт-кодов')
+
+    value = (number * MULTIPLIER + OFFSET) % CAPACITY
+    first, value = divmod(value, TAIL_CAPACITY)
+    tail = []
+    for _ in range(CODE_LENGTH - 1):
+        value, digit = divmod(value, len(ALPHABET))
+        tail.append(ALPHABET[digit])
+    return FIRST_ALPHABET[first] + ''.join(reversed(tail))
+
+
+def decode(code):
+    if len(code) != CODE_LENGTH or code[0] not in FIRST_ALPHABET:
+        raise ValueError('Некорректный инвайт-код')
+
+    value = FIRST_ALPHABET.index(code[0])
+    for char in code[1:]:
+        value = value * len(ALPHABET) + ALPHABET.index(char)
+    return (value - OFFSET) * INVERSE % CAPACITY
+
+
+def lease_block(size):
+    # Блок арендуется в отдельной короткой транзакции. Внутри внешней транзакции это
+    # запрещено: ее откат вернул бы счетчик назад, и блок выдали бы повторно
+    if connection.in_atomic_block:
+        raise RuntimeError('Блок инвайт-кодов нельзя арендовать внутри транзакции')
+
+    with transaction.atomic():
+        sequence = InviteCodeSequence.objects.select_for_update().get(name=SEQUENCE_NAME)
+        start = sequence.next_value
+        sequence.next_value = start + size
+        sequence.save(update_fields=['next_value'])
+
+    if start + size > CAPACITY:
+        raise RuntimeError('Инвайт-коды закончились')
+    return start
+
+
+class InviteCodeAllocator:
+    def __init__(self, block_size=None, lease=lease_block):
+        self.block_size = block_size or settings.INVITE_CODE_BLOCK_SIZE
+        self._lease = lease
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        # Арендованный блок принадлежит одному процессу: после fork потомок начинает с нового блока
+        self._next = self._end = 0
+
+    def allocate(self):
+        return self.allocate_many(1)[0]
+
+    def allocate_many(self, count):
+        codes = []
+        with self._lock:
+            while len(codes) < count:
+                if self._next >= self._end:
+                    self._next = self._lease(self.block_size)
+                    self._end = self._next + self.block_size
+                take = min(count - len(codes), self._end - self._next)
+                codes.extend(encode(number) for number in range(self._next, self._next + take))
+                self._next += take
+        return codes
+
+
+allocator = InviteCodeAllocator()
+os.register_at_fork(after_in_child=allocator.reset)
+
+
+def allocate_invite_code():
+    return allocator.allocate()
+
+
+def allocate_invite_codes(count):
+    return allocator.allocate_many(count)
@@ -0,0 +1,169 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .metrics import registry
+from .models import ReferralActivity
+from .referrals import iter_referral_counts
+
+logger = logging.getLogger(__name__)
+
+
+# Рейтинг пригласивших за день, неделю и все время. Количество активаций хранится
+# в ReferralActivity по периодам и увеличивается при каждой активации. Топ периода
+# читается из кэша, а при промахе - одним запросом по индексу (period, -count).
+# Между перестроениями топ в кэше обновляется при активациях, но без блокировок:
+# при одновременных активациях обновление может потеряться до следующего перестроения
+# (не позже LEADERBOARD_CACHE_TIMEOUT) или запуска reconcile_leaderboard
+
+WINDOWS = ('day', 'week', 'all')
+UPSERT_VENDORS = {'postgresql', 'sqlite'}
+
+leaderboard_update_errors = registry.counter(
+    'leaderboard_update_errors_total', 'Активации, не учтенные в рейтинге из-за ошибки БД'
+)
+
+
+def period_of(window, day=None):
+    day = day or timezone.localdate()
+    if window == 'day':
+        return f'day:{day.isoformat()}'
+    if window == 'week':
+        year, week, _ = day.isocalendar()
+        return f'week:{year}-W{week:02d}'
+    return 'all'
+
+
+def current_periods():
+    day = timezone.localdate()
+    return [period_of(window, day) for window in WINDOWS]
+
+
+def top_key(period):
+    return f'leaderboard_top_{period}'
+
+
+def count_key(period, invite_code):
+    return f'leaderboard_count_{period}_{invite_code}'
+
+
+def record_activation(invite_code):
+    # Вызывается после успешной активации: +1 коду за день, за неделю и за все время.
+    # Активация к этому моменту уже сохранена, поэтому ошибка рейтинга ее не отменяет: она пишется
+    # в лог и в метрику leaderboard_update_errors_total, рейтинг за все время исправит reconcile_leaderboard
+    periods = current_periods()
+    try:
+        _increment(invite_code, periods)
+        for period in periods:
+            _update_top(period, invite_code)
+    except DatabaseError:
+        leaderboard_update_errors.inc()
+        logger.exception('Не удалось обновить рейтинг для кода %s', invite_code)
+
+
+def _increment(invite_code, periods):
+    # Строки периодов создаются при первой активации кода в периоде. В PostgreSQL и SQLite это
+    # один INSERT ... ON CONFLICT DO UPDATE сразу трех строк, поэтому параллельная активация,
+    # создавшая строки первой, не может «съесть» увеличение
+    if connection.vendor in UPSERT_VENDORS:
+        table = connection.ops.quote_name(ReferralActivity._meta.db_table)
+        rows = ', '.join(['(%s, %s, 1)'] * len(periods))
+        sql = (
+            f'INSERT INTO {table} (period, invite_code, count) VALUES {rows} '
+            f'ON CONFLICT (period, invite_code) DO UPDATE SET count = {table}.count + 1'
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [value for period in periods for value in (period, invite_code)])
+        return
+
+    # В остальных БД недостающие строки сначала создаются с нулем, затем увеличиваются все сразу
+    with transaction.atomic():
+        ReferralActivity.objects.bulk_create(
+            [ReferralActivity(period=period, invite_code=invite_code, count=0) for period in periods],
+            ignore_conflicts=True,
+        )
+        ReferralActivity.objects.filter(invite_code=invite_code, period__in=periods).update(count=F('count') + 1)
+
+
+def _update_top(period, invite_code):
+    # Счетчик кода в кэше есть, только если код попал в топ при последнем перестроении.
+    # Остальные коды попадут в полный топ при следующем перестроении
+    try:
+        count = cache.incr(count_key(period, invite_code))
+    except ValueError:
+        count = None
+
+    top = cache.get(top_key(period))
+    if top is None:
+        return
+
+    ranking = dict(top)
+    if count is None:
+        if invite_code not in ranking:
+            # В неполный топ попадают все коды, поэтому без счетчика его проще перестроить при чтении
+            if len(top) < settings.LEADERBOARD_SIZE:
+                cache.delete(top_key(period))
+            return
+        count = ranking[invite_code] + 1
+    elif invite_code not in ranking and len(top) >= settings.LEADERBOARD_SIZE and count <= top[-1][1]:
+        return
+
+    ranking[invite_code] = count
+    top = sorted(ranking.items(), key=lambda item: (-item[1], item[0]))[:settings.LEADERBOARD_SIZE]
+    cache.set(top_key(period), top, timeout=settings.LEADERBOARD_CACHE_TIMEOUT)
+
+
+def build_top(period):
+    # Топ периода по индексу (period, -count), сохраняется в кэш вместе со счетчиками кодов из него
+    top = list(
+        ReferralActivity.objects.filter(period=period, count__gt=0)
+        .order_by('-count', 'invite_code')
+        .values_list('invite_code', 'count')[:settings.LEADERBOARD_SIZE]
+    )
+    cache.set(top_key(period), top, timeout=settings.LEADERBOARD_CACHE_TIMEOUT)
+    cache.set_many(
+        {count_key(period, code): count for code, count in top},
+        timeout=settings.LEADERBOARD_CACHE_TIMEOUT
+    )
+    return top
+
+
+def get_leaderboard(window, limit=None):
+    period = period_of(window)
+    top = cache.get(top_key(period))
+    if top is None:
+        top = build_top(period)
+    return period, top[:limit or settings.LEADERBOARD_SIZE]
+
+
+def reconcile_leaderboard(batch_size=1000):
+    # Пересчитывает рейтинг за все время по пользователям, удаляет устаревшие периоды
+    # и перестраивает топы в кэше. Возвращает (обновлено строк 'all', удалено устаревших строк)
+    updated = 0
+    for counts in iter_referral_counts(batch_size):
+        ReferralActivity.objects.bulk_create(
+            [ReferralActivity(period='all', invite_code=code, count=count) for code, count in counts.items() if count],
+            update_conflicts=True,
+            unique_fields=['period', 'invite_code'],
+            update_fields=['count'],
+        )
+        ReferralActivity.objects.filter(
+            period='all', invite_code__in=[code for code, count in counts.items() if not count]
+        ).delete()
+        updated += len(counts)
+
+    today = timezone.localdate()
+    expired_day = period_of('day', today - timedelta(days=settings.LEADERBOARD_RETENTION_DAYS))
+    expired_week = period_of('week', today - timedelta(days=settings.LEADERBOARD_RETENTION_DAYS))
+    # Периоды сравниваются как строки: даты и номера недель записаны с ведущими нулями
+    deleted, _ = ReferralActivity.objects.filter(period__startswith='day:', period__lt=expired_day).delete()
+    deleted += ReferralActivity.objects.filter(period__startswith='week:', period__lt=expired_week).delete()[0]
+
+    for period in current_periods():
+        build_top(period)
+    return updated, deleted
@@ -0,0 +1,106 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory, override_settings
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import AccessToken
+
+from users.api_views import ProfileView
+from users.authentication import ClaimsJWTAuthentication, user_cache
+from users.bench import percentile, format_table, test_database
+from users.invite_codes import allocate_invite_codes
+from users.models import User
+from users.referrals import get_referral_count
+from users.services import issue_tokens
+
+from .check_query_counts import LOCAL_CACHES
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает стоимость аутентифицированного запроса профиля: JWTAuthentication с загрузкой '
+        'пользователя из БД, claims в access токене и токен без claims с кэшем пользователей в памяти процесса. '
+        'Запускается на временной тестовой БД'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200, help='Количество пользователей')
+        parser.add_argument('--iterations', type=int, default=5000, help='Количество запросов для каждого варианта')
+
+    def handle(self, *args, **options):
+        # Все пользователи должны помещаться в кэш процесса и в кэш счетчиков, иначе третий вариант
+        # и прогретые счетчики замеряли бы вытеснение, а не аутентификацию
+        if options['users'] > user_cache.max_size:
+            raise CommandError(f'--users не больше {user_cache.max_size} (размер кэша пользователей)')
+        if options['users'] > settings.CACHE_MAX_ENTRIES:
+            raise CommandError(f'--users не больше {settings.CACHE_MAX_ENTRIES} (CACHE_MAX_ENTRIES)')
+
+        with test_database(), override_settings(CACHES=LOCAL_CACHES):
+            rows = self.run(options)
+        self.stdout.write(format_table(rows, ['auth', 'requests_per_sec', 'p50_us', 'p99_us', 'queries_per_request']))
+
+    def run(self, options):
+        codes = allocate_invite_codes(options['users'])
+        users = User.objects.bulk_create([
+            User(phone=f'+7903{index:07d}', invite_code=code) for index, code in enumerate(codes)
+        ])
+        claims_tokens = [issue_tokens(user)['access'] for user in users]
+        plain_tokens = [str(AccessToken.for_user(user)) for user in users]
+
+        variants = [
+            ('JWTAuthentication', JWTAuthentication, plain_tokens),
+            ('claims', ClaimsJWTAuthentication, claims_tokens),
+            ('без claims + кэш процесса', ClaimsJWTAuthentication, plain_tokens),
+        ]
+        rows = []
+        for name, authentication, tokens in variants:
+            self.reset_caches(users)
+            rows.append(self.measure(name, authentication, tokens, options['iterations']))
+        return rows
+
+    def reset_caches(self, users):
+        # Каждый вариант начинается с одинакового состояния: кэш пользователей пуст, счетчики
+        # рефералов прогреты заранее, чтобы замерялась только аутентификация
+        user_cache.clear()
+        cache.clear()
+        for user in users:
+            get_referral_count(user)
+
+    def measure(self, name, authentication, tokens, iterations):
+        view = ProfileView.as_view(authentication_classes=[authentication])
+        factory = RequestFactory()
+        requests = [
+            factory.get('/api/profile/', HTTP_AUTHORIZATION=f'Bearer {tokens[index % len(tokens)]}')
+            for index in range(iterations)
+        ]
+
+        # Запросы к БД только считаются: CaptureQueriesContext хранит не больше 9000 запросов
+        # и на длинном прогоне занизил бы количество
+        queries = 0
+
+        def count_query(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        latencies = []
+        with connection.execute_wrapper(count_query):
+            started = time.perf_counter()
+            for request in requests:
+                request_started = time.perf_counter()
+                response = view(request)
+                latencies.append(time.perf_counter() - request_started)
+                if response.status_code != 200:
+                    raise CommandError(f'{name}: неожиданный ответ {response.status_code} {response.data}')
+            elapsed = time.perf_counter() - started
+
+        return {
+            'auth': name,
+            'requests_per_sec': round(iterations / elapsed),
+            'p50_us': round(percentile(latencies, 50) * 1_000_000),
+            'p99_us': round(percentile(latencies, 99) * 1_000_000),
+            'queries_per_request': round(queries / iterations, 3),
+        }
@@ -0,0 +1,97 @@
+import json
+import logging
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from users.bench import percentile, format_table, test_database, seed_referral_tree
+from users.services import issue_tokens
+
+from .check_query_counts import LOCAL_CACHES
+
+SERVICE_TOKEN = 'bench-service-token'
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает получение профилей многих пользователей запросом /api/profile/ на каждого '
+        'и пакетным эндпоинтом /api/internal/profiles/ с разным размером пакета. Запускается на временной тестовой БД'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=5000, help='Количество пользователей в дереве')
+        parser.add_argument('--fanout', type=int, default=10, help='Количество рефералов у узла')
+        parser.add_argument('--lookups', type=int, default=2000, help='Сколько профилей запросить в каждом режиме')
+        parser.add_argument(
+            '--batch-sizes', type=int, nargs='+', default=[10, 100, 1000], help='Размеры пакетов для сравнения'
+        )
+
+    def handle(self, *args, **options):
+        logging.getLogger('users.metrics').setLevel(logging.WARNING)
+
+        lookups = min(options['lookups'], options['users'])
+        max_size = max(options['batch_sizes'])
+        with test_database(), override_settings(
+            CACHES=LOCAL_CACHES, ALLOWED_HOSTS=['testserver'],
+            SERVICE_TOKENS={'bench': SERVICE_TOKEN}, BATCH_PROFILES_MAX_SIZE=max_size,
+        ):
+            users = seed_referral_tree(options['users'], 'balanced', options['fanout'])[:lookups]
+            rows = [self.per_user(users)]
+            rows.extend(self.batched(users, size) for size in options['batch_sizes'])
+
+        self.stdout.write(format_table(
+            rows, ['mode', 'requests', 'users_per_s', 'p50_ms', 'p99_ms', 'queries_per_request']
+        ))
+
+    def per_user(self, users):
+        # Токены выпускаются заранее: сервисы сейчас тоже ходят с уже готовыми токенами пользователей
+        tokens = [issue_tokens(user)['access'] for user in users]
+        cache.clear()
+        client = Client()
+
+        def request(token):
+            response = client.get('/api/profile/', HTTP_AUTHORIZATION=f'Bearer {token}')
+            if response.status_code != 200:
+                raise CommandError(f'/api/profile/: неожиданный ответ {response.status_code}')
+
+        return self.measure('per-user', tokens, request, len(users))
+
+    def batched(self, users, size):
+        cache.clear()
+        client = Client()
+        batches = [[user.pk for user in users[start:start + size]] for start in range(0, len(users), size)]
+
+        def request(ids):
+            response = client.post(
+                '/api/internal/profiles/', json.dumps({'ids': ids}), content_type='application/json',
+                HTTP_AUTHORIZATION=f'Service {SERVICE_TOKEN}'
+            )
+            if response.status_code != 200:
+                raise CommandError(f'/api/internal/profiles/: неожиданный ответ {response.status_code}')
+            if len(json.loads(b''.join(response.streaming_content))['results']) != len(ids):
+                raise CommandError('/api/internal/profiles/: найдены не все пользователи')
+
+        return self.measure(f'batch {size}', batches, request, len(users))
+
+    def measure(self, mode, items, request, users):
+        latencies = []
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            for item in items:
+                request_started = time.perf_counter()
+                request(item)
+                latencies.append(time.perf_counter() - request_started)
+            elapsed = time.perf_counter() - started
+
+        return {
+            'mode': mode,
+            'requests': len(items),
+            'users_per_s': round(users / elapsed, 1),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+            'queries_per_request': round(len(queries) / len(items), 2),
+        }
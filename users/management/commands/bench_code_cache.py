@@ -0,0 +1,79 @@
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.management.commands.createcachetable import Command as CreateCacheTableCommand
+from django.db import connection
+from django.utils.module_loading import import_string
+
+from users.bench import percentile, format_table
+
+BENCH_TABLE = 'cache_bench_codes'
+
+
+class Command(BaseCommand):
+    help = (
+        'Измеряет стоимость обращения к кэшу кодов подтверждения (запись, чтение, '
+        'проверка с удалением) для каждого бэкенда кэша'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--backend', action='append', choices=list(settings.CACHE_BACKENDS),
+            help='Бэкенд для замера, можно указать несколько раз. По умолчанию все, кроме redis'
+        )
+        parser.add_argument('--iterations', type=int, default=2000, help='Количество операций каждого типа')
+        parser.add_argument('--redis-url', default=settings.REDIS_URL, help='Адрес Redis-совместимого сервера')
+
+    def handle(self, *args, **options):
+        backends = options['backend'] or ['locmem', 'file', 'db']
+        rows = []
+        with tempfile.TemporaryDirectory() as cache_dir:
+            locations = {
+                'locmem': 'bench-codes',
+                'file': cache_dir,
+                'db': BENCH_TABLE,
+                'redis': options['redis_url'],
+            }
+            for backend in backends:
+                if backend == 'db':
+                    command = CreateCacheTableCommand()
+                    command.verbosity = 0
+                    command.create_table('default', BENCH_TABLE, False)
+                try:
+                    cache = import_string(settings.CACHE_BACKENDS[backend])(locations[backend], {})
+                    rows.extend(self.measure(backend, cache, options['iterations']))
+                    cache.close()
+                finally:
+                    if backend == 'db':
+                        with connection.cursor() as cursor:
+                            cursor.execute(f'DROP TABLE {connection.ops.quote_name(BENCH_TABLE)}')
+
+        self.stdout.write(format_table(rows, ['backend', 'operation', 'ops_per_sec', 'mean_us', 'p99_us']))
+
+    def measure(self, backend, cache, iterations):
+        phones = [f'+7900{index:07d}' for index in range(iterations)]
+        operations = [
+            ('set', lambda phone: cache.set(f'code_{phone}', '1234', timeout=300)),
+            ('get', lambda phone: cache.get(f'code_{phone}')),
+            # Чтение и атомарное удаление, как при успешной проверке кода в CacheOTPStore
+            ('consume', lambda phone: cache.get(f'code_{phone}') == '1234' and cache.delete(f'code_{phone}')),
+        ]
+
+        rows = []
+        for name, operation in operations:
+            timings = []
+            for phone in phones:
+                started = time.perf_counter()
+                operation(phone)
+                timings.append(time.perf_counter() - started)
+            total = sum(timings)
+            rows.append({
+                'backend': backend,
+                'operation': name,
+                'ops_per_sec': round(len(timings) / total) if total else 0,
+                'mean_us': round(total / len(timings) * 1e6, 1),
+                'p99_us': round(percentile(timings, 99) * 1e6, 1),
+            })
+        return rows
@@ -0,0 +1,140 @@
+import importlib.util
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection
+from django.db.backends.signals import connection_created
+from django.test import Client, override_settings
+
+from users.bench import summarize, format_table, test_database, seed_referral_tree
+from users.services import issue_tokens
+
+from .check_query_counts import LOCAL_CACHES
+
+# Способы работы с соединениями: новое соединение на каждый запрос (как было до DB_CONN_MAX_AGE),
+# постоянное соединение на поток с проверкой перед переиспользованием и пул psycopg 3
+MODES = {
+    'per-request': {'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': False},
+    'persistent': {'CONN_MAX_AGE': 600, 'CONN_HEALTH_CHECKS': True},
+    'pool': {'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': False},
+}
+
+
+def pool_available():
+    if connection.vendor != 'postgresql':
+        return False
+    from django.db.backends.postgresql.psycopg_any import is_psycopg3
+    return is_psycopg3 and importlib.util.find_spec('psycopg_pool') is not None
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает задержку запросов и количество открытых соединений с БД: соединение на запрос, '
+        'постоянные соединения и пул psycopg 3 (только PostgreSQL). Запускается на временной тестовой БД'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=1000, help='Количество запросов в каждом режиме')
+        parser.add_argument('--concurrency', type=int, default=4, help='Количество одновременных клиентов')
+        parser.add_argument(
+            '--modes', nargs='+', choices=list(MODES), default=None,
+            help='Режимы для сравнения, по умолчанию все доступные для текущей БД'
+        )
+
+    def handle(self, *args, **options):
+        logging.getLogger('users.metrics').setLevel(logging.WARNING)
+
+        modes = options['modes'] or [mode for mode in MODES if mode != 'pool' or pool_available()]
+        if 'pool' in modes and not pool_available():
+            raise CommandError('Пул соединений доступен только для PostgreSQL с установленным psycopg[pool]')
+
+        connects = 0
+        lock = threading.Lock()
+
+        def count_connect(sender, **kwargs):
+            nonlocal connects
+            with lock:
+                connects += 1
+
+        rows = []
+        connection_created.connect(count_connect)
+        try:
+            with test_database(shared_file=True), override_settings(CACHES=LOCAL_CACHES, ALLOWED_HOSTS=['testserver']):
+                inviter = seed_referral_tree(20, 'flat')[0]
+                token = issue_tokens(inviter)['access']
+                for mode in modes:
+                    with self.configured(mode, options['concurrency']):
+                        connects = 0
+                        result = self.run(token, options['requests'], options['concurrency'])
+                        if mode == 'pool':
+                            # Соединение выдается из пула на каждый запрос, открытыми считаются соединения пула
+                            result['new_connections'] = connection.pool.get_stats()['connections_num']
+                        else:
+                            result['new_connections'] = connects
+                    rows.append({'mode': mode, **result})
+        finally:
+            connection_created.disconnect(count_connect)
+
+        self.stdout.write(format_table(
+            rows, ['mode', 'requests', 'errors', 'new_connections', 'rps', 'p50_ms', 'p95_ms', 'p99_ms']
+        ))
+
+    @contextmanager
+    def configured(self, mode, concurrency):
+        saved = {
+            key: settings.DATABASES['default'].get(key) for key in ('CONN_MAX_AGE', 'CONN_HEALTH_CHECKS', 'OPTIONS')
+        }
+        options = {key: value for key, value in (saved['OPTIONS'] or {}).items() if key != 'pool'}
+        if mode == 'pool':
+            options['pool'] = {'min_size': concurrency, 'max_size': concurrency}
+        self.apply({**MODES[mode], 'OPTIONS': options})
+        try:
+            yield
+        finally:
+            if mode == 'pool':
+                connection.close_pool()
+            self.apply(saved)
+
+    def apply(self, values):
+        # Потоки создают соединения по settings.DATABASES, основной поток - по своему settings_dict
+        connection.close()
+        for settings_dict in (settings.DATABASES['default'], connection.settings_dict):
+            settings_dict.update(values)
+
+    def run(self, token, requests, concurrency):
+        latencies = []
+        errors = 0
+        lock = threading.Lock()
+
+        def worker(count):
+            nonlocal errors
+            client = Client(HTTP_AUTHORIZATION=f'Bearer {token}')
+            try:
+                for _ in range(count):
+                    # Тестовый клиент не закрывает соединения по сигналам request_started/request_finished,
+                    # поэтому здесь это делается так же, как в обработчике WSGI-сервера
+                    started = time.perf_counter()
+                    close_old_connections()
+                    response = client.get('/api/referrals/')
+                    close_old_connections()
+                    elapsed = time.perf_counter() - started
+                    with lock:
+                        latencies.append(elapsed)
+                        errors += response.status_code != 200
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=worker, args=(len(range(index, requests, concurrency)),))
+            for index in range(concurrency)
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return summarize(latencies, time.perf_counter() - started, errors)
@@ -0,0 +1,70 @@
+import itertools
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+
+from users.bench import format_table
+from users.invite_codes import InviteCodeAllocator, ALPHABET
+
+
+class Command(BaseCommand):
+    help = (
+        'Измеряет скорость выдачи инвайт-кодов и долю коллизий для нового аллокатора '
+        'и для прежней генерации из uuid4'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=10_000_000, help='Количество кодов для замера')
+        parser.add_argument(
+            '--db-count', type=int, default=10_000,
+            help='Количество кодов, выдаваемых с арендой блоков в БД (расходует номера настоящей последовательности)'
+        )
+        parser.add_argument('--block-size', type=int, default=1000, help='Размер арендуемого блока')
+
+    def handle(self, *args, **options):
+        count = options['count']
+        rows = []
+
+        # Аллокатор без БД: блоки выдаются из памяти, замеряется только кодирование
+        blocks = itertools.count(0, options['block_size'])
+        allocator = InviteCodeAllocator(options['block_size'], lease=lambda size: next(blocks))
+        rows.append(self.measure('allocator', lambda n: allocator.allocate_many(n), count, base=len(ALPHABET)))
+
+        # Аллокатор с арендой блоков в БД (блоки расходуются из настоящей последовательности)
+        allocator = InviteCodeAllocator(options['block_size'])
+        rows.append(self.measure('allocator+db', lambda n: allocator.allocate_many(n), options['db_count'], base=len(ALPHABET)))
+
+        rows.append(self.measure(
+            'uuid4[:6]', lambda n: [str(uuid.uuid4())[:6].upper() for _ in range(n)], count, base=16
+        ))
+
+        self.stdout.write(format_table(rows, ['generator', 'codes', 'codes_per_sec', 'duplicates', 'collision_rate']))
+
+    def measure(self, name, generate, count, base):
+        # Уникальность проверяется битовой картой по числовому значению кода
+        seen = bytearray(base ** 6 // 8 + 1)
+        duplicates = 0
+        elapsed = 0.0
+
+        for chunk_start in range(0, count, 100_000):
+            chunk = min(100_000, count - chunk_start)
+            started = time.perf_counter()
+            codes = generate(chunk)
+            elapsed += time.perf_counter() - started
+
+            for code in codes:
+                value = int(code, base)
+                byte, bit = divmod(value, 8)
+                if seen[byte] & (1 << bit):
+                    duplicates += 1
+                else:
+                    seen[byte] |= 1 << bit
+
+        return {
+            'generator': name,
+            'codes': count,
+            'codes_per_sec': round(count / elapsed) if elapsed else 0,
+            'duplicates': duplicates,
+            'collision_rate': f'{duplicates / count:.4%}' if count else '0',
+        }
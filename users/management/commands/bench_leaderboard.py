@@ -0,0 +1,81 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+
+from users.bench import percentile, format_table, test_database, seed_referral_tree
+from users.leaderboard import build_top, get_leaderboard, reconcile_leaderboard, top_key
+from users.models import User
+
+from .check_query_counts import LOCAL_CACHES
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает способы чтения рейтинга пригласивших за все время: GROUP BY по пользователям на каждый '
+        'запрос, запрос к таблице ReferralActivity и топ из кэша. Запускается на временной тестовой БД'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100_000, help='Количество пользователей в дереве')
+        parser.add_argument('--shape', choices=['flat', 'chain', 'balanced'], default='balanced', help='Форма дерева')
+        parser.add_argument('--fanout', type=int, default=10, help='Количество рефералов у узла для --shape balanced')
+        parser.add_argument('--reads', type=int, default=200, help='Количество чтений рейтинга каждым способом')
+
+    def handle(self, *args, **options):
+        logging.getLogger('users.metrics').setLevel(logging.WARNING)
+
+        with test_database(), override_settings(CACHES=LOCAL_CACHES):
+            seed_referral_tree(options['users'], options['shape'], options['fanout'])
+            started = time.perf_counter()
+            reconcile_leaderboard()
+            self.stdout.write(f'Рейтинг пересчитан за {time.perf_counter() - started:.2f} с')
+
+            def group_by():
+                return list(
+                    User.objects.filter(activated_invite_code__isnull=False)
+                    .values('activated_invite_code')
+                    .annotate(count=Count('pk'))
+                    .order_by('-count', 'activated_invite_code')
+                    .values_list('activated_invite_code', 'count')[:settings.LEADERBOARD_SIZE]
+                )
+
+            def table():
+                cache.delete(top_key('all'))
+                return build_top('all')
+
+            def cached():
+                return get_leaderboard('all')[1]
+
+            expected = group_by()
+            rows = [
+                self.measure(name, read, expected, options['reads'])
+                for name, read in (('group_by', group_by), ('table', table), ('cache', cached))
+            ]
+
+        self.stdout.write(format_table(rows, ['method', 'p50_ms', 'p99_ms', 'queries_per_read']))
+
+    def measure(self, name, read, expected, reads):
+        latencies = []
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(reads):
+                started = time.perf_counter()
+                top = read()
+                latencies.append(time.perf_counter() - started)
+
+        # Все способы обязаны давать одинаковый топ
+        if [tuple(entry) for entry in top] != [tuple(entry) for entry in expected]:
+            raise CommandError(f'{name}: топ расходится с подсчетом по пользователям')
+
+        return {
+            'method': name,
+            'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+            'queries_per_read': round(len(queries) / reads, 2),
+        }
@@ -0,0 +1,83 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache.backends.db import DatabaseCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.commands.createcachetable import Command as CreateCacheTableCommand
+
+from users.bench import percentile, format_table, test_database
+from users.otp import MemoryOTPStore, CacheOTPStore, DatabaseOTPStore, RedisOTPStore, VERIFIED, INVALID
+
+BENCH_TABLE = 'cache_bench_otp'
+STORES = ('memory', 'cache-locmem', 'cache-db', 'db', 'redis')
+
+
+class Command(BaseCommand):
+    help = (
+        'Измеряет скорость выдачи и проверки кодов подтверждения (верный и неверный код) '
+        'для каждого хранилища OTP. Запускается на временной тестовой БД'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--store', action='append', choices=STORES,
+            help='Хранилище для замера, можно указать несколько раз. По умолчанию все, кроме redis'
+        )
+        parser.add_argument('--iterations', type=int, default=2000, help='Количество операций каждого типа')
+        parser.add_argument('--redis-url', default=settings.OTP_REDIS_URL, help='Адрес Redis-совместимого сервера')
+
+    def handle(self, *args, **options):
+        logging.getLogger('users.metrics').setLevel(logging.WARNING)
+
+        # Коды всех номеров должны поместиться в кэш без вытеснения
+        options['cache_options'] = {'MAX_ENTRIES': options['iterations'] * 2 + 1}
+        rows = []
+        with test_database():
+            command = CreateCacheTableCommand()
+            command.verbosity = 0
+            command.create_table('default', BENCH_TABLE, False)
+            for name in options['store'] or [store for store in STORES if store != 'redis']:
+                rows.extend(self.measure(name, self.create_store(name, options), options['iterations']))
+
+        self.stdout.write(format_table(rows, ['store', 'operation', 'ops_per_sec', 'mean_us', 'p99_us']))
+
+    def create_store(self, name, options):
+        if name == 'memory':
+            return MemoryOTPStore()
+        if name == 'cache-locmem':
+            return CacheOTPStore(cache=LocMemCache('bench-otp', {'OPTIONS': options['cache_options']}))
+        if name == 'cache-db':
+            return CacheOTPStore(cache=DatabaseCache(BENCH_TABLE, {'OPTIONS': options['cache_options']}))
+        if name == 'db':
+            return DatabaseOTPStore()
+        return RedisOTPStore(url=options['redis_url'])
+
+    def measure(self, name, store, iterations):
+        phones = [f'+7900{index:07d}' for index in range(iterations)]
+        # Неверная попытка перед верной, как при опечатке: код после нее остается действительным
+        operations = [
+            ('issue', lambda phone: store.issue(phone, '1234'), None),
+            ('verify-invalid', lambda phone: store.verify(phone, '4321'), INVALID),
+            ('verify', lambda phone: store.verify(phone, '1234'), VERIFIED),
+        ]
+
+        rows = []
+        for operation, call, expected in operations:
+            timings = []
+            for phone in phones:
+                started = time.perf_counter()
+                result = call(phone)
+                timings.append(time.perf_counter() - started)
+                if expected is not None and result != expected:
+                    raise CommandError(f'{name}: {operation} вернул {result} вместо {expected}')
+            total = sum(timings)
+            rows.append({
+                'store': name,
+                'operation': operation,
+                'ops_per_sec': round(len(timings) / total) if total else 0,
+                'mean_us': round(total / len(timings) * 1e6, 1),
+                'p99_us': round(percentile(timings, 99) * 1e6, 1),
+            })
+        return rows
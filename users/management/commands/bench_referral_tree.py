@@ -0,0 +1,63 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from users.bench import percentile, format_table, test_database, seed_referral_tree
+from users.referral_tree import RECURSIVE_CTE_VENDORS, get_downline, rebuild_referral_paths
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает способы подсчета многоуровневой реферальной сети: материализованный путь, '
+        'рекурсивный CTE и запрос на каждый уровень. Запускается на временной тестовой БД'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100_000, help='Количество пользователей в дереве')
+        parser.add_argument('--shape', choices=['flat', 'chain', 'balanced'], default='balanced', help='Форма дерева')
+        parser.add_argument('--fanout', type=int, default=10, help='Количество рефералов у узла для --shape balanced')
+        parser.add_argument('--depth', type=int, default=10, help='Глубина запроса')
+        parser.add_argument('--samples', type=int, default=50, help='Количество пользователей для замера')
+
+    def handle(self, *args, **options):
+        methods = ['path', 'levels']
+        if connection.vendor in RECURSIVE_CTE_VENDORS:
+            methods.insert(1, 'cte')
+
+        with test_database():
+            users = seed_referral_tree(options['users'], options['shape'], options['fanout'])
+            started = time.perf_counter()
+            rebuild_referral_paths()
+            self.stdout.write(f'Пути построены за {time.perf_counter() - started:.2f} с')
+
+            # Корень дерева и случайные пользователи: от самой большой сети до пустой
+            samples = [users[0]] + random.sample(users, min(options['samples'], len(users)) - 1)
+            rows = [self.measure(method, samples, options['depth']) for method in methods]
+
+        self.stdout.write(format_table(rows, ['method', 'root_size', 'root_ms', 'p50_ms', 'p99_ms', 'queries']))
+
+    def measure(self, method, samples, depth):
+        latencies = []
+        results = []
+        with CaptureQueriesContext(connection) as queries:
+            for user in samples:
+                started = time.perf_counter()
+                results.append(get_downline(user, depth, method))
+                latencies.append(time.perf_counter() - started)
+
+        # Все способы обязаны давать одинаковый результат
+        expected = [get_downline(user, depth, 'levels') for user in samples]
+        if results != expected:
+            raise CommandError(f'{method}: результат расходится с подсчетом по уровням')
+
+        return {
+            'method': method,
+            'root_size': results[0]['size'],
+            'root_ms': round(latencies[0] * 1000, 2),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+            'queries': len(queries),
+        }
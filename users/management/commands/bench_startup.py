@@ -0,0 +1,119 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from users.bench import percentile, format_table
+
+# Запускается в отдельном процессе: загрузка приложения так же, как в воркере gunicorn
+# (модуль wsgi или asgi), плюс импорт urlconf, который иначе произошел бы на первом запросе
+STARTUP_SCRIPT = """
+import json, os, sys, time
+started = time.perf_counter()
+import importlib
+
+# Пакеты, которых нет в образе продакшена: None в sys.modules - модуль не найден
+for name in filter(None, os.environ.get('BENCH_STARTUP_BLOCK', '').split(',')):
+    sys.modules[name] = None
+
+importlib.import_module(sys.argv[1])
+from django.urls import get_resolver
+get_resolver().url_patterns
+elapsed = time.perf_counter() - started
+with open('/proc/self/status') as f:
+    rss = next(int(line.split()[1]) for line in f if line.startswith('VmRSS:'))
+print(json.dumps({'startup_s': elapsed, 'rss_kb': rss, 'modules': len(sys.modules)}))
+"""
+
+# Пакеты из requirements-docs.txt и requirements-dev.txt. DRF импортирует yaml, uritemplate,
+# inflection и requests при старте, если они установлены
+DEV_PACKAGES = (
+    'drf_spectacular', 'drf_spectacular_sidecar', 'yaml', 'uritemplate', 'inflection', 'jsonschema',
+    'requests',
+)
+
+# Варианты запуска: документация API включена (drf-spectacular загружается при старте),
+# выключена, и выключена без пакетов документации и разработки, как в образе продакшена
+VARIANTS = {
+    'docs': {'API_DOCS': '1'},
+    'no-docs': {'API_DOCS': '0'},
+    'image': {'API_DOCS': '0', 'BENCH_STARTUP_BLOCK': ','.join(DEV_PACKAGES)},
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Измеряет время загрузки приложения и занимаемую память (RSS) в новом процессе, '
+        'как при старте воркера gunicorn, с документацией API и без нее'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help='Количество запусков каждого варианта')
+        parser.add_argument('--server-mode', choices=['wsgi', 'asgi'], default='wsgi', help='Загружаемое приложение')
+        parser.add_argument(
+            '--variant', action='append', choices=list(VARIANTS),
+            help='Вариант для замера, можно указать несколько раз. По умолчанию все'
+        )
+        parser.add_argument(
+            '--top', type=int, default=0,
+            help='Показать N модулей, дольше всего импортирующихся в первом варианте (python -X importtime)'
+        )
+
+    def handle(self, *args, **options):
+        if not os.path.exists('/proc/self/status'):
+            raise CommandError('Замер RSS поддерживается только в Linux')
+
+        module = f'referral_system.{options["server_mode"]}'
+        variants = options['variant'] or list(VARIANTS)
+        rows = []
+        for variant in variants:
+            results = [self.start(module, VARIANTS[variant]) for _ in range(options['runs'])]
+            timings = [result['startup_s'] for result in results]
+            rows.append({
+                'variant': variant,
+                'runs': len(results),
+                'startup_p50_ms': round(percentile(timings, 50) * 1000, 1),
+                'startup_max_ms': round(max(timings) * 1000, 1),
+                'rss_mb': round(max(result['rss_kb'] for result in results) / 1024, 1),
+                'modules': results[-1]['modules'],
+            })
+
+        self.stdout.write(format_table(
+            rows, ['variant', 'runs', 'startup_p50_ms', 'startup_max_ms', 'rss_mb', 'modules']
+        ))
+        if options['top']:
+            self.stdout.write('')
+            self.stdout.write(self.import_times(module, VARIANTS[variants[0]], options['top']))
+
+    def run_script(self, module, env, *flags):
+        return subprocess.run(
+            [sys.executable, *flags, '-c', STARTUP_SCRIPT, module],
+            # DEBUG выключен, как под gunicorn, если не задан явно
+            env={'DEBUG': '0', **os.environ, 'DJANGO_SETTINGS_MODULE': 'referral_system.settings', **env},
+            cwd=settings.BASE_DIR, capture_output=True, text=True, check=False,
+        )
+
+    def start(self, module, env):
+        process = self.run_script(module, env)
+        if process.returncode != 0:
+            raise CommandError(f'Приложение не загрузилось:\n{process.stderr}')
+        return json.loads(process.stdout.strip().splitlines()[-1])
+
+    def import_times(self, module, env, top):
+        # Строки -X importtime: "import time: self | cumulative | module", вложенность - отступом имени
+        process = self.run_script(module, env, '-X', 'importtime')
+        rows = []
+        for line in process.stderr.splitlines():
+            parts = line.removeprefix('import time:').split('|')
+            if len(parts) != 3 or not parts[1].strip().isdigit():
+                continue
+            name = parts[2].rstrip()
+            # Только импорты верхнего уровня, вложенные уже учтены в их cumulative
+            if name.startswith('  '):
+                continue
+            rows.append({'module': name.strip(), 'cumulative_ms': round(int(parts[1]) / 1000, 1)})
+        rows.sort(key=lambda row: row['cumulative_ms'], reverse=True)
+        return format_table(rows[:top], ['module', 'cumulative_ms'])
@@ -0,0 +1,236 @@
+import itertools
+import json
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from users.bench import summarize, format_table, test_database, load_postman_flow, render_template, \
+    seed_referral_tree
+from users.referral_tree import rebuild_referral_paths
+
+from .check_query_counts import LOCAL_CACHES
+
+# Метрики, по которым результат сравнивается с базовым: для задержек и пропускной
+# способности допускается отклонение --tolerance, количество SQL-запросов расти не должно.
+# p99 на сотнях запросов слишком шумный для автоматической проверки и только выводится
+LATENCY_METRICS = ('p50_ms', 'p95_ms')
+
+
+class Command(BaseCommand):
+    help = (
+        'Воспроизводимый бенчмарк: поднимает приложение на временной тестовой БД, создает пользователей '
+        'с деревом рефералов заданной формы и прогоняет сценарий из postman_collection.json '
+        '(запрос кода -> проверка кода -> профиль -> активация) в несколько потоков. '
+        'Сообщает пропускную способность, p50/p95/p99 и количество SQL-запросов на запрос, '
+        'и завершается с ошибкой при регрессии относительно сохраненного базового результата'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--collection', default=str(settings.BASE_DIR / 'postman_collection.json'),
+            help='Коллекция Postman со сценарием'
+        )
+        parser.add_argument('--users', type=int, default=1000, help='Количество заранее созданных пользователей')
+        parser.add_argument(
+            '--shape', choices=['flat', 'chain', 'balanced'], default='balanced',
+            help='Форма дерева рефералов: все у одного, цепочка или сбалансированное дерево'
+        )
+        parser.add_argument('--fanout', type=int, default=10, help='Количество рефералов у узла для --shape balanced')
+        parser.add_argument('--iterations', type=int, default=200, help='Количество прогонов сценария')
+        parser.add_argument('--concurrency', type=int, default=8, help='Количество одновременных клиентов')
+        parser.add_argument(
+            '--cache', choices=['configured', 'locmem'], default='configured',
+            help='Кэши на время прогона: из настроек или в памяти процесса'
+        )
+        parser.add_argument('--seed', type=int, default=0, help='Начальное значение для перемешивания пользователей')
+        parser.add_argument('--baseline', help='JSON с базовым результатом для сравнения')
+        parser.add_argument('--save-baseline', help='Сохранить результат как базовый в указанный файл')
+        parser.add_argument(
+            '--tolerance', type=float, default=0.25,
+            help='Допустимое ухудшение задержек и пропускной способности относительно базового, доля'
+        )
+        parser.add_argument(
+            '--min-delta-ms', type=float, default=5,
+            help='Рост задержки меньше этого значения регрессией не считается (шум на быстрых запросах)'
+        )
+
+    def handle(self, *args, **options):
+        steps, variables = load_postman_flow(options['collection'])
+        if not steps:
+            raise CommandError('В коллекции нет запросов')
+
+        # Построчный лог MetricsMiddleware и предупреждения о 4xx здесь только мешают таблице с результатами
+        logging.getLogger('users.metrics').setLevel(logging.WARNING)
+        logging.getLogger('django.request').setLevel(logging.ERROR)
+
+        # Одинаковые названия шагов (профиль запрашивается дважды) различаются номером
+        seen = defaultdict(int)
+        for step in steps:
+            seen[step['name']] += 1
+            if seen[step['name']] > 1:
+                step['name'] = f'{step["name"]} ({seen[step["name"]]})'
+
+        caches = LOCAL_CACHES if options['cache'] == 'locmem' else settings.CACHES
+        if (connection.vendor == 'sqlite' and options['concurrency'] > 1
+                and any(config['BACKEND'].endswith('DatabaseCache') for config in caches.values())):
+            # DatabaseCache молча пропускает запись, если SQLite заблокирован другим потоком
+            self.stderr.write(self.style.WARNING(
+                'Кэш в SQLite теряет записи при одновременных запросах, коды подтверждения будут отклоняться. '
+                'Используйте --cache locmem или --concurrency 1'
+            ))
+
+        with test_database(shared_file=True), override_settings(CACHES=caches, ALLOWED_HOSTS=['testserver']):
+            seeded = seed_referral_tree(options['users'], options['shape'], options['fanout'])
+            if settings.REFERRAL_PATHS_ENABLED:
+                rebuild_referral_paths()
+            # Пользователи из дерева перемешиваются и берутся по очереди: один и тот же
+            # пользователь в параллельных прогонах затер бы свой код подтверждения
+            phones = [user.phone for user in seeded]
+            random.Random(options['seed']).shuffle(phones)
+            result = self.run(steps, variables, phones, options)
+
+        rows = [{'step': name, **stats} for name, stats in result['steps'].items()]
+        rows.append({'step': 'Всего', **result['total']})
+        self.stdout.write(format_table(
+            rows, ['step', 'requests', 'errors', 'rps', 'p50_ms', 'p95_ms', 'p99_ms', 'queries_per_request']
+        ))
+
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w', encoding='utf-8') as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+            self.stdout.write(f'Базовый результат сохранен в {options["save_baseline"]}')
+
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as f:
+                baseline = json.load(f)
+            regressions = self.compare(result, baseline, options['tolerance'], options['min_delta_ms'])
+            if regressions:
+                raise CommandError('Регрессия относительно базового результата:\n' + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS('Регрессий относительно базового результата нет'))
+
+        errors = result['total']['errors']
+        if errors:
+            raise CommandError(f'Ошибок в запросах: {errors}')
+
+    def run(self, steps, variables, seeded_phones, options):
+        # Префикс пути API берется из base_url коллекции, хост не важен: запросы идут в приложение напрямую
+        base_path = urlsplit(render_template(variables.get('base_url', ''), variables)).path.rstrip('/')
+        latencies = defaultdict(list)
+        queries = defaultdict(int)
+        errors = defaultdict(int)
+        lock = threading.Lock()
+        counter = itertools.count()
+
+        def replay(client):
+            # Первый пользователь сценария берется из созданного дерева, если оно есть, второй - всегда новый
+            iteration = next(counter)
+            scope = dict(variables)
+            if seeded_phones:
+                scope['user1_phone'] = seeded_phones[iteration % len(seeded_phones)]
+            else:
+                scope['user1_phone'] = f'+7906{iteration:07d}'
+            scope['user2_phone'] = f'+7905{iteration:07d}'
+            # Каждый прогон - отдельный клиент со своим IP, как при настоящей нагрузке,
+            # иначе все запросы упрутся в ограничение частоты по IP
+            client.defaults['REMOTE_ADDR'] = f'10.{iteration >> 16 & 255}.{iteration >> 8 & 255}.{iteration & 255}'
+
+            for step in steps:
+                path = urlsplit(render_template(step['url'], scope)).path
+                # Путь без завершающего слеша привел бы к редиректу CommonMiddleware
+                path = base_path + path[len(base_path):].rstrip('/') + '/'
+                headers = {
+                    f'HTTP_{key.upper().replace("-", "_")}': render_template(value, scope)
+                    for key, value in step['headers'].items() if key.lower() != 'content-type'
+                }
+                body = render_template(step['body'], scope) or None
+
+                started = time.perf_counter()
+                with CaptureQueriesContext(connection) as captured:
+                    response = client.generic(step['method'], path, body, content_type='application/json', **headers)
+                elapsed = time.perf_counter() - started
+
+                with lock:
+                    latencies[step['name']].append(elapsed)
+                    queries[step['name']] += len(captured)
+                    if response.status_code >= 400:
+                        errors[step['name']] += 1
+
+                if response.status_code >= 400:
+                    # Следующие шаги зависят от данных из ответа, продолжать прогон нет смысла
+                    return
+                if step['captures']:
+                    data = response.json()
+                    for variable, field in step['captures'].items():
+                        scope[variable] = data.get(field, '')
+
+        def worker(count):
+            client = Client()
+            try:
+                for _ in range(count):
+                    replay(client)
+            finally:
+                connection.close()
+
+        per_worker = [len(range(index, options['iterations'], options['concurrency'])) for index in range(options['concurrency'])]
+        threads = [threading.Thread(target=worker, args=(count,)) for count in per_worker]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        result = {
+            'config': {
+                key: options[key] for key in ('users', 'shape', 'fanout', 'iterations', 'concurrency', 'cache', 'seed')
+            },
+            'steps': {},
+        }
+        for step in steps:
+            name = step['name']
+            count = len(latencies[name])
+            result['steps'][name] = {
+                **summarize(latencies[name], elapsed, errors[name]),
+                'queries_per_request': round(queries[name] / count, 2) if count else 0,
+            }
+
+        all_latencies = [latency for values in latencies.values() for latency in values]
+        result['total'] = {
+            **summarize(all_latencies, elapsed, sum(errors.values())),
+            'queries_per_request': round(sum(queries.values()) / len(all_latencies), 2) if all_latencies else 0,
+        }
+        return result
+
+    def compare(self, result, baseline, tolerance, min_delta_ms):
+        regressions = []
+        if baseline.get('config') != result['config']:
+            regressions.append(f'Параметры прогона отличаются от базовых: {baseline.get("config")}')
+            return regressions
+
+        current = {**result['steps'], 'Всего': result['total']}
+        expected = {**baseline['steps'], 'Всего': baseline['total']}
+        for name, base in expected.items():
+            stats = current.get(name)
+            if stats is None:
+                regressions.append(f'{name}: шаг отсутствует в текущем прогоне')
+                continue
+            for metric in LATENCY_METRICS:
+                if stats[metric] > base[metric] * (1 + tolerance) and stats[metric] - base[metric] > min_delta_ms:
+                    regressions.append(f'{name}: {metric} {stats[metric]} > {base[metric]}')
+            if stats['queries_per_request'] > base['queries_per_request']:
+                regressions.append(
+                    f'{name}: queries_per_request {stats["queries_per_request"]} > {base["queries_per_request"]}'
+                )
+
+        if result['total']['rps'] < baseline['total']['rps'] * (1 - tolerance):
+            regressions.append(f'Пропускная способность {result["total"]["rps"]} < {baseline["total"]["rps"]}')
+        return regressions
@@ -0,0 +1,146 @@
+import logging
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework_simplejwt.tokens import AccessToken
+
+from users.authentication import user_cache
+from users.bench import format_table, test_database
+from users.invite_codes import allocate_invite_code
+from users.models import User
+from users.referral_tree import ACTIVATION_LOCK_VENDORS
+from users.services import issue_tokens
+
+# Допустимое количество SQL-запросов на один вызов эндпоинта.
+# При уменьшении фактического числа запросов бюджет стоит уменьшить вслед за ним
+# Коды в хранилище db (OTP_STORE): запрос кода - INSERT ... ON CONFLICT, который bulk_create
+# оборачивает в BEGIN/COMMIT, проверка - один UPDATE
+OTP_QUERIES = {'issue': 3, 'verify': 1} if settings.OTP_STORE == settings.OTP_STORES['db'] else {'issue': 0, 'verify': 0}
+
+# В PostgreSQL активация идет в транзакции (BEGIN и COMMIT), до UPDATE находит корень дерева пригласившего
+# и блокирует его строку FOR SHARE, а если id пользователя меньше - сначала и строку пользователя FOR UPDATE
+# (см. lock_activation)
+ACTIVATION_LOCK_QUERIES = 5 if connection.vendor in ACTIVATION_LOCK_VENDORS else 0
+
+QUERY_BUDGETS = {
+    'request-code': OTP_QUERIES['issue'],
+    'verify-code (новый пользователь)': 2 + OTP_QUERIES['verify'],
+    'verify-code (существующий пользователь)': 1 + OTP_QUERIES['verify'],
+    'profile (счетчик не в кэше)': 1,
+    'profile (счетчик в кэше)': 0,
+    'profile (304 по ETag)': 0,
+    'profile (токен без claims)': 1,
+    'profile (токен без claims, пользователь в кэше процесса)': 0,
+    'referrals': 1,
+    # Пакет меньше 200 пользователей - одна пачка: пользователи одним запросом с IN,
+    # количество рефералов - одним GROUP BY
+    'internal profiles (пакет)': 2,
+    # Активация и увеличение рейтинга кода. С материализованными путями активация
+    # дополнительно переносит сеть пользователя
+    'activate-invite-code': (3 if settings.REFERRAL_PATHS_ENABLED else 2) + ACTIVATION_LOCK_QUERIES,
+    # Первая активация кода за день создает его строки рейтинга тем же INSERT ... ON CONFLICT
+    'activate-invite-code (первая за день)': (3 if settings.REFERRAL_PATHS_ENABLED else 2) + ACTIVATION_LOCK_QUERIES,
+}
+
+# Кэши в памяти процесса, чтобы обращения к кэшу в БД не попадали в подсчет
+LOCAL_CACHES = {
+    alias: {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': f'query-counts-{alias}',
+        'OPTIONS': {'MAX_ENTRIES': settings.CACHE_MAX_ENTRIES},
+    }
+    for alias in settings.CACHES
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Проверяет количество SQL-запросов на каждый API эндпоинт и завершается с ошибкой, '
+        'если оно превышает зафиксированный бюджет. Запускается на временной тестовой БД'
+    )
+
+    def handle(self, *args, **options):
+        # Построчный лог MetricsMiddleware здесь только мешает таблице с результатами
+        logging.getLogger('users.metrics').setLevel(logging.WARNING)
+        with test_database(), override_settings(CACHES=LOCAL_CACHES, ALLOWED_HOSTS=['testserver']):
+            counts = self.measure()
+
+        rows = []
+        failed = []
+        for name, budget in QUERY_BUDGETS.items():
+            actual = counts[name]
+            status = 'ok' if actual <= budget else 'ПРЕВЫШЕН'
+            if actual > budget:
+                failed.append(name)
+            rows.append({'endpoint': name, 'queries': actual, 'budget': budget, 'status': status})
+
+        self.stdout.write(format_table(rows, ['endpoint', 'queries', 'budget', 'status']))
+        if failed:
+            raise CommandError(f'Превышен бюджет запросов: {", ".join(failed)}')
+
+    def measure(self):
+        client = Client()
+        counts = {}
+
+        def call(name, method, path, data=None, token=None):
+            headers = {'HTTP_AUTHORIZATION': f'Bearer {token}'} if token else {}
+            with CaptureQueriesContext(connection) as queries:
+                response = getattr(client, method)(path, data, content_type='application/json', **headers)
+            if response.status_code != 200:
+                raise CommandError(f'{name}: неожиданный ответ {response.status_code} {response.content[:200]!r}')
+            counts[name] = len(queries)
+            return response.json()
+
+        user_cache.clear()
+
+        # Блок инвайт-кодов арендуется заранее, чтобы его аренда не попала в замер
+        allocate_invite_code()
+
+        inviter = User.objects.create(phone='+79000000001', invite_code=allocate_invite_code())
+        inviter_token = issue_tokens(inviter)['access']
+
+        phone = '+79000000002'
+        code = call('request-code', 'post', '/api/request-code/', {'phone': phone})['debug_code']
+        tokens = call('verify-code (новый пользователь)', 'post', '/api/verify-code/', {'phone': phone, 'code': code})
+
+        code = call('request-code', 'post', '/api/request-code/', {'phone': phone})['debug_code']
+        call('verify-code (существующий пользователь)', 'post', '/api/verify-code/', {'phone': phone, 'code': code})
+
+        call('activate-invite-code (первая за день)', 'post', '/api/activate-invite-code/',
+             {'invite_code': inviter.invite_code}, token=tokens['access'])
+        second = User.objects.create(phone='+79000000003', invite_code=allocate_invite_code())
+        call('activate-invite-code', 'post', '/api/activate-invite-code/',
+             {'invite_code': inviter.invite_code}, token=issue_tokens(second)['access'])
+
+        call('profile (счетчик не в кэше)', 'get', '/api/profile/', token=inviter_token)
+        call('profile (счетчик в кэше)', 'get', '/api/profile/', token=inviter_token)
+
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {inviter_token}'}
+        etag = client.get('/api/profile/', **headers)['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get('/api/profile/', HTTP_IF_NONE_MATCH=etag, **headers)
+        if response.status_code != 304:
+            raise CommandError(f'profile (304 по ETag): неожиданный ответ {response.status_code}')
+        counts['profile (304 по ETag)'] = len(queries)
+        call('referrals', 'get', '/api/referrals/', token=inviter_token)
+
+        with override_settings(SERVICE_TOKENS={'check': 'check-token'}):
+            ids = list(User.objects.values_list('pk', flat=True))
+            with CaptureQueriesContext(connection) as queries:
+                response = client.post(
+                    '/api/internal/profiles/', {'ids': ids}, content_type='application/json',
+                    HTTP_AUTHORIZATION='Service check-token'
+                )
+                b''.join(response.streaming_content)
+            if response.status_code != 200:
+                raise CommandError(f'internal profiles (пакет): неожиданный ответ {response.status_code}')
+            counts['internal profiles (пакет)'] = len(queries)
+
+        # Токен, выданный до появления claims: пользователь загружается из БД один раз
+        legacy_token = str(AccessToken.for_user(inviter))
+        call('profile (токен без claims)', 'get', '/api/profile/', token=legacy_token)
+        call('profile (токен без claims, пользователь в кэше процесса)', 'get', '/api/profile/', token=legacy_token)
+        return counts
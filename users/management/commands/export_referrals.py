@@ -0,0 +1,39 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from users.export import FORMATS, export_referrals, gzip_stream
+
+
+class Command(BaseCommand):
+    help = (
+        'Выгружает пары (пригласивший, приглашенный, время активации) в CSV или JSONL. '
+        'Пользователи читаются курсором пачками, поэтому память не зависит от размера таблицы'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=FORMATS, default='csv', dest='file_format', help='Формат выгрузки')
+        parser.add_argument('--gzip', action='store_true', help='Сжать выгрузку gzip')
+        parser.add_argument('--output', default='-', help='Файл для выгрузки, по умолчанию stdout')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Количество пользователей в одной пачке')
+
+    def handle(self, *args, **options):
+        chunks = export_referrals(options['file_format'], options['chunk_size'])
+        if options['gzip']:
+            chunks = gzip_stream(chunks)
+
+        if options['output'] == '-':
+            self.write(sys.stdout.buffer, chunks)
+            sys.stdout.buffer.flush()
+            return
+
+        with open(options['output'], 'wb') as f:
+            size = self.write(f, chunks)
+        self.stderr.write(self.style.SUCCESS(f'Выгрузка записана в {options["output"]}: {size} байт'))
+
+    def write(self, f, chunks):
+        size = 0
+        for chunk in chunks:
+            f.write(chunk)
+            size += len(chunk)
+        return size
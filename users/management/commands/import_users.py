@@ -0,0 +1,139 @@
+import csv
+import json
+import os
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from users.invite_codes import allocate_invite_codes
+from users.models import User
+from users.validators import is_valid_phone
+
+
+class Command(BaseCommand):
+    help = (
+        'Массовый импорт пользователей из CSV или JSONL файла с выдачей инвайт-кодов. '
+        'Файл читается потоково, пользователи создаются пачками через bulk_create. '
+        'После каждой пачки сохраняется контрольная точка, с которой импорт можно продолжить (--resume)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к файлу с пользователями')
+        parser.add_argument(
+            '--format', choices=['csv', 'jsonl'],
+            help='Формат файла. По умолчанию определяется по расширению'
+        )
+        parser.add_argument('--phone-field', default='phone', help='Колонка CSV или ключ JSONL с номером телефона')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Количество строк в одной пачке')
+        parser.add_argument(
+            '--checkpoint',
+            help='Файл контрольной точки. По умолчанию <path>.checkpoint'
+        )
+        parser.add_argument(
+            '--resume', action='store_true',
+            help='Продолжить импорт с последней сохраненной контрольной точки'
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+        checkpoint_path = options['checkpoint'] or f'{path}.checkpoint'
+
+        skip = 0
+        if options['resume'] and os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as f:
+                skip = json.load(f)['rows']
+            self.stdout.write(f'Продолжаем импорт со строки {skip + 1}')
+
+        stats = {'rows': skip, 'created': 0, 'invalid': 0, 'duplicates': 0, 'existing': 0}
+        started = time.perf_counter()
+
+        with open(path, newline='', encoding='utf-8') as f:
+            phones = self.read_phones(f, file_format, options['phone_field'])
+            batch = []
+            for index, phone in enumerate(phones):
+                if index < skip:
+                    continue
+                batch.append(phone)
+                if len(batch) == options['batch_size']:
+                    self.import_batch(batch, stats)
+                    self.save_checkpoint(checkpoint_path, stats['rows'])
+                    self.report(stats, skip, started)
+                    batch = []
+
+            if batch:
+                self.import_batch(batch, stats)
+                self.save_checkpoint(checkpoint_path, stats['rows'])
+
+        self.report(stats, skip, started, style=self.style.SUCCESS)
+
+    def read_phones(self, f, file_format, phone_field):
+        if file_format == 'jsonl':
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield str(json.loads(line).get(phone_field) or '')
+                except (ValueError, AttributeError):
+                    # Некорректная строка будет посчитана как невалидный номер
+                    yield ''
+            return
+
+        reader = csv.DictReader(f)
+        if phone_field not in (reader.fieldnames or []):
+            raise CommandError(f'В CSV нет колонки {phone_field!r}')
+        for row in reader:
+            yield (row[phone_field] or '').strip()
+
+    def import_batch(self, batch, stats):
+        stats['rows'] += len(batch)
+
+        # Валидируем номера тем же правилом, что и API, и убираем дубликаты внутри пачки
+        valid = [phone for phone in batch if is_valid_phone(phone)]
+        phones = list(dict.fromkeys(valid))
+        stats['invalid'] += len(batch) - len(valid)
+        stats['duplicates'] += len(valid) - len(phones)
+
+        existing = set(User.objects.filter(phone__in=phones).values_list('phone', flat=True))
+        phones = [phone for phone in phones if phone not in existing]
+        stats['existing'] += len(existing)
+
+        if not phones:
+            return
+
+        # Коды выдаются из арендованных блоков и гарантированно уникальны, проверять их в БД не нужно
+        invite_codes = allocate_invite_codes(len(phones))
+        password = make_password(None)
+        users = [
+            User(phone=phone, invite_code=invite_code, password=password)
+            for phone, invite_code in zip(phones, invite_codes)
+        ]
+
+        # ignore_conflicts делает повторный импорт той же пачки безопасным,
+        # если пользователь успел зарегистрироваться параллельно. Пропущенные строки bulk_create
+        # не возвращает, поэтому созданные считаются по выданным кодам: до вставки их ни у кого не было
+        with transaction.atomic():
+            User.objects.bulk_create(users, ignore_conflicts=True)
+            created = User.objects.filter(invite_code__in=invite_codes).count()
+        stats['created'] += created
+        stats['existing'] += len(users) - created
+
+    def save_checkpoint(self, checkpoint_path, rows):
+        # Пишем во временный файл и атомарно подменяем, чтобы сбой не оставил битую контрольную точку
+        tmp_path = f'{checkpoint_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'rows': rows}, f)
+        os.replace(tmp_path, checkpoint_path)
+
+    def report(self, stats, skip, started, style=None):
+        elapsed = time.perf_counter() - started
+        rate = (stats['rows'] - skip) / elapsed if elapsed else 0
+        message = (
+            f'Обработано строк: {stats["rows"]}, создано: {stats["created"]}, '
+            f'уже существуют: {stats["existing"]}, повторов в файле: {stats["duplicates"]}, '
+            f'невалидных: {stats["invalid"]}, {rate:.0f} строк/с'
+        )
+        self.stdout.write(style(message) if style else message)
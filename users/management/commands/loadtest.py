@@ -0,0 +1,85 @@
+import itertools
+import random
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+from users.bench import summarize, format_table
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный тест запущенного сервера: сценарий запрос кода -> проверка кода -> профиль. '
+        'Позволяет сравнить WSGI и ASGI развертывания, например: '
+        '--target wsgi=http://localhost:8000/api/ --target asgi=http://localhost:8001/api/async/'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--target', action='append', required=True,
+            help='Метка и базовый URL API в формате label=url, можно указать несколько раз'
+        )
+        parser.add_argument('--iterations', type=int, default=200, help='Количество прогонов сценария')
+        parser.add_argument('--concurrency', type=int, default=20, help='Количество одновременных клиентов')
+        parser.add_argument('--timeout', type=float, default=30, help='Таймаут одного запроса в секундах')
+
+    def handle(self, *args, **options):
+        targets = []
+        for target in options['target']:
+            label, sep, url = target.partition('=')
+            if not sep or not url:
+                raise CommandError(f'Некорректная цель {target!r}, ожидается label=url')
+            targets.append((label, url.rstrip('/') + '/'))
+
+        rows = []
+        for label, base_url in targets:
+            self.stdout.write(f'{label}: {base_url} ...')
+            rows.extend(self.run_target(label, base_url, options))
+
+        self.stdout.write(format_table(rows, ['target', 'endpoint', 'requests', 'errors', 'rps', 'p50_ms', 'p95_ms', 'p99_ms']))
+
+    def run_target(self, label, base_url, options):
+        latencies = defaultdict(list)
+        errors = defaultdict(int)
+        # Уникальные номера телефонов для каждого прогона, чтобы пользователи создавались заново
+        prefix = random.randint(100, 999)
+        counter = itertools.count()
+
+        def call(session, endpoint, method, **kwargs):
+            started = time.perf_counter()
+            try:
+                response = session.request(method, base_url + endpoint, timeout=options['timeout'], **kwargs)
+            except requests.RequestException:
+                errors[endpoint] += 1
+                return None
+            latencies[endpoint].append(time.perf_counter() - started)
+            if response.status_code != 200:
+                errors[endpoint] += 1
+                return None
+            return response.json()
+
+        def scenario(_):
+            phone = f'+7{prefix}{next(counter):07d}'
+            with requests.Session() as session:
+                data = call(session, 'request-code/', 'POST', json={'phone': phone})
+                if data is None:
+                    return
+                data = call(session, 'verify-code/', 'POST', json={'phone': phone, 'code': data['debug_code']})
+                if data is None:
+                    return
+                call(session, 'profile/', 'GET', headers={'Authorization': f'Bearer {data["access"]}'})
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            list(executor.map(scenario, range(options['iterations'])))
+        elapsed = time.perf_counter() - started
+
+        rows = []
+        for endpoint in ['request-code/', 'verify-code/', 'profile/']:
+            rows.append({'target': label, 'endpoint': endpoint, **summarize(latencies[endpoint], elapsed, errors[endpoint])})
+        all_latencies = [value for values in latencies.values() for value in values]
+        rows.append({'target': label, 'endpoint': 'total', **summarize(all_latencies, elapsed, sum(errors.values()))})
+        return rows
@@ -0,0 +1,31 @@
+import time
+
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет сессии из таблицы django_session пачками: истекшие или, с --all, все. '
+        'В отличие от clearsessions не удаляет всю таблицу одним запросом, поэтому не держит '
+        'долгую блокировку. Рассчитана на периодический запуск (cron) при SESSION_BACKEND=db или cached_db '
+        'и на однократную очистку после перехода на сессии в cookie или кэше'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Количество сессий в одном DELETE')
+        parser.add_argument('--all', action='store_true', help='Удалить все сессии, а не только истекшие')
+        parser.add_argument('--sleep', type=float, default=0, help='Пауза между пачками в секундах')
+
+    def handle(self, *args, **options):
+        sessions = Session.objects.all() if options['all'] else Session.objects.filter(expire_date__lt=timezone.now())
+        total = 0
+        while True:
+            keys = list(sessions.values_list('session_key', flat=True)[:options['batch_size']])
+            if not keys:
+                break
+            total += Session.objects.filter(session_key__in=keys).delete()[0]
+            if options['sleep']:
+                time.sleep(options['sleep'])
+        self.stdout.write(self.style.SUCCESS(f'Удалено сессий: {total}'))
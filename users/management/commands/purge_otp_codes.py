@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from users.models import OneTimeCode
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет истекшие коды подтверждения из таблицы users_onetimecode пачками. '
+        'Нужна только при OTP_STORE=db, рассчитана на периодический запуск (cron)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Количество кодов в одном DELETE')
+        parser.add_argument('--sleep', type=float, default=0, help='Пауза между пачками в секундах')
+
+    def handle(self, *args, **options):
+        codes = OneTimeCode.objects.filter(expires_at__lt=timezone.now())
+        total = 0
+        while True:
+            phones = list(codes.values_list('phone', flat=True)[:options['batch_size']])
+            if not phones:
+                break
+            total += OneTimeCode.objects.filter(phone__in=phones).delete()[0]
+            if options['sleep']:
+                time.sleep(options['sleep'])
+        self.stdout.write(self.style.SUCCESS(f'Удалено кодов: {total}'))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from users.referrals import rebuild_referral_counters, find_counter_drift
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает кэшированные счетчики рефералов по БД или проверяет их расхождение с БД (--check)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Количество пользователей в одной пачке')
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Только найти счетчики, расходящиеся с БД, ничего не изменяя'
+        )
+
+    def handle(self, *args, **options):
+        if not options['check']:
+            total = rebuild_referral_counters(options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'Пересчитано счетчиков: {total}'))
+            return
+
+        drift = 0
+        for invite_code, cached, actual in find_counter_drift(options['batch_size']):
+            drift += 1
+            self.stdout.write(f'{invite_code}: в кэше {cached}, в БД {actual}')
+
+        if drift:
+            raise CommandError(f'Расходящихся счетчиков: {drift}')
+        self.stdout.write(self.style.SUCCESS('Расхождений не найдено'))
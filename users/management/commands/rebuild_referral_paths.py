@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from users.referral_tree import rebuild_referral_paths
+
+
+class Command(BaseCommand):
+    help = (
+        'Строит материализованные пути реферальной сети (referral_path) заново по referred_by. '
+        'Нужно выполнить перед включением REFERRAL_PATHS_ENABLED и после массовых изменений в обход API'
+    )
+
+    def handle(self, *args, **options):
+        total, unreachable = rebuild_referral_paths()
+        self.stdout.write(self.style.SUCCESS(f'Построено путей: {total}'))
+        if unreachable:
+            self.stdout.write(self.style.WARNING(
+                f'Пользователей в циклах приглашений: {unreachable}. Их сеть считается без учета цикла'
+            ))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from users.leaderboard import reconcile_leaderboard
+
+
+class Command(BaseCommand):
+    help = (
+        'Сверяет рейтинг пригласивших с БД: пересчитывает рейтинг за все время по пользователям, '
+        'удаляет рейтинги за дни и недели старше LEADERBOARD_RETENTION_DAYS и перестраивает топы в кэше. '
+        'Рассчитана на периодический запуск (cron)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Количество пользователей в одной пачке')
+
+    def handle(self, *args, **options):
+        updated, deleted = reconcile_leaderboard(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано кодов: {updated}, удалено устаревших строк: {deleted}'))
@@ -0,0 +1,116 @@
+import random
+import threading
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from users.bench import summarize, format_table, test_database
+from users.invite_codes import allocate_invite_codes
+from users.models import User
+from users.referrals import find_counter_drift
+from users.services import ServiceError, activate_invite_code
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочная проверка активации инвайт-кодов: тысячи одновременных активаций, '
+        'в том числе несколько попыток одного пользователя с разными кодами. '
+        'Проверяет, что каждый пользователь активировал ровно один код, и измеряет пропускную способность. '
+        'Запускается на временной тестовой БД'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2000, help='Количество активирующих пользователей')
+        parser.add_argument('--inviters', type=int, default=50, help='Количество пригласивших')
+        parser.add_argument('--attempts', type=int, default=3, help='Количество одновременных попыток на пользователя')
+        parser.add_argument('--threads', type=int, default=32, help='Количество потоков')
+
+    def handle(self, *args, **options):
+        with test_database(shared_file=True):
+            rows, errors = self.run(options)
+
+        self.stdout.write(format_table(rows, ['check', 'value']))
+        if errors:
+            raise CommandError('\n'.join(errors))
+        self.stdout.write(self.style.SUCCESS('Все проверки пройдены'))
+
+    def run(self, options):
+        inviters = self.create_users('+7901', options['inviters'])
+        users = self.create_users('+7902', options['users'])
+        codes = [inviter.invite_code for inviter in inviters]
+        owners = {inviter.invite_code: inviter.pk for inviter in inviters}
+
+        # Каждый пользователь пытается активировать несколько разных кодов одновременно
+        attempts = [(user, code) for user in users for code in random.sample(codes, options['attempts'])]
+        random.shuffle(attempts)
+
+        successes = []
+        failures = Counter()
+        latencies = []
+        lock = threading.Lock()
+
+        def worker(chunk):
+            try:
+                for user, code in chunk:
+                    started = time.perf_counter()
+                    try:
+                        # Свой экземпляр пользователя на каждую попытку, как в отдельном запросе
+                        activate_invite_code(User(pk=user.pk, invite_code=user.invite_code), code)
+                        result = None
+                    except ServiceError as e:
+                        result = e.detail
+                    elapsed = time.perf_counter() - started
+                    with lock:
+                        latencies.append(elapsed)
+                        if result is None:
+                            successes.append((user.pk, code))
+                        else:
+                            failures[result] += 1
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=worker, args=(attempts[index::options['threads']],))
+            for index in range(options['threads'])
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        errors = []
+        activations_per_user = Counter(user_id for user_id, _ in successes)
+        if len(activations_per_user) != len(users) or any(n != 1 for n in activations_per_user.values()):
+            errors.append('Не каждый пользователь активировал ровно один инвайт-код')
+
+        stored = dict(
+            User.objects.filter(pk__in=[user.pk for user in users]).values_list('pk', 'referred_by_id')
+        )
+        if any(stored[user_id] != owners[code] for user_id, code in successes):
+            errors.append('referred_by в БД не совпадает с успешно активированным кодом')
+
+        drift = list(find_counter_drift())
+        if drift:
+            errors.append(f'Счетчики рефералов в кэше расходятся с БД: {len(drift)}')
+
+        stats = summarize(latencies, elapsed)
+        rows = [
+            {'check': 'попыток активации', 'value': len(attempts)},
+            {'check': 'успешных активаций', 'value': len(successes)},
+            *({'check': f'отказ: {reason}', 'value': count} for reason, count in failures.items()),
+            {'check': 'попыток в секунду', 'value': stats['rps']},
+            {'check': 'p50, мс', 'value': stats['p50_ms']},
+            {'check': 'p99, мс', 'value': stats['p99_ms']},
+        ]
+        return rows, errors
+
+    def create_users(self, prefix, count):
+        codes = allocate_invite_codes(count)
+        return User.objects.bulk_create([
+            User(phone=f'{prefix}{index:07d}', invite_code=code)
+            for index, code in enumerate(codes)
+        ])
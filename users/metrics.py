@@ -0,0 +1,325 @@
+import bisect
+import fcntl
+import glob
+import json
+import os
+import threading
+
+
+# Границы бакетов гистограмм по умолчанию (в секундах)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels_key(labels):
+    # Метки из JSON приходят списком пар
+    return tuple(tuple(pair) for pair in labels)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels) + '}'
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self._lock = threading.Lock()
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self.samples())
+        return lines
+
+    def samples(self):
+        raise NotImplementedError
+
+    # Состояние метрики для других процессов (см. Registry.enable_multiprocess): dump - в виде,
+    # пригодном для JSON, merge - прибавить такое состояние к своему, empty - пустая копия для сложения
+    def dump(self):
+        raise NotImplementedError
+
+    def merge(self, data):
+        raise NotImplementedError
+
+    def empty(self):
+        return type(self)(self.name, self.description)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name, description):
+        super().__init__(name, description)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f'{self.name}{_format_labels(key)} {value}' for key, value in items]
+
+    def dump(self):
+        with self._lock:
+            return list(self._values.items())
+
+    def merge(self, data):
+        with self._lock:
+            for labels, value in data:
+                key = _labels_key(labels)
+                self._values[key] = self._values.get(key, 0) + value
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, description, func=None):
+        super().__init__(name, description)
+        self._value = 0
+        # Значение можно вычислять в момент чтения (например, размер очереди)
+        self._func = func
+
+    def set(self, value):
+        self._value = value
+
+    def value(self):
+        return self._func() if self._func else self._value
+
+    def samples(self):
+        return [f'{self.name} {self.value()}']
+
+    def dump(self):
+        return self.value()
+
+    def merge(self, data):
+        # Значения процессов складываются: например, глубина очередей отправки всех воркеров
+        self._value += data
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, description, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, description)
+        self.buckets = tuple(buckets)
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0}
+            series['counts'][index] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def snapshot(self, **labels):
+        with self._lock:
+            series = self._series.get(tuple(sorted(labels.items())))
+            return None if series is None else {**series, 'counts': list(series['counts'])}
+
+    def samples(self):
+        with self._lock:
+            items = [(key, {**series, 'counts': list(series['counts'])}) for key, series in self._series.items()]
+
+        lines = []
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series['counts']):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_format_labels(key + (("le", bound),))} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(key)} {series["sum"]}')
+            lines.append(f'{self.name}_count{_format_labels(key)} {series["count"]}')
+        return lines
+
+    def dump(self):
+        with self._lock:
+            return [(key, {**series, 'counts': list(series['counts'])}) for key, series in self._series.items()]
+
+    def merge(self, data):
+        with self._lock:
+            for labels, other in data:
+                key = _labels_key(labels)
+                series = self._series.get(key)
+                if series is None:
+                    series = self._series[key] = {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0}
+                series['counts'] = [count + added for count, added in zip(series['counts'], other['counts'])]
+                series['sum'] += other['sum']
+                series['count'] += other['count']
+
+    def empty(self):
+        return type(self)(self.name, self.description, self.buckets)
+
+
+class Registry:
+    # Метрики процесса. Под gunicorn у каждого воркера свой экземпляр, а запрос /api/metrics/ попадает
+    # в случайный воркер, поэтому воркеры раз в interval секунд пишут свое состояние в общий каталог
+    # (<pid>.json, enable_multiprocess), и render складывает его с состоянием остальных. Счетчики
+    # и гистограммы завершившегося воркера переносятся в archive.json (close_process) и не пропадают
+    # после перезапуска по max_requests. Значения Gauge берутся только у живых процессов
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._directory = None
+        self._stopped = threading.Event()
+
+    def register(self, metric):
+        # Повторная регистрация (например, при перезагрузке модуля) возвращает уже существующую метрику
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, description):
+        return self.register(Counter(name, description))
+
+    def gauge(self, name, description, func=None):
+        return self.register(Gauge(name, description, func))
+
+    def histogram(self, name, description, buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, description, buckets))
+
+    def _metrics_list(self):
+        with self._lock:
+            return list(self._metrics.values())
+
+    def dump(self, gauges=True):
+        return {metric.name: metric.dump() for metric in self._metrics_list() if gauges or metric.kind != 'gauge'}
+
+    def _combine(self, *states):
+        combined = {metric.name: metric.empty() for metric in self._metrics_list()}
+        for state in states:
+            for name, data in state.items():
+                if name in combined:
+                    combined[name].merge(data)
+        return combined
+
+    def render(self):
+        if self._directory is None:
+            metrics = self._metrics_list()
+        else:
+            metrics = self._combine(self.dump(), *self._other_processes()).values()
+
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def enable_multiprocess(self, directory, interval=1.0):
+        # Вызывается в процессе воркера после fork. Файл с тем же pid мог остаться от процесса,
+        # завершившегося без close_process (например, по таймауту), его данные уходят в архив
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        with self._file_lock():
+            self._archive(self._read(self._path(os.getpid())))
+            self._remove(self._path(os.getpid()))
+        self._stopped.clear()
+        threading.Thread(
+            target=self._write_loop, args=(self._file_lock(), self._path(os.getpid()), interval), daemon=True
+        ).start()
+
+    def close_process(self):
+        # Вызывается при завершении воркера: счетчики и гистограммы процесса переносятся в архив
+        if self._directory is None:
+            return
+        self._stopped.set()
+        with self._file_lock():
+            self._archive(self.dump(gauges=False))
+            self._remove(self._path(os.getpid()))
+        self._directory = None
+
+    def _write_loop(self, lock, path, interval):
+        while not self._stopped.wait(interval):
+            # Под блокировкой: файл не должен появиться снова после close_process
+            with lock:
+                if not self._stopped.is_set():
+                    self._write(path, self.dump())
+
+    def _other_processes(self):
+        own = self._path(os.getpid())
+        states = []
+        with self._file_lock():
+            for path in glob.glob(os.path.join(self._directory, '*.json')):
+                if path == own:
+                    continue
+                state = self._read(path)
+                if path != self._path('archive') and not self._alive(path):
+                    state = {name: data for name, data in state.items() if name not in self._gauges()}
+                states.append(state)
+        return states
+
+    def _archive(self, state):
+        if not state:
+            return
+        archive = self._path('archive')
+        combined = self._combine(self._read(archive), state)
+        self._write(archive, {name: metric.dump() for name, metric in combined.items() if metric.kind != 'gauge'})
+
+    def _gauges(self):
+        return {metric.name for metric in self._metrics_list() if metric.kind == 'gauge'}
+
+    def _path(self, name):
+        return os.path.join(self._directory, f'{name}.json')
+
+    @staticmethod
+    def _alive(path):
+        try:
+            os.kill(int(os.path.basename(path)[:-len('.json')]), 0)
+        except (ValueError, ProcessLookupError):
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def _write(path, state):
+        # Во временный файл и атомарная подмена: читатель не увидит файл записанным наполовину
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _file_lock(self):
+        return _FileLock(os.path.join(self._directory, 'lock'))
+
+
+class _FileLock:
+    # Блокировка каталога метрик между процессами: архив не читается в момент переноса в него данных
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self.file = open(self.path, 'a')
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+
+    def __exit__(self, *exc_info):
+        fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+
+
+registry = Registry()
@@ -0,0 +1,71 @@
+import json
+import logging
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from .instrumentation import (
+    RequestStats, current_stats, request_duration, requests_total, db_queries_total, db_query_seconds_total
+)
+
+logger = logging.getLogger('users.metrics')
+
+
+class MetricsMiddleware:
+    # Замеряет время обработки каждого запроса, количество и время SQL-запросов и время
+    # сериализаторов. Результат попадает в метрики (/api/metrics/) и в лог users.metrics
+    # одной JSON-строкой на запрос. Работает и под WSGI, и под ASGI без переключения контекста
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+
+        stats = RequestStats()
+        token = current_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_stats.reset(token)
+        self.record(request, response, stats, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = current_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_stats.reset(token)
+        self.record(request, response, stats, time.perf_counter() - started)
+        return response
+
+    def record(self, request, response, stats, elapsed):
+        match = request.resolver_match
+        view = match.view_name if match else 'unmatched'
+
+        request_duration.observe(elapsed, view=view, method=request.method)
+        requests_total.inc(view=view, method=request.method, status=response.status_code)
+        db_queries_total.inc(stats.db_queries, view=view)
+        db_query_seconds_total.inc(stats.db_time, view=view)
+
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps({
+                'view': view,
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'duration_ms': round(elapsed * 1000, 3),
+                'db_queries': stats.db_queries,
+                'db_ms': round(stats.db_time * 1000, 3),
+                'serializer_ms': round(stats.serializer_time * 1000, 3),
+            }))
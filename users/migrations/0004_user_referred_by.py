@@ -0,0 +1,24 @@
+# Generated by Django 5.2.4 on 2026-10-18 18:11
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_user_activated_invite_code_user_invite_code'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='referred_by',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='referrals', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['referred_by', 'phone'], name='users_referred_by_phone_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_referred_by(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+
+    # Один UPDATE с подзапросом вместо обхода пользователей в Python
+    inviter = User.objects.filter(invite_code=OuterRef('activated_invite_code')).values('pk')[:1]
+    User.objects.filter(activated_invite_code__isnull=False).update(referred_by=Subquery(inviter))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_user_referred_by'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_referred_by, migrations.RunPython.noop),
+    ]
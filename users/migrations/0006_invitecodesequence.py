@@ -0,0 +1,26 @@
+# Generated by Django 5.2.4 on 2026-10-18 18:16
+
+from django.db import migrations, models
+
+
+def create_sequence(apps, schema_editor):
+    InviteCodeSequence = apps.get_model('users', 'InviteCodeSequence')
+    InviteCodeSequence.objects.get_or_create(name='invite_code')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_backfill_referred_by'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InviteCodeSequence',
+            fields=[
+                ('name', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('next_value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(create_sequence, migrations.RunPython.noop),
+    ]
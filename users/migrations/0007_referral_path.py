@@ -0,0 +1,27 @@
+# Generated by Django 5.2.4 on 2026-10-18 18:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_invitecodesequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='referral_depth',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='referral_path',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['referral_path'], name='users_referral_path_idx', opclasses=['text_pattern_ops']),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.4 on 2026-10-18 18:38
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_all_time(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+    ReferralActivity = apps.get_model('users', 'ReferralActivity')
+
+    # Рейтинг за все время заполняется по уже активированным кодам одним GROUP BY.
+    # Активации до этой миграции не имеют даты, поэтому в рейтинги за день и неделю не попадают
+    counts = (
+        User.objects.filter(referred_by__invite_code__isnull=False)
+        .values('referred_by__invite_code')
+        .annotate(count=Count('id'))
+        .order_by()
+    )
+    ReferralActivity.objects.bulk_create(
+        (
+            ReferralActivity(period='all', invite_code=row['referred_by__invite_code'], count=row['count'])
+            for row in counts.iterator()
+        ),
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0007_referral_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReferralActivity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(max_length=16)),
+                ('invite_code', models.CharField(max_length=6)),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['period', '-count'], name='users_activity_top_idx')],
+                'constraints': [models.UniqueConstraint(fields=('period', 'invite_code'), name='users_activity_period_code_uniq')],
+            },
+        ),
+        migrations.RunPython(backfill_all_time, migrations.RunPython.noop),
+    ]
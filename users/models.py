@@ -21,6 +21,10 @@ class User(AbstractBaseUser):
     is_active = models.BooleanField(
         default=True
     )
+    # Доступ к служебным эндпоинтам, например к выгрузке рефералов
+    is_staff = models.BooleanField(
+        default=False
+    )
 
     invite_code = models.CharField(
         max_length=6,
@@ -34,11 +38,114 @@ class User(AbstractBaseUser):
         null=True,
         blank=True
     )
+    # Время активации инвайт-кода. NULL у активаций, сделанных до появления поля
+    activated_at = models.DateTimeField(
+        null=True,
+        blank=True
+    )
+
+    # Пользователь, чей инвайт-код был активирован
+    referred_by = models.ForeignKey(
+        'self',
+        on_delete=models.SET_NULL,
+        related_name='referrals',
+        null=True,
+        blank=True,
+        db_index=False
+    )
+
+    # Материализованный путь по цепочке приглашений: id всех пригласивших и самого
+    # пользователя, например '/1/5/23/'. NULL у пользователя, которого никто не пригласил:
+    # его путь - '/<id>/'. Поддерживается только при REFERRAL_PATHS_ENABLED (см. users/referral_tree.py)
+    referral_path = models.TextField(
+        null=True,
+        blank=True
+    )
+    # Уровень в дереве рефералов: 0 у пользователя, которого никто не пригласил.
+    # Поддерживается вместе с referral_path
+    referral_depth = models.PositiveIntegerField(
+        default=0
+    )
 
     objects = UserManager()
 
     USERNAME_FIELD = 'phone'
     REQUIRED_FIELDS = []
 
+    class Meta:
+        indexes = [
+            # Покрывающий индекс: список рефералов читается только из индекса
+            models.Index(fields=['referred_by', 'phone'], name='users_referred_by_phone_idx'),
+            # Поиск всех рефералов по префиксу пути. В PostgreSQL для LIKE 'prefix%' нужен text_pattern_ops
+            models.Index(fields=['referral_path'], name='users_referral_path_idx', opclasses=['text_pattern_ops']),
+        ]
+
     def __str__(self):
         return self.phone
+
+    def get_downline(self, max_depth=None):
+        # Размер и глубина всей реферальной сети пользователя, см. users.referral_tree.get_downline
+        from .referral_tree import get_downline
+        return get_downline(self, max_depth)
+
+
+class InviteCodeSequence(models.Model):
+    # Счетчик для выдачи инвайт-кодов: воркеры арендуют из него блоки номеров
+    # и кодируют их в инвайт-коды без обращения к БД (см. users/invite_codes.py)
+    name = models.CharField(
+        max_length=32,
+        primary_key=True
+    )
+    next_value = models.BigIntegerField(
+        default=0
+    )
+
+    def __str__(self):
+        return f'{self.name}: {self.next_value}'
+
+
+class ReferralActivity(models.Model):
+    # Количество активаций инвайт-кода за период: день ('day:2026-10-18'), неделю ISO
+    # ('week:2026-W42') или за все время ('all'). Таблица для рейтинга пригласивших
+    # (см. users/leaderboard.py): топ за период читается по индексу без GROUP BY по пользователям
+    period = models.CharField(
+        max_length=16
+    )
+    invite_code = models.CharField(
+        max_length=6
+    )
+    count = models.PositiveIntegerField(
+        default=0
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['period', 'invite_code'], name='users_activity_period_code_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['period', '-count'], name='users_activity_top_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.period} {self.invite_code}: {self.count}'
+
+
+class OneTimeCode(models.Model):
+    # Код подтверждения для OTP_STORE=db (см. users/otp.py): HMAC кода, количество
+    # неверных попыток и срок действия. Использованный код хранится с пустым хэшем
+    phone = models.CharField(
+        max_length=15,
+        primary_key=True
+    )
+    code_hash = models.CharField(
+        max_length=64
+    )
+    attempts = models.PositiveSmallIntegerField(
+        default=0
+    )
+    expires_at = models.DateTimeField(
+        db_index=True
+    )
+
+    def __str__(self):
+        return f'{self.phone}: до {self.expires_at}'
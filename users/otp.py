@@ -0,0 +1,229 @@
+import threading
+import time
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import F
+from django.utils import timezone
+from django.utils.connection import ConnectionProxy
+from django.utils.crypto import constant_time_compare, salted_hmac
+from django.utils.module_loading import import_string
+
+from .metrics import registry
+from .models import OneTimeCode
+
+
+# Хранилища кодов подтверждения. Код хранится не в открытом виде, а как HMAC от номера и кода
+# на SECRET_KEY, вместе с ним - количество неверных попыток и срок действия. Проверка сравнивает
+# код и в случае успеха удаляет его одной атомарной операцией, поэтому при одновременных запросах
+# с одним кодом успешным будет только один. После OTP_MAX_ATTEMPTS неверных попыток код
+# блокируется до запроса нового. Хранилище выбирается настройкой OTP_STORE
+
+# Результаты проверки кода
+VERIFIED = 'verified'
+INVALID = 'invalid'
+EXPIRED = 'expired'
+LOCKED = 'locked'
+
+codes_cache_requests = registry.counter(
+    'codes_cache_requests_total', 'Обращения к хранилищу кодов подтверждения: result=hit или miss'
+)
+otp_verifications = registry.counter(
+    'otp_verifications_total', 'Проверки кодов подтверждения: result=verified, invalid, expired или locked'
+)
+
+
+def hash_code(phone, code):
+    return salted_hmac('users.otp', f'{phone}:{code}', algorithm='sha256').hexdigest()
+
+
+class BaseOTPStore:
+    def __init__(self, ttl=None, max_attempts=None):
+        self._ttl = ttl
+        self._max_attempts = max_attempts
+
+    # Значения по умолчанию читаются из настроек при каждом обращении, чтобы работал override_settings
+    @property
+    def ttl(self):
+        return settings.OTP_TTL if self._ttl is None else self._ttl
+
+    @property
+    def max_attempts(self):
+        return settings.OTP_MAX_ATTEMPTS if self._max_attempts is None else self._max_attempts
+
+    def issue(self, phone, code):
+        # Сохраняет новый код, прежний код номера и счетчик попыток сбрасываются
+        self._issue(phone, hash_code(phone, code))
+
+    def verify(self, phone, code):
+        result = self._verify(phone, hash_code(phone, code))
+        codes_cache_requests.inc(result='miss' if result == EXPIRED else 'hit')
+        otp_verifications.inc(result=result)
+        return result
+
+    async def aissue(self, phone, code):
+        await sync_to_async(self.issue)(phone, code)
+
+    async def averify(self, phone, code):
+        return await sync_to_async(self.verify)(phone, code)
+
+    def _issue(self, phone, code_hash):
+        raise NotImplementedError
+
+    def _verify(self, phone, code_hash):
+        raise NotImplementedError
+
+
+class MemoryOTPStore(BaseOTPStore):
+    # В памяти процесса: для разработки и бенчмарков, с несколькими воркерами не работает
+    def __init__(self, ttl=None, max_attempts=None, max_entries=10000):
+        super().__init__(ttl, max_attempts)
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _issue(self, phone, code_hash):
+        now = time.monotonic()
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._entries = {key: entry for key, entry in self._entries.items() if entry[2] > now}
+            self._entries[phone] = [code_hash, 0, now + self.ttl]
+
+    def _verify(self, phone, code_hash):
+        with self._lock:
+            entry = self._entries.get(phone)
+            if entry is None or entry[2] <= time.monotonic():
+                self._entries.pop(phone, None)
+                return EXPIRED
+            if entry[1] >= self.max_attempts:
+                return LOCKED
+            if constant_time_compare(entry[0], code_hash):
+                del self._entries[phone]
+                return VERIFIED
+            entry[1] += 1
+            return INVALID
+
+    async def aissue(self, phone, code):
+        self.issue(phone, code)
+
+    async def averify(self, phone, code):
+        return self.verify(phone, code)
+
+
+class CacheOTPStore(BaseOTPStore):
+    # В кэше CODES_CACHE_ALIAS. Код и срок действия хранятся в одной записи, счетчик попыток -
+    # в соседней: запись с кодом при неверной попытке не перезаписывается, иначе параллельная
+    # неверная попытка могла бы вернуть в кэш только что использованный код. Попытка занимается
+    # через incr до сравнения кода, поэтому лимит держится при одновременных попытках, только если
+    # incr атомарен: redis или locmem с одним процессом. В db и file incr - чтение и запись,
+    # для них нужно хранилище db
+    def __init__(self, ttl=None, max_attempts=None, cache=None):
+        super().__init__(ttl, max_attempts)
+        self.cache = cache or ConnectionProxy(caches, settings.CODES_CACHE_ALIAS)
+
+    def _issue(self, phone, code_hash):
+        self.cache.set_many(
+            {f'otp_{phone}': (code_hash, time.time() + self.ttl), f'otp_attempts_{phone}': 0}, timeout=self.ttl
+        )
+
+    def _take_attempt(self, attempts_key, expires):
+        # Номер текущей попытки. Если счетчик вытеснен из кэша, он создается заново
+        try:
+            return self.cache.incr(attempts_key)
+        except ValueError:
+            if self.cache.add(attempts_key, 1, timeout=max(1, int(expires - time.time()))):
+                return 1
+            return self.cache.incr(attempts_key)
+
+    def _verify(self, phone, code_hash):
+        key, attempts_key = f'otp_{phone}', f'otp_attempts_{phone}'
+        entry = self.cache.get(key)
+        if entry is None or entry[1] <= time.time():
+            return EXPIRED
+        if self._take_attempt(attempts_key, entry[1]) > self.max_attempts:
+            return LOCKED
+        if constant_time_compare(entry[0], code_hash):
+            return VERIFIED if self.cache.delete(key) else EXPIRED
+        return INVALID
+
+
+class DatabaseOTPStore(BaseOTPStore):
+    # В таблице users_onetimecode, строка на номер телефона. Успешная проверка - один UPDATE,
+    # который находит строку по номеру и хэшу кода и стирает хэш. Неверная попытка - UPDATE
+    # счетчика. Строка переиспользуется при следующем запросе кода, истекшие строки
+    # удаляются командой purge_otp_codes
+    def _issue(self, phone, code_hash):
+        OneTimeCode.objects.bulk_create(
+            [OneTimeCode(phone=phone, code_hash=code_hash, attempts=0,
+                         expires_at=timezone.now() + timedelta(seconds=self.ttl))],
+            update_conflicts=True, unique_fields=['phone'], update_fields=['code_hash', 'attempts', 'expires_at'],
+        )
+
+    def _verify(self, phone, code_hash):
+        active = OneTimeCode.objects.filter(phone=phone, expires_at__gt=timezone.now()).exclude(code_hash='')
+        if active.filter(code_hash=code_hash, attempts__lt=self.max_attempts).update(code_hash=''):
+            return VERIFIED
+        if active.filter(attempts__lt=self.max_attempts).update(attempts=F('attempts') + 1):
+            return INVALID
+        return LOCKED if active.exists() else EXPIRED
+
+
+# Проверка в Redis: чтение, сравнение и удаление или увеличение счетчика выполняются
+# на сервере одним скриптом
+VERIFY_SCRIPT = """
+local entry = redis.call('HMGET', KEYS[1], 'hash', 'attempts')
+if not entry[1] then
+    return 0
+end
+if tonumber(entry[2]) >= tonumber(ARGV[2]) then
+    return 3
+end
+if entry[1] == ARGV[1] then
+    redis.call('DEL', KEYS[1])
+    return 1
+end
+redis.call('HINCRBY', KEYS[1], 'attempts', 1)
+return 2
+"""
+SCRIPT_RESULTS = {0: EXPIRED, 1: VERIFIED, 2: INVALID, 3: LOCKED}
+
+
+class RedisOTPStore(BaseOTPStore):
+    # В Redis-совместимом сервере по адресу OTP_REDIS_URL (требуется пакет redis),
+    # запись - хэш с полями hash и attempts и временем жизни OTP_TTL
+    def __init__(self, ttl=None, max_attempts=None, url=None, client=None):
+        super().__init__(ttl, max_attempts)
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url or settings.OTP_REDIS_URL)
+        self.client = client
+        self._verify_script = client.register_script(VERIFY_SCRIPT)
+
+    def _issue(self, phone, code_hash):
+        key = f'otp:{phone}'
+        with self.client.pipeline() as pipe:
+            pipe.delete(key)
+            pipe.hset(key, mapping={'hash': code_hash, 'attempts': 0})
+            pipe.expire(key, self.ttl)
+            pipe.execute()
+
+    def _verify(self, phone, code_hash):
+        return SCRIPT_RESULTS[self._verify_script(keys=[f'otp:{phone}'], args=[code_hash, self.max_attempts])]
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_otp_store():
+    # Экземпляр на процесс для каждого значения OTP_STORE
+    path = settings.OTP_STORE
+    store = _stores.get(path)
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(path)
+            if store is None:
+                store = _stores[path] = import_string(path)()
+    return store
@@ -0,0 +1,11 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class ReferralCursorPagination(CursorPagination):
+    # Keyset-пагинация по телефону: номер уникален и входит в индекс (referred_by, phone),
+    # поэтому каждая страница читается из индекса за O(page_size) независимо от смещения
+    ordering = 'phone'
+    page_size = settings.REFERRALS_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.REFERRALS_MAX_PAGE_SIZE
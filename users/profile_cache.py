@@ -0,0 +1,67 @@
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+
+
+# Версия профиля пользователя - время его последнего изменения. Профиль меняется, только когда
+# пользователь активирует инвайт-код или кто-то активирует его код, поэтому версия хранится
+# в кэше по инвайт-коду и обновляется при активации. По версии строятся ключ кэша фрагмента
+# со списком рефералов и ETag/Last-Modified: повторный запрос профиля получает 304
+# без обращений к БД и без рендеринга
+
+
+def profile_version_key(invite_code=None, user_id=None):
+    # У пользователя без инвайт-кода нет рефералов, его версия хранится по id
+    return f'profile_version_{invite_code}' if invite_code else f'profile_version_user_{user_id}'
+
+
+def _user_key(user):
+    return profile_version_key(user.invite_code, user.pk)
+
+
+def get_profile_version(user):
+    key = _user_key(user)
+    version = cache.get(key)
+    if version is None:
+        # Версия неизвестна (кэш очищен или истек): считаем, что профиль изменился сейчас
+        version = time.time()
+        if not cache.add(key, version, timeout=settings.REFERRAL_CACHE_TIMEOUT):
+            version = cache.get(key, version)
+    return version
+
+
+def bump_profile_versions(user, invite_code):
+    # Вызывается после активации: меняются профиль пользователя и профиль пригласившего
+    version = time.time()
+    cache.set_many(
+        {_user_key(user): version, profile_version_key(invite_code): version},
+        timeout=settings.REFERRAL_CACHE_TIMEOUT
+    )
+
+
+async def abump_profile_versions(user, invite_code):
+    version = time.time()
+    await cache.aset_many(
+        {_user_key(user): version, profile_version_key(invite_code): version},
+        timeout=settings.REFERRAL_CACHE_TIMEOUT
+    )
+
+
+def profile_etag(request):
+    # Кроме версии в ETag входят поля профиля: в API они берутся из claims токена,
+    # и ответ по старому токену не должен совпасть с ответом по новому.
+    # Пока есть непоказанные сообщения, страница рендерится заново, иначе они потеряются
+    user = request.user
+    if not user.is_authenticated or len(get_messages(request)):
+        return None
+    return f'"{user.pk}-{user.activated_invite_code or ""}-{get_profile_version(user)!r}"'
+
+
+def profile_last_modified(request):
+    user = request.user
+    if not user.is_authenticated or len(get_messages(request)):
+        return None
+    return datetime.fromtimestamp(get_profile_version(user), tz=timezone.utc)
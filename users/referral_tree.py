@@ -0,0 +1,266 @@
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import BooleanField, CharField, Count, F, OuterRef, Q, Subquery, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast, Coalesce, Concat, Substr
+
+from .models import User
+
+
+# Многоуровневая реферальная сеть: все пользователи, приглашенные пользователем,
+# приглашенные ими и так далее. Считается одним из трех способов:
+# - path: по материализованному пути referral_path, один запрос по индексу на префикс пути;
+# - cte: рекурсивным CTE по referred_by, один запрос (PostgreSQL и SQLite);
+# - levels: по запросу на уровень, для остальных БД
+
+RECURSIVE_CTE_VENDORS = {'postgresql', 'sqlite'}
+IN_BATCH_SIZE = 1000
+# Сколько уровней вверх по цепочке пригласивших проверяется при поиске цикла
+CYCLE_CHECK_DEPTH = 1000
+# БД, в которых одновременные активации разводятся блокировками (см. lock_activation). В SQLite запись
+# и так идет по очереди, в остальных БД проверка цикла только в UPDATE активации
+ACTIVATION_LOCK_VENDORS = {'postgresql'}
+
+
+def own_path(pk):
+    # Путь пользователя, которого никто не пригласил (в БД у него NULL)
+    return f'/{pk}/'
+
+
+def under_path(prefix):
+    # Пользователи, путь которых начинается с prefix. В PostgreSQL LIKE 'prefix%' идет по индексу
+    # с text_pattern_ops. В SQLite Django добавляет к LIKE ESCAPE, и индекс не используется, поэтому
+    # префикс заменяется диапазоном: после '/' в пути идет цифра, а '0' - следующий за '/' символ
+    if connection.vendor == 'postgresql':
+        return Q(referral_path__startswith=prefix)
+    return Q(referral_path__gte=prefix, referral_path__lt=prefix[:-1] + '0')
+
+
+def path_expression(pk_field='pk', path_field='referral_path'):
+    return Coalesce(
+        F(path_field),
+        Concat(Value('/'), Cast(pk_field, CharField()), Value('/'), output_field=CharField()),
+        output_field=CharField()
+    )
+
+
+def _quoted_names():
+    quote = connection.ops.quote_name
+    return (
+        quote(User._meta.db_table),
+        quote(User._meta.get_field('referred_by').column),
+        quote(User._meta.pk.column),
+    )
+
+
+def without_cycles(inviter, user, invite_code):
+    # Условия, не дающие замкнуть цепочку приглашений: пригласивший не должен быть
+    # в сети пользователя. Возвращает (queryset пригласившего, условие для UPDATE или None)
+    if settings.REFERRAL_PATHS_ENABLED:
+        return inviter.exclude(referral_path__contains=own_path(user.pk)), None
+    if connection.vendor not in RECURSIVE_CTE_VENDORS:
+        return inviter, None
+
+    # Без путей цепочка пригласивших поднимается рекурсивным CTE внутри того же UPDATE
+    table, referred_by, user_id = _quoted_names()
+    sql = f'''
+        NOT EXISTS (
+            WITH RECURSIVE ancestors (id, level) AS (
+                SELECT {referred_by}, 1 FROM {table} WHERE invite_code = %s
+                UNION ALL
+                SELECT u.{referred_by}, a.level + 1
+                FROM {table} u JOIN ancestors a ON u.{user_id} = a.id
+                WHERE a.level < %s
+            )
+            SELECT 1 FROM ancestors WHERE id = %s
+        )
+    '''
+    return inviter, RawSQL(sql, [invite_code, CYCLE_CHECK_DEPTH, user.pk], output_field=BooleanField())
+
+
+def tree_root(invite_code):
+    # id корня дерева, в котором состоит владелец invite_code, или None, если такого кода нет
+    if settings.REFERRAL_PATHS_ENABLED:
+        row = User.objects.filter(invite_code=invite_code).values_list('pk', 'referral_path').first()
+        if row is None:
+            return None
+        pk, path = row
+        return int(path.split('/')[1]) if path else pk
+
+    if connection.vendor in RECURSIVE_CTE_VENDORS:
+        table, referred_by, user_id = _quoted_names()
+        sql = f'''
+            WITH RECURSIVE ancestors (id, parent, level) AS (
+                SELECT {user_id}, {referred_by}, 1 FROM {table} WHERE invite_code = %s
+                UNION ALL
+                SELECT u.{user_id}, u.{referred_by}, a.level + 1
+                FROM {table} u JOIN ancestors a ON u.{user_id} = a.parent
+                WHERE a.level < %s
+            )
+            SELECT id FROM ancestors ORDER BY level DESC LIMIT 1
+        '''
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [invite_code, CYCLE_CHECK_DEPTH])
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    row = User.objects.filter(invite_code=invite_code).values_list('pk', 'referred_by_id').first()
+    for _ in range(CYCLE_CHECK_DEPTH):
+        if row is None or row[1] is None:
+            break
+        row = User.objects.filter(pk=row[1]).values_list('pk', 'referred_by_id').first()
+    return row[0] if row else None
+
+
+def lock_activation(user, invite_code):
+    # Проверка цикла в UPDATE активации не защищает от двух одновременных активаций: A активирует код
+    # из сети B, а B - код из сети A, и каждый UPDATE видит дерево до другой активации. Пользователь,
+    # активирующий код, всегда корень своего дерева, а цепочка замыкается, только если он же корень
+    # дерева пригласившего. Поэтому до UPDATE строка пользователя блокируется FOR UPDATE, а строка
+    # корня дерева пригласившего - FOR SHARE. Такая пара активаций конфликтует и выполняется по очереди,
+    # а обычные активации в одно дерево друг друга не ждут. Блокировки берутся в порядке id, чтобы пара
+    # не попала во взаимную блокировку: если корень меньше пользователя, строку пользователя блокирует
+    # сам UPDATE. FOR SHARE в Django нет, поэтому запросы сырые. Вызывается внутри транзакции.
+    # Если корень сам успел активировать код, пока ждали блокировку, корень ищется заново
+    if connection.vendor not in ACTIVATION_LOCK_VENDORS:
+        return
+    table, referred_by, user_id = _quoted_names()
+    # У пользователя из claims токена id - строка
+    pk = User._meta.pk.to_python(user.pk)
+    while True:
+        root = tree_root(invite_code)
+        # Кода нет или пригласивший уже в сети пользователя: UPDATE откажет и без блокировок
+        if root is None or root == pk:
+            return
+        with connection.cursor() as cursor:
+            if pk < root:
+                cursor.execute(f'SELECT 1 FROM {table} WHERE {user_id} = %s FOR UPDATE', [pk])
+            cursor.execute(f'SELECT {referred_by} FROM {table} WHERE {user_id} = %s FOR SHARE', [root])
+            row = cursor.fetchone()
+        if row is None or row[0] is None:
+            return
+
+
+def inviter_path_values(inviter, user):
+    # Значения для UPDATE активации: путь пригласившего плюс id пользователя и следующий уровень
+    inviter = inviter.annotate(path=path_expression())
+    return {
+        'referral_path': Concat(
+            Subquery(inviter.values('path')[:1]), Value(f'{user.pk}/'), output_field=CharField()
+        ),
+        'referral_depth': Subquery(inviter.values('referral_depth')[:1]) + 1,
+    }
+
+
+def move_subtree(user):
+    # Вызывается после активации при REFERRAL_PATHS_ENABLED. До активации пользователь был корнем,
+    # поэтому пути его рефералов начинаются с '/<id>/' - этот префикс заменяется новым путем
+    # пользователя одним UPDATE
+    prefix = own_path(user.pk)
+    moved = User.objects.filter(pk=user.pk)
+    return User.objects.filter(under_path(prefix)).update(
+        referral_path=Concat(
+            Subquery(moved.values('referral_path')[:1]), Substr('referral_path', len(prefix) + 1),
+            output_field=CharField()
+        ),
+        referral_depth=F('referral_depth') + Subquery(moved.values('referral_depth')[:1]),
+    )
+
+
+def default_method():
+    if settings.REFERRAL_PATHS_ENABLED:
+        return 'path'
+    if connection.vendor in RECURSIVE_CTE_VENDORS:
+        return 'cte'
+    return 'levels'
+
+
+def get_downline(user, max_depth=None, method=None):
+    # Размер сети (size), глубина (depth) и количество рефералов на каждом уровне (levels, с первого)
+    max_depth = max_depth or settings.REFERRAL_TREE_MAX_DEPTH
+    levels = {
+        'path': _levels_by_path,
+        'cte': _levels_by_cte,
+        'levels': _levels_by_level,
+    }[method or default_method()](user.pk, max_depth)
+    return {'size': sum(levels), 'depth': len(levels), 'levels': levels}
+
+
+def _levels_by_path(pk, max_depth):
+    path, depth = User.objects.filter(pk=pk).values_list('referral_path', 'referral_depth').first() or (None, 0)
+    counts = (
+        User.objects
+        .filter(
+            under_path(path or own_path(pk)),
+            referral_depth__gt=depth,
+            referral_depth__lte=depth + max_depth,
+        )
+        .values('referral_depth')
+        .annotate(count=Count('pk'))
+        .values_list('referral_depth', 'count')
+        .order_by('referral_depth')
+    )
+    return [count for _, count in counts]
+
+
+def _levels_by_cte(pk, max_depth):
+    table, referred_by, user_id = _quoted_names()
+    # Глубина ограничена, поэтому цикл в цепочке приглашений не приведет к бесконечной рекурсии
+    sql = f'''
+        WITH RECURSIVE downline (id, level) AS (
+            SELECT {user_id}, 1 FROM {table} WHERE {referred_by} = %s
+            UNION ALL
+            SELECT u.{user_id}, d.level + 1
+            FROM {table} u JOIN downline d ON u.{referred_by} = d.id
+            WHERE d.level < %s
+        )
+        SELECT level, COUNT(*) FROM downline GROUP BY level ORDER BY level
+    '''
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [pk, max_depth])
+        return [count for _, count in cursor.fetchall()]
+
+
+def _levels_by_level(pk, max_depth):
+    levels = []
+    parents = [pk]
+    while parents and len(levels) < max_depth:
+        children = []
+        for start in range(0, len(parents), IN_BATCH_SIZE):
+            children.extend(
+                User.objects.filter(referred_by_id__in=parents[start:start + IN_BATCH_SIZE])
+                .values_list('pk', flat=True)
+            )
+        if children:
+            levels.append(len(children))
+        parents = children
+    return levels
+
+
+def rebuild_referral_paths(max_levels=10_000):
+    # Строит пути заново от корней вниз: один UPDATE на уровень дерева.
+    # Возвращает (количество пользователей с путем, количество недостижимых из корней -
+    # такие пользователи состоят в цикле приглашений)
+    parent = User.objects.filter(pk=OuterRef('referred_by_id')).annotate(path=path_expression())
+    with transaction.atomic():
+        User.objects.update(referral_path=None, referral_depth=0)
+
+        total = 0
+        level = User.objects.filter(referred_by__isnull=False, referred_by__referred_by__isnull=True)
+        for depth in range(1, max_levels + 1):
+            updated = level.update(
+                referral_path=Concat(
+                    Subquery(parent.values('path')[:1]), Cast('pk', CharField()), Value('/'),
+                    output_field=CharField()
+                ),
+                referral_depth=depth,
+            )
+            if not updated:
+                break
+            total += updated
+            level = User.objects.filter(
+                referred_by__referral_depth=depth, referred_by__referral_path__isnull=False
+            )
+
+        unreachable = User.objects.filter(referred_by__isnull=False, referral_path__isnull=True).count()
+    return total, unreachable
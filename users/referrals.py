@@ -0,0 +1,158 @@
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+
+from .models import User
+
+
+# Счетчики и списки рефералов хранятся в кэше по инвайт-коду пригласившего:
+# при активации код известен сразу, без дополнительного запроса к БД.
+# Счетчик, посчитанный по БД при промахе, мог устареть до записи в кэш: активация успела
+# завершиться, а ее incr не нашел ключа. Такая активация записывает новую отметку (случайное значение
+# на STALE_MARK_TIMEOUT секунд). Читатель берет отметку вместе со счетчиком до подсчета и, если после
+# записи счетчика отметка изменилась, удаляет его
+STALE_MARK_TIMEOUT = 60
+
+
+def referral_count_key(invite_code):
+    return f'referrals_count_{invite_code}'
+
+
+def referral_list_key(invite_code):
+    return f'referrals_list_{invite_code}'
+
+
+def referral_stale_key(invite_code):
+    return f'referrals_count_stale_{invite_code}'
+
+
+def referrals_of(user):
+    # По первичному ключу, а не через user.referrals: пользователь может быть
+    # восстановлен из claims токена без загрузки модели
+    return User.objects.filter(referred_by_id=user.pk)
+
+
+def get_referral_count(user):
+    if not user.invite_code:
+        return 0
+
+    key, stale_key = referral_count_key(user.invite_code), referral_stale_key(user.invite_code)
+    cached = cache.get_many([key, stale_key])
+    count = cached.get(key)
+    if count is None:
+        count = referrals_of(user).count()
+        # add, а не set: не затираем значение, которое успела увеличить активация
+        cache.add(key, count, timeout=settings.REFERRAL_CACHE_TIMEOUT)
+        if cache.get(stale_key) != cached.get(stale_key):
+            cache.delete(key)
+    return count
+
+
+async def aget_referral_count(user):
+    if not user.invite_code:
+        return 0
+
+    key, stale_key = referral_count_key(user.invite_code), referral_stale_key(user.invite_code)
+    cached = await cache.aget_many([key, stale_key])
+    count = cached.get(key)
+    if count is None:
+        count = await referrals_of(user).acount()
+        await cache.aadd(key, count, timeout=settings.REFERRAL_CACHE_TIMEOUT)
+        if await cache.aget(stale_key) != cached.get(stale_key):
+            await cache.adelete(key)
+    return count
+
+
+def get_referral_phones(user):
+    if not user.invite_code:
+        return []
+
+    key = referral_list_key(user.invite_code)
+    phones = cache.get(key)
+    if phones is None:
+        phones = list(referrals_of(user).order_by('phone').values_list('phone', flat=True))
+        cache.add(key, phones, timeout=settings.REFERRAL_CACHE_TIMEOUT)
+    return phones
+
+
+def register_referral(invite_code):
+    # Вызывается после успешной активации инвайт-кода: счетчик увеличивается,
+    # список сбрасывается и будет построен заново при следующем чтении
+    try:
+        cache.incr(referral_count_key(invite_code))
+    except ValueError:
+        # Счетчика нет в кэше - он будет посчитан по БД при следующем чтении. Параллельное чтение
+        # могло посчитать его до активации: отметка не даст ему остаться в кэше
+        cache.set(referral_stale_key(invite_code), uuid.uuid4().hex, timeout=STALE_MARK_TIMEOUT)
+        cache.delete(referral_count_key(invite_code))
+    cache.delete(referral_list_key(invite_code))
+
+
+async def aregister_referral(invite_code):
+    try:
+        await cache.aincr(referral_count_key(invite_code))
+    except ValueError:
+        await cache.aset(referral_stale_key(invite_code), uuid.uuid4().hex, timeout=STALE_MARK_TIMEOUT)
+        await cache.adelete(referral_count_key(invite_code))
+    await cache.adelete(referral_list_key(invite_code))
+
+
+def iter_referral_counts(batch_size=1000):
+    # Пачками отдает фактические счетчики рефералов из БД: {invite_code: count}
+    users = User.objects.filter(invite_code__isnull=False).order_by('pk').values_list('pk', 'invite_code')
+    batch = []
+    for user_id, invite_code in users.iterator(chunk_size=batch_size):
+        batch.append((user_id, invite_code))
+        if len(batch) == batch_size:
+            yield _count_batch(batch)
+            batch = []
+    if batch:
+        yield _count_batch(batch)
+
+
+def _count_batch(batch):
+    counts = dict(
+        User.objects.filter(referred_by_id__in=[user_id for user_id, _ in batch])
+        .values('referred_by_id')
+        .annotate(count=Count('id'))
+        .values_list('referred_by_id', 'count')
+        .order_by()
+    )
+    return {invite_code: counts.get(user_id, 0) for user_id, invite_code in batch}
+
+
+def get_referral_counts(users):
+    # Счетчики для многих пользователей сразу: [(id, invite_code)] -> {invite_code: count}.
+    # Найденные в кэше берутся из него одним get_many, остальные считаются одним запросом с GROUP BY
+    users = [(user_id, invite_code) for user_id, invite_code in users if invite_code]
+    cached = cache.get_many([referral_count_key(code) for _, code in users])
+    counts = {code: cached[referral_count_key(code)] for _, code in users if referral_count_key(code) in cached}
+    missing = [(user_id, code) for user_id, code in users if code not in counts]
+    if missing:
+        counts.update(_count_batch(missing))
+    return counts
+
+
+def rebuild_referral_counters(batch_size=1000):
+    total = 0
+    for counts in iter_referral_counts(batch_size):
+        cache.set_many(
+            {referral_count_key(code): count for code, count in counts.items()},
+            timeout=settings.REFERRAL_CACHE_TIMEOUT
+        )
+        cache.delete_many([referral_list_key(code) for code in counts])
+        total += len(counts)
+    return total
+
+
+def find_counter_drift(batch_size=1000):
+    # Счетчики, значение которых в кэше расходится с БД: (invite_code, в кэше, в БД).
+    # Отсутствующие в кэше счетчики расхождением не считаются
+    for counts in iter_referral_counts(batch_size):
+        cached = cache.get_many([referral_count_key(code) for code in counts])
+        for code, count in counts.items():
+            cached_count = cached.get(referral_count_key(code))
+            if cached_count is not None and cached_count != count:
+                yield code, cached_count, count
@@ -0,0 +1,29 @@
+from django.conf import settings
+
+# Описание схемы API для drf-spectacular. Пакет импортируется только при API_DOCS:
+# без документации декораторы ничего не меняют и drf-spectacular не загружается при старте воркера
+
+if settings.API_DOCS:
+    from drf_spectacular.utils import (  # noqa: F401
+        extend_schema, extend_schema_serializer, extend_schema_field, OpenApiExample, OpenApiResponse
+    )
+else:
+    def _unchanged(target):
+        return target
+
+    def extend_schema(*args, **kwargs):
+        return _unchanged
+
+    def extend_schema_serializer(*args, **kwargs):
+        return _unchanged
+
+    def extend_schema_field(*args, **kwargs):
+        return _unchanged
+
+    class OpenApiExample:
+        def __init__(self, *args, **kwargs):
+            pass
+
+    class OpenApiResponse:
+        def __init__(self, *args, **kwargs):
+            pass
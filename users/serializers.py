@@ -1,8 +1,12 @@
-import re
-from drf_spectacular.utils import extend_schema_serializer, OpenApiExample, extend_schema_field
+from django.conf import settings
+from .schema import extend_schema_serializer, OpenApiExample, extend_schema_field
 from rest_framework import serializers
 
+from .export import FORMATS
+from .instrumentation import TimedSerializerMixin
 from .models import User
+from .referrals import get_referral_count
+from .validators import is_valid_phone
 
 @extend_schema_serializer(
     examples=[
@@ -13,13 +17,13 @@ from .models import User
     ]
 )
 
-class PhoneRequestSerializer(serializers.Serializer):
+class PhoneRequestSerializer(TimedSerializerMixin, serializers.Serializer):
     phone = serializers.CharField(
         max_length=15
     )
 
     def validate_phone(self, value):
-        if not re.match(r'^\+7\d{10}$', value):
+        if not is_valid_phone(value):
             raise serializers.ValidationError('Введите корректный номер телефона в формате +7XXXXXXXXXX')
         return value
 
@@ -32,7 +36,7 @@ class PhoneRequestSerializer(serializers.Serializer):
         )
     ]
 )
-class CodeVerifySerializer(serializers.Serializer):
+class CodeVerifySerializer(TimedSerializerMixin, serializers.Serializer):
     phone = serializers.CharField(
         max_length=15
     )
@@ -41,21 +45,155 @@ class CodeVerifySerializer(serializers.Serializer):
     )
 
 
-class UserProfileSerializer(serializers.ModelSerializer):
-    @extend_schema_field(serializers.ListField(child=serializers.CharField()))
+class UserProfileSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    @extend_schema_field(serializers.IntegerField())
 
-    def get_referrals(self, obj):
-        referral_users = User.objects.filter(activated_invite_code=obj.invite_code)
-        return [user.phone for user in referral_users]
+    def get_referrals_count(self, obj):
+        return get_referral_count(obj)
 
-    referrals = serializers.SerializerMethodField(
-        help_text="Список телефонных номеров пользователей, активировавших инвайт-код данного пользователя"
+    referrals_count = serializers.SerializerMethodField(
+        help_text="Количество пользователей, активировавших инвайт-код данного пользователя"
     )
 
     class Meta:
         model = User
-        fields = ['phone', 'invite_code', 'activated_invite_code', 'referrals']
-        read_only_fields = ['phone', 'invite_code', 'referrals']
+        fields = ['phone', 'invite_code', 'activated_invite_code', 'referrals_count']
+        read_only_fields = ['phone', 'invite_code', 'referrals_count']
+
+
+class ReferralSerializer(TimedSerializerMixin, serializers.Serializer):
+    phone = serializers.CharField(
+        help_text="Телефонный номер пользователя, активировавшего инвайт-код"
+    )
+
+
+class ReferralTreeQuerySerializer(TimedSerializerMixin, serializers.Serializer):
+    depth = serializers.IntegerField(
+        min_value=1,
+        required=False,
+        help_text="Сколько уровней сети учитывать. По умолчанию и не больше REFERRAL_TREE_MAX_DEPTH"
+    )
+
+    def validate_depth(self, value):
+        if value > settings.REFERRAL_TREE_MAX_DEPTH:
+            raise serializers.ValidationError(f'Не больше {settings.REFERRAL_TREE_MAX_DEPTH}')
+        return value
+
+
+class ReferralTreeSerializer(TimedSerializerMixin, serializers.Serializer):
+    size = serializers.IntegerField(
+        help_text="Количество пользователей в реферальной сети на всех уровнях"
+    )
+    depth = serializers.IntegerField(
+        help_text="Количество уровней сети"
+    )
+    levels = serializers.ListField(
+        child=serializers.IntegerField(),
+        help_text="Количество рефералов на каждом уровне, начиная с первого"
+    )
+
+
+class LeaderboardQuerySerializer(TimedSerializerMixin, serializers.Serializer):
+    window = serializers.ChoiceField(
+        choices=['day', 'week', 'all'],
+        default='all',
+        help_text="Период рейтинга: текущий день, текущая неделя или все время"
+    )
+    limit = serializers.IntegerField(
+        min_value=1,
+        required=False,
+        help_text="Сколько мест рейтинга вернуть. По умолчанию и не больше LEADERBOARD_SIZE"
+    )
+
+    def validate_limit(self, value):
+        if value > settings.LEADERBOARD_SIZE:
+            raise serializers.ValidationError(f'Не больше {settings.LEADERBOARD_SIZE}')
+        return value
+
+
+class LeaderboardEntrySerializer(TimedSerializerMixin, serializers.Serializer):
+    rank = serializers.IntegerField(
+        help_text="Место в рейтинге"
+    )
+    invite_code = serializers.CharField(
+        help_text="Инвайт-код пригласившего пользователя"
+    )
+    referrals = serializers.IntegerField(
+        help_text="Количество активаций инвайт-кода за период"
+    )
+
+
+class LeaderboardSerializer(TimedSerializerMixin, serializers.Serializer):
+    window = serializers.CharField(
+        help_text="Период рейтинга"
+    )
+    period = serializers.CharField(
+        help_text="Конкретный период: day:2024-01-31, week:2024-W05 или all"
+    )
+    results = LeaderboardEntrySerializer(many=True)
+
+
+class ReferralExportQuerySerializer(TimedSerializerMixin, serializers.Serializer):
+    # Параметр не называется format: его DRF использует для выбора рендерера
+    output = serializers.ChoiceField(
+        choices=FORMATS,
+        default='csv',
+        help_text="Формат выгрузки: csv или jsonl"
+    )
+    gzip = serializers.BooleanField(
+        default=False,
+        help_text="Сжать выгрузку gzip"
+    )
+
+
+@extend_schema_serializer(
+    examples=[
+        OpenApiExample(
+            'Пример пакетного запроса профилей',
+            value={'ids': [1, 2, 3]}
+        )
+    ]
+)
+class BatchProfilesRequestSerializer(TimedSerializerMixin, serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        required=False,
+        help_text="id пользователей"
+    )
+    phones = serializers.ListField(
+        child=serializers.CharField(max_length=15),
+        required=False,
+        help_text="Номера телефонов пользователей, вместо ids"
+    )
+
+    def validate(self, attrs):
+        if ('ids' in attrs) == ('phones' in attrs):
+            raise serializers.ValidationError('Укажите ids или phones')
+        keys = attrs.get('ids', attrs.get('phones'))
+        if not keys:
+            raise serializers.ValidationError('Список пуст')
+        if len(keys) > settings.BATCH_PROFILES_MAX_SIZE:
+            raise serializers.ValidationError(f'Не больше {settings.BATCH_PROFILES_MAX_SIZE} пользователей за запрос')
+        return attrs
+
+
+class BatchProfileSerializer(TimedSerializerMixin, serializers.Serializer):
+    id = serializers.IntegerField()
+    phone = serializers.CharField()
+    invite_code = serializers.CharField(allow_null=True)
+    activated_invite_code = serializers.CharField(allow_null=True)
+    referrals_count = serializers.IntegerField()
+
+
+class BatchProfilesSerializer(TimedSerializerMixin, serializers.Serializer):
+    results = BatchProfileSerializer(
+        many=True,
+        help_text="Найденные профили в порядке запроса"
+    )
+    not_found = serializers.ListField(
+        child=serializers.CharField(),
+        help_text="Ненайденные id или номера"
+    )
 
 
 @extend_schema_serializer(
@@ -66,7 +204,7 @@ class UserProfileSerializer(serializers.ModelSerializer):
         )
     ]
 )
-class ActivateInviteCodeSerializer(serializers.Serializer):
+class ActivateInviteCodeSerializer(TimedSerializerMixin, serializers.Serializer):
     invite_code = serializers.CharField(
         max_length=6
     )
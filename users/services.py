@@ -0,0 +1,201 @@
+from contextlib import nullcontext
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Exists, Subquery
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .authentication import add_user_claims, user_cache
+from .auth import generate_verification_code
+from .delivery import send_verification_code
+from .invite_codes import allocate_invite_code
+from .leaderboard import record_activation
+from .models import User
+from .otp import get_otp_store, VERIFIED, LOCKED
+from .profile_cache import bump_profile_versions, abump_profile_versions
+from .referral_tree import ACTIVATION_LOCK_VENDORS, without_cycles, inviter_path_values, lock_activation, move_subtree
+from .referrals import register_referral, aregister_referral
+
+
+# Бизнес-логика авторизации и инвайт-кодов, общая для API и веб-интерфейса.
+# Функции принимают уже провалидированные данные и сообщают об ошибках через ServiceError
+
+
+class ServiceError(Exception):
+    def __init__(self, detail):
+        super().__init__(detail)
+        self.detail = detail
+
+
+def send_code(phone):
+    code = generate_verification_code()
+    get_otp_store().issue(phone, code)
+
+    # Отправка SMS выполняется в фоне, запрос не ждет ответа шлюза
+    send_verification_code(phone, code)
+    return code
+
+
+async def asend_code(phone):
+    code = generate_verification_code()
+    await get_otp_store().aissue(phone, code)
+    send_verification_code(phone, code)
+    return code
+
+
+def check_otp_result(result):
+    if result == LOCKED:
+        raise ServiceError('Превышено количество попыток ввода кода, запросите новый код')
+    if result != VERIFIED:
+        raise ServiceError('Неверный код')
+
+
+def verify_code(phone, code):
+    # Код одноразовый: при успешной проверке он удаляется из хранилища
+    check_otp_result(get_otp_store().verify(phone, code))
+
+    # Если пользователь уже есть в бд - это один SELECT
+    user = User.objects.filter(phone=phone).first()
+    if user is not None:
+        return user
+
+    # Новый пользователь создается одним INSERT сразу с инвайт-кодом. Код выдается
+    # до транзакции: аренда блока кодов не должна откатываться вместе с ней
+    invite_code = allocate_invite_code()
+    try:
+        # В режиме autocommit INSERT атомарен сам по себе, точка сохранения нужна только внутри транзакции
+        with transaction.atomic() if connection.in_atomic_block else nullcontext():
+            return User.objects.create(phone=phone, invite_code=invite_code)
+    except IntegrityError:
+        # Пользователь успел зарегистрироваться параллельным запросом
+        return User.objects.get(phone=phone)
+
+
+async def averify_code(phone, code):
+    check_otp_result(await get_otp_store().averify(phone, code))
+
+    user = await User.objects.filter(phone=phone).afirst()
+    if user is not None:
+        return user
+
+    # В асинхронном коде внешней транзакции нет, поэтому неудачный INSERT ничего не ломает
+    invite_code = await sync_to_async(allocate_invite_code)()
+    try:
+        return await User.objects.acreate(phone=phone, invite_code=invite_code)
+    except IntegrityError:
+        return await User.objects.aget(phone=phone)
+
+
+def issue_tokens(user):
+    refresh = RefreshToken.for_user(user)
+    # Claims добавляются только в access токен: токены, обновленные по refresh,
+    # не несут устаревших данных и аутентифицируются через загрузку пользователя
+    return {
+        'refresh': str(refresh),
+        'access': str(add_user_claims(refresh.access_token, user))
+    }
+
+
+def _activation_query(user, invite_code):
+    # Активация - один условный UPDATE: код еще не активирован, код не свой и пригласивший
+    # существует. Пригласивший подставляется подзапросом в том же запросе, поэтому
+    # гонка двух активаций одного пользователя невозможна
+    # Пригласивший не может быть в сети самого пользователя, иначе цепочка замкнется. Одновременные
+    # активации, которые вместе замкнули бы цепочку, разводит lock_activation
+    inviter, no_cycle = without_cycles(User.objects.filter(invite_code=invite_code), user, invite_code)
+    queryset = (
+        User.objects
+        .filter(pk=user.pk, activated_invite_code__isnull=True)
+        .exclude(invite_code=invite_code)
+        .filter(Exists(inviter))
+    )
+    if no_cycle is not None:
+        queryset = queryset.filter(no_cycle)
+    values = {
+        'activated_invite_code': invite_code,
+        'activated_at': timezone.now(),
+        'referred_by': Subquery(inviter.values('pk')[:1]),
+    }
+    if settings.REFERRAL_PATHS_ENABLED:
+        values.update(inviter_path_values(inviter, user))
+    return queryset, values
+
+
+def _activation_error(user, invite_code, activated_invite_code, inviter_exists):
+    # Причина отказа выясняется только в случае неудачи
+    if activated_invite_code:
+        return ServiceError('Вы уже активировали инвайт-код')
+    if user.invite_code == invite_code:
+        return ServiceError('Вы не можете активировать свой собственный инвайт-код')
+    if inviter_exists:
+        return ServiceError('Нельзя активировать инвайт-код пользователя из вашей реферальной сети')
+    return ServiceError('Инвайт-код не существует')
+
+
+def _failure_query(user, invite_code):
+    return User.objects.filter(pk=user.pk).annotate(
+        inviter_exists=Exists(User.objects.filter(invite_code=invite_code))
+    ).values_list('activated_invite_code', 'inviter_exists')
+
+
+def _update_activation(user, invite_code):
+    queryset, values = _activation_query(user, invite_code)
+    if not queryset.update(**values):
+        activated, inviter_exists = _failure_query(user, invite_code).first() or (None, False)
+        raise _activation_error(user, invite_code, activated, inviter_exists)
+
+    if settings.REFERRAL_PATHS_ENABLED:
+        move_subtree(user)
+    return values['activated_at']
+
+
+def _locked_activation(user, invite_code):
+    # Активации, которые вместе замкнули бы цепочку, выполняются по очереди (см. lock_activation),
+    # вместе с переносом путей сети пользователя в одной транзакции
+    with transaction.atomic():
+        lock_activation(user, invite_code)
+        return _update_activation(user, invite_code)
+
+
+def activate_invite_code(user, invite_code):
+    # Проверяем, не активировал ли пользователь уже инвайт-код
+    if user.activated_invite_code:
+        raise ServiceError('Вы уже активировали инвайт-код')
+
+    if connection.vendor in ACTIVATION_LOCK_VENDORS:
+        activated_at = _locked_activation(user, invite_code)
+    else:
+        activated_at = _update_activation(user, invite_code)
+
+    user.activated_invite_code = invite_code
+    user.activated_at = activated_at
+    user_cache.delete(user.pk)
+    register_referral(invite_code)
+    bump_profile_versions(user, invite_code)
+    record_activation(invite_code)
+
+
+async def aactivate_invite_code(user, invite_code):
+    if user.activated_invite_code:
+        raise ServiceError('Вы уже активировали инвайт-код')
+
+    if connection.vendor in ACTIVATION_LOCK_VENDORS:
+        # Блокировки держатся до конца транзакции, а транзакций в асинхронном коде Django нет
+        activated_at = await sync_to_async(_locked_activation)(user, invite_code)
+    else:
+        queryset, values = _activation_query(user, invite_code)
+        if not await queryset.aupdate(**values):
+            activated, inviter_exists = await _failure_query(user, invite_code).afirst() or (None, False)
+            raise _activation_error(user, invite_code, activated, inviter_exists)
+        if settings.REFERRAL_PATHS_ENABLED:
+            await sync_to_async(move_subtree)(user)
+        activated_at = values['activated_at']
+
+    user.activated_invite_code = invite_code
+    user.activated_at = activated_at
+    user_cache.delete(user.pk)
+    await aregister_referral(invite_code)
+    await abump_profile_versions(user, invite_code)
+    await sync_to_async(record_activation)(invite_code)
@@ -1,21 +1,28 @@
-import os
-
+from django.conf import settings
 from django.shortcuts import render, redirect
+from django.utils.decorators import method_decorator
+from django.utils.functional import SimpleLazyObject
 from django.views import View
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 from django.contrib.auth.mixins import LoginRequiredMixin
-import requests
 
-from .models import User
+from .delivery import DeliveryQueueFull
+from .profile_cache import get_profile_version, profile_etag, profile_last_modified
+from .referrals import get_referral_phones
+from .serializers import PhoneRequestSerializer, CodeVerifySerializer, ActivateInviteCodeSerializer
+from .services import ServiceError, send_code, verify_code, activate_invite_code
+from .throttling import check_rates
 from django.contrib.auth import login
 from django.contrib import messages
-import jwt
-from dotenv import load_dotenv
-
-load_dotenv()
 
 
-# Базовый url для API запросов
-BASE_URL = os.getenv('API_BASE_URL', 'http://localhost:8000/api/')
+def first_error(errors, default):
+    # Первое сообщение об ошибке валидации сериализатора
+    for field_errors in errors.values():
+        if isinstance(field_errors, list) and field_errors:
+            return str(field_errors[0])
+    return default
 
 
 # Страница для ввода номера телефона
@@ -27,23 +34,25 @@ class LoginPhoneView(View):
     def post(self, request):
         phone = request.POST.get('phone')
 
-        response = requests.post(f"{BASE_URL}request-code/", json={'phone': phone})
-        data = response.json()
+        wait = check_rates(request, 'request_code', phone)
+        if wait is not None:
+            messages.error(request, f'Слишком много запросов, попробуйте через {wait} сек.')
+            return render(request, 'login_phone.html', {'phone': phone})
 
-        if response.status_code == 200:
-            request.session['phone'] = phone
-            messages.success(request, f"Код отправлен. Демо-код: {data.get('debug_code')}")
-            return redirect('verify_code')
+        serializer = PhoneRequestSerializer(data={'phone': phone})
+        if not serializer.is_valid():
+            messages.error(request, first_error(serializer.errors, 'Произошла ошибка'))
+            return render(request, 'login_phone.html', {'phone': phone})
 
-        error_message = data.get('detail', 'Произошла ошибка')
+        try:
+            code = send_code(serializer.validated_data['phone'])
+        except DeliveryQueueFull:
+            messages.error(request, 'Сервис отправки кодов перегружен, попробуйте позже')
+            return render(request, 'login_phone.html', {'phone': phone})
 
-        if 'phone' in data:
-            phone_errors = data['phone']
-            if isinstance(phone_errors, list) and phone_errors:
-                error_message = phone_errors[0]
-
-        messages.error(request, error_message)
-        return render(request, 'login_phone.html', {'phone': phone})
+        request.session['phone'] = phone
+        messages.success(request, f"Код отправлен. Демо-код: {code}")
+        return redirect('verify_code')
 
 # Страница для ввода проверочного кода
 class VerifyCodeView(View):
@@ -63,54 +72,48 @@ class VerifyCodeView(View):
             messages.error(request, "Сессия истекла. Пожалуйста, введите номер телефона снова")
             return redirect('login_phone')
 
-        # Запрос к API для проверки кода
-        response = requests.post(f"{BASE_URL}verify-code/", json={'phone': phone, 'code': code})
-
-        if response.status_code == 200:
-            data = response.json()
-
-            # Сохраняем токены в сессии
-            request.session['access_token'] = data.get('access')
-            request.session['refresh_token'] = data.get('refresh')
-
-            # Декодируем токен, чтобы получить айди пользователя
-            try:
-                token_data = jwt.decode(data.get('access'), options={"verify_signature": False})
-                user_id = token_data.get('user_id')
+        wait = check_rates(request, 'verify_code', phone)
+        if wait is not None:
+            messages.error(request, f'Слишком много попыток, попробуйте через {wait} сек.')
+            return render(request, 'verify_code.html')
 
-                # Логиним пользователя
-                user = User.objects.get(id=user_id)
-                login(request, user)
+        serializer = CodeVerifySerializer(data={'phone': phone, 'code': code})
+        if not serializer.is_valid():
+            messages.error(request, first_error(serializer.errors, 'Неверный код'))
+            return render(request, 'verify_code.html')
 
-                messages.success(request, "Вы успешно авторизовались")
-                return redirect('profile')
+        try:
+            user = verify_code(serializer.validated_data['phone'], serializer.validated_data['code'])
+        except ServiceError as e:
+            messages.error(request, e.detail)
+            return render(request, 'verify_code.html')
+        except Exception as e:
+            messages.error(request, f"Ошибка авторизации: {str(e)}")
+            return redirect('login_phone')
 
-            except Exception as e:
-                messages.error(request, f"Ошибка авторизации: {str(e)}")
-                return redirect('login_phone')
-        else:
-            try:
-                data = response.json()
-                messages.error(request, data.get('detail', 'Неверный код'))
-            except:
-                messages.error(request, "Произошла ошибка при проверке кода")
+        # Логиним пользователя
+        login(request, user)
 
-            return render(request, 'verify_code.html')
+        messages.success(request, "Вы успешно авторизовались")
+        return redirect('profile')
 
 # Страница профиля пользователя
 class ProfileView(LoginRequiredMixin, View):
     login_url = '/login-phone/'
 
+    # Браузер перепроверяет страницу при каждом открытии и, пока профиль не изменился, получает 304
+    @method_decorator(cache_control(private=True, no_cache=True))
+    @method_decorator(condition(etag_func=profile_etag, last_modified_func=profile_last_modified))
     def get(self, request):
         # Получаем текущего пользователя
         user = request.user
 
-        # Получаем список рефералов
-        referrals = User.objects.filter(activated_invite_code=user.invite_code)
-
+        # Список рефералов нужен только при рендеринге фрагмента, которого нет в кэше
         context = {
             'user': user,
-            'referrals': referrals
+            'referrals': SimpleLazyObject(lambda: get_referral_phones(user)),
+            'profile_version': get_profile_version(user),
+            'cache_timeout': settings.REFERRAL_CACHE_TIMEOUT,
         }
 
         return render(request, 'profile.html', context)
@@ -130,25 +133,16 @@ class ActivateInviteCodeView(LoginRequiredMixin, View):
             messages.error(request, "Вы уже активировали инвайт-код")
             return redirect('profile')
 
-        # Запрос к API для активации инвайт-кода
-        headers = {'Authorization': f'Bearer {request.session.get("access_token")}'}
-        response = requests.post(
-            f"{BASE_URL}activate-invite-code/",
-            json={'invite_code': invite_code},
-            headers=headers
-        )
-
-        if response.status_code == 200:
-            messages.success(request, "Инвайт-код успешно активирован")
-            # Обновляем пользователя, чтобы изменения сразу отразились
-            request.user.activated_invite_code = invite_code
-            request.user.save()
-            return redirect('profile')
-        else:
-            try:
-                data = response.json()
-                messages.error(request, data.get('detail', 'Ошибка при активации инвайт-кода'))
-            except:
-                messages.error(request, "Произошла ошибка при активации инвайт-кода")
+        serializer = ActivateInviteCodeSerializer(data={'invite_code': invite_code})
+        if not serializer.is_valid():
+            messages.error(request, first_error(serializer.errors, 'Ошибка при активации инвайт-кода'))
+            return render(request, 'activate_code.html')
 
+        try:
+            activate_invite_code(request.user, serializer.validated_data['invite_code'])
+        except ServiceError as e:
+            messages.error(request, e.detail)
             return render(request, 'activate_code.html')
+
+        messages.success(request, "Инвайт-код успешно активирован")
+        return redirect('profile')
@@ -0,0 +1,143 @@
+import math
+import re
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.connection import ConnectionProxy
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+from .metrics import registry
+from .validators import is_valid_phone
+
+# Ограничение частоты запросов кодов и попыток их проверки. Счетчики хранятся в кэше
+# THROTTLE_CACHE_ALIAS: с redis лимит общий для всех воркеров и серверов, с locmem - на процесс.
+# Атомарность incr гарантируют locmem и redis; кэш в БД для этого не подходит
+
+throttle_cache = ConnectionProxy(caches, settings.THROTTLE_CACHE_ALIAS)
+
+throttled_requests = registry.counter('throttled_requests_total', 'Количество запросов, отклоненных ограничением частоты')
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+RATE_RE = re.compile(r'^(\d+)/(\d*)([smhd])')
+
+
+def get_rate(scope):
+    # Лимит в формате DRF ('5/h', '100/day'), дополнительно с длиной периода ('5/10m').
+    # Если лимит для scope не задан, возвращается (None, None) и ограничение не действует
+    rate = api_settings.DEFAULT_THROTTLE_RATES.get(scope)
+    if rate is None:
+        return None, None
+    match = RATE_RE.match(rate)
+    if match is None:
+        raise ValueError(f'Некорректный лимит {rate!r} для {scope}')
+    num, multiplier, unit = match.groups()
+    return int(num), int(multiplier or 1) * PERIODS[unit]
+
+
+def phone_ident(phone):
+    # Невалидный номер не считается: такой запрос все равно отклонит сериализатор
+    return phone if isinstance(phone, str) and is_valid_phone(phone) else None
+
+
+def _keys(scope, ident, duration, now):
+    # Скользящее окно приближается двумя соседними фиксированными окнами:
+    # запросы прошлого окна учитываются с весом, убывающим по мере сдвига текущего
+    window = int(now // duration)
+    return f'throttle_{scope}_{ident}_{window}', f'throttle_{scope}_{ident}_{window - 1}'
+
+
+def _wait(scope, num_requests, duration, now, count, previous):
+    weight = 1 - (now % duration) / duration
+    if count + previous * weight <= num_requests:
+        return None
+    throttled_requests.inc(scope=scope)
+    return math.ceil(duration - now % duration)
+
+
+def throttle_wait(scope, ident):
+    # Засчитывает запрос и возвращает, сколько секунд ждать, если лимит превышен, иначе None.
+    # Три обращения к кэшу и никаких запросов к БД
+    num_requests, duration = get_rate(scope)
+    if num_requests is None or not ident:
+        return None
+
+    now = time.time()
+    key, previous_key = _keys(scope, ident, duration, now)
+    throttle_cache.add(key, 0, timeout=duration * 2)
+    try:
+        count = throttle_cache.incr(key)
+    except ValueError:
+        # Ключ истек между add и incr
+        throttle_cache.set(key, 1, timeout=duration * 2)
+        count = 1
+    return _wait(scope, num_requests, duration, now, count, throttle_cache.get(previous_key, 0))
+
+
+async def athrottle_wait(scope, ident):
+    num_requests, duration = get_rate(scope)
+    if num_requests is None or not ident:
+        return None
+
+    now = time.time()
+    key, previous_key = _keys(scope, ident, duration, now)
+    await throttle_cache.aadd(key, 0, timeout=duration * 2)
+    try:
+        count = await throttle_cache.aincr(key)
+    except ValueError:
+        await throttle_cache.aset(key, 1, timeout=duration * 2)
+        count = 1
+    return _wait(scope, num_requests, duration, now, count, await throttle_cache.aget(previous_key, 0))
+
+
+def client_ip(request):
+    return BaseThrottle().get_ident(request)
+
+
+def check_rates(request, scope, phone):
+    # Проверка лимитов по номеру и по IP для представлений вне DRF.
+    # Возвращает время ожидания в секундах или None
+    waits = [throttle_wait(f'{scope}_phone', phone_ident(phone)), throttle_wait(f'{scope}_ip', client_ip(request))]
+    waits = [wait for wait in waits if wait is not None]
+    return max(waits) if waits else None
+
+
+async def acheck_rates(request, scope, phone):
+    waits = [
+        await athrottle_wait(f'{scope}_phone', phone_ident(phone)),
+        await athrottle_wait(f'{scope}_ip', client_ip(request)),
+    ]
+    waits = [wait for wait in waits if wait is not None]
+    return max(waits) if waits else None
+
+
+class SlidingWindowThrottle(BaseThrottle):
+    # Лимит берется из DEFAULT_THROTTLE_RATES по ключу '<throttle_scope представления>_<suffix>'
+    suffix = None
+
+    def get_ident_value(self, request):
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        self.wait_seconds = throttle_wait(f'{view.throttle_scope}_{self.suffix}', self.get_ident_value(request))
+        return self.wait_seconds is None
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class PhoneRateThrottle(SlidingWindowThrottle):
+    # По номеру телефона из тела запроса: защищает конкретный номер от подбора кода
+    suffix = 'phone'
+
+    def get_ident_value(self, request):
+        return phone_ident(request.data.get('phone') if hasattr(request.data, 'get') else None)
+
+
+class IPRateThrottle(SlidingWindowThrottle):
+    # По IP клиента: не дает одному источнику перебирать номера
+    suffix = 'ip'
+
+    def get_ident_value(self, request):
+        return self.get_ident(request)
@@ -1,18 +1,33 @@
 from django.urls import path
-from drf_spectacular.views import SpectacularRedocView, SpectacularAPIView
 
-from . import api_views, template_views
+from . import api_views, async_views, docs_views, template_views
 
 urlpatterns = [
     # API эндпоинты
     path('api/request-code/', api_views.RequestCodeView.as_view(), name='api_request_code'),
     path('api/verify-code/', api_views.VerifyCodeView.as_view(), name='api_verify_code'),
     path('api/profile/', api_views.ProfileView.as_view(), name='api_profile'),
+    path('api/referrals/', api_views.ReferralListView.as_view(), name='api_referrals'),
+    path('api/referrals/tree/', api_views.ReferralTreeView.as_view(), name='api_referral_tree'),
+    path('api/leaderboard/', api_views.LeaderboardView.as_view(), name='api_leaderboard'),
     path('api/activate-invite-code/', api_views.ActivateInviteCodeView.as_view(), name='api_activate_invite_code'),
+    path('api/internal/profiles/', api_views.BatchProfilesView.as_view(), name='api_batch_profiles'),
+    path('api/admin/referrals/export/', api_views.ReferralExportView.as_view(), name='api_referral_export'),
+    path('api/metrics/', api_views.MetricsView.as_view(), name='api_metrics'),
+
+    # Асинхронные варианты API эндпоинтов (для запуска под ASGI-сервером)
+    path('api/async/request-code/', async_views.RequestCodeView.as_view(), name='api_async_request_code'),
+    path('api/async/verify-code/', async_views.VerifyCodeView.as_view(), name='api_async_verify_code'),
+    path('api/async/profile/', async_views.ProfileView.as_view(), name='api_async_profile'),
+    path(
+        'api/async/activate-invite-code/',
+        async_views.ActivateInviteCodeView.as_view(),
+        name='api_async_activate_invite_code'
+    ),
 
     # Документация API
-    path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
-    path('api/schema/redoc/', SpectacularRedocView.as_view(url_name='schema'), name='redoc'),
+    path('api/schema/', docs_views.SchemaView.as_view(), name='schema'),
+    path('api/schema/redoc/', docs_views.RedocView.as_view(), name='redoc'),
 
     # Веб интерфейс
     path('login-phone/', template_views.LoginPhoneView.as_view(), name='login_phone'),
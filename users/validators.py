@@ -0,0 +1,7 @@
+import re
+
+PHONE_RE = re.compile(r'^\+7\d{10}$')
+
+
+def is_valid_phone(value):
+    return bool(PHONE_RE.match(value))